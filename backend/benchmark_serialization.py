@@ -0,0 +1,98 @@
+"""Compara la serialización del listado de facturas: modelos pydantic + response_model vs. FastJSONResponse
+
+Uso (desde backend/):
+
+    python benchmark_serialization.py [--filas 1000 10000 100000] [--repeticiones 3]
+
+No usa la base de datos: genera documentos con la forma que guarda la
+aplicación y mide solo la conversión a bytes de GET /api/invoices/{empresa_id}.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+# server.py exige estas variables al importarse; el benchmark no se conecta
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'benchmark')
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+
+import server
+from fast_json import FastJSONResponse, orjson
+
+
+def make_documents(count):
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    documents = []
+    for i in range(count):
+        creada = base + timedelta(minutes=i)
+        documents.append(server.prepare_for_mongo({
+            'id': str(uuid.uuid4()),
+            'empresa_id': 'empresa-benchmark',
+            'numero_factura': f"F-{i:06d}",
+            'numero_contrato': None if i % 3 else f"C-{i}",
+            'nombre_proveedor': f"Proveedor Ñandú {i % 200}",
+            'fecha_factura': (base + timedelta(days=i % 365)).strftime('%Y-%m-%d'),
+            'monto': round(100 + i * 1.37, 2),
+            'estado_pago': 'pendiente' if i % 2 else 'pagado',
+            'fecha_creacion': creada,
+            'archivo_pdf': f"{uuid.uuid4()}.pdf",
+            'archivo_original': f"factura_{i}.pdf"
+        }))
+    return documents
+
+
+def invoices_response_field():
+    for route in server.app.routes:
+        if getattr(route, 'path', None) == '/api/invoices/{empresa_id}' and 'GET' in route.methods:
+            return route.response_field
+    raise RuntimeError("No se encontró la ruta GET /api/invoices/{empresa_id}")
+
+
+def model_path(documents, field):
+    """Lo que hacía el endpoint: un Invoice por documento, validación de response_model y json.dumps"""
+    invoices = [server.Invoice(**server.parse_from_mongo(dict(doc))) for doc in documents]
+    content = asyncio.run(serialize_response(field=field, response_content=invoices))
+    return JSONResponse(content).body
+
+
+def fast_path(documents):
+    return FastJSONResponse([server.invoice_document(doc) for doc in documents]).body
+
+
+def best_time(func, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        body = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de serialización del listado de facturas")
+    parser.add_argument("--filas", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+
+    field = invoices_response_field()
+    print(f"Codificador rápido: {'orjson' if orjson is not None else 'json (orjson no instalado)'}")
+    print(f"{'filas':>8} {'modelos (ms)':>14} {'rápido (ms)':>13} {'mejora':>8} {'KB':>8}")
+    for count in args.filas:
+        documents = make_documents(count)
+        slow_seconds, slow_body = best_time(lambda: model_path(documents, field), args.repeticiones)
+        fast_seconds, fast_body = best_time(lambda: fast_path(documents), args.repeticiones)
+        if json.loads(slow_body) != json.loads(fast_body):
+            raise SystemExit(f"Las respuestas no coinciden con {count} filas")
+        print(f"{count:>8} {slow_seconds * 1000:>14.1f} {fast_seconds * 1000:>13.1f} "
+              f"{slow_seconds / fast_seconds:>7.1f}x {len(fast_body) / 1024:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
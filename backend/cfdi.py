@@ -0,0 +1,93 @@
+import contextlib
+import os
+
+import defusedxml.ElementTree as ET
+from defusedxml import DefusedXmlException
+
+
+class CfdiError(ValueError):
+    """El XML no es un CFDI válido o le faltan datos obligatorios"""
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def parse_cfdi(source):
+    """Lee los datos de la factura de un CFDI (3.3 / 4.0) con iterparse
+
+    `source` puede ser una ruta o un archivo binario. El parseo se detiene en cuanto
+    se tienen Comprobante y Emisor, así que no recorre conceptos ni complementos
+    salvo que falte el Folio y haya que usar el UUID del timbre.
+    """
+    comprobante = None
+    emisor = None
+    uuid_timbre = None
+
+    # Con una ruta el archivo se cierra aunque el parseo termine antes con break
+    opened = open(source, 'rb') if isinstance(source, (str, bytes, os.PathLike)) else contextlib.nullcontext(source)
+    try:
+        with opened as xml_file:
+            # defusedxml rechaza entidades (billion laughs) y referencias externas
+            for _, elem in ET.iterparse(xml_file, events=("start",)):
+                name = _local_name(elem.tag)
+                if name == 'Comprobante' and comprobante is None:
+                    comprobante = dict(elem.attrib)
+                elif name == 'Emisor' and emisor is None:
+                    emisor = dict(elem.attrib)
+                elif name == 'TimbreFiscalDigital':
+                    uuid_timbre = elem.attrib.get('UUID')
+
+                if comprobante is not None and emisor is not None and (comprobante.get('Folio') or uuid_timbre):
+                    break
+    except ET.ParseError as e:
+        raise CfdiError(f"XML mal formado: {str(e)}")
+    except DefusedXmlException:
+        raise CfdiError("El XML contiene entidades o DTD no permitidos")
+
+    if comprobante is None:
+        raise CfdiError("El XML no contiene un nodo Comprobante")
+    if emisor is None or not emisor.get('Nombre'):
+        raise CfdiError("El CFDI no contiene el nombre del Emisor")
+
+    folio = comprobante.get('Folio')
+    serie = comprobante.get('Serie')
+    if folio:
+        numero_factura = f"{serie}-{folio}" if serie else folio
+    elif uuid_timbre:
+        numero_factura = uuid_timbre
+    else:
+        raise CfdiError("El CFDI no contiene Folio ni UUID")
+
+    try:
+        monto = float(comprobante['Total'])
+    except (KeyError, ValueError):
+        raise CfdiError("El CFDI no contiene un Total válido")
+
+    fecha = comprobante.get('Fecha', '')
+    if len(fecha) < 10:
+        raise CfdiError("El CFDI no contiene una Fecha válida")
+
+    return {
+        'numero_factura': numero_factura,
+        'nombre_proveedor': emisor['Nombre'].strip(),
+        'fecha_factura': fecha[:10],
+        'monto': monto,
+        'rfc_emisor': emisor.get('Rfc'),
+        'uuid': uuid_timbre
+    }
+
+
+def compare_with_invoice(cfdi_data, invoice, tolerancia=0.01):
+    """Compara monto y fecha de una factura existente contra su CFDI"""
+    diferencias = []
+
+    monto_factura = float(invoice.get('monto') or 0)
+    if abs(monto_factura - cfdi_data['monto']) > tolerancia:
+        diferencias.append({"campo": "monto", "factura": monto_factura, "xml": cfdi_data['monto']})
+
+    fecha_factura = str(invoice.get('fecha_factura') or '')[:10]
+    if fecha_factura != cfdi_data['fecha_factura']:
+        diferencias.append({"campo": "fecha_factura", "factura": fecha_factura, "xml": cfdi_data['fecha_factura']})
+
+    return {"coincide": not diferencias, "diferencias": diferencias}
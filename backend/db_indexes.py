@@ -0,0 +1,92 @@
+import logging
+
+from pymongo import ASCENDING
+
+
+# Índices que la aplicación necesita, por colección. Las consultas por `id` y
+# los listados por empresa dependen de ellos para no recorrer toda la colección.
+REQUIRED_INDEXES = {
+    "empresas": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+    ],
+    "invoices": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("empresa_id", ASCENDING), ("nombre_proveedor", ASCENDING)]},
+        # Listados: cada índice sirve a un filtro de igualdad más un orden o rango,
+        # terminando en id para desempatar la paginación por keyset. Los prefijos
+        # cubren también (empresa_id, estado_pago) y (empresa_id, fecha_creacion).
+        {"keys": [("empresa_id", ASCENDING), ("fecha_creacion", ASCENDING), ("id", ASCENDING)]},
+        {"keys": [("empresa_id", ASCENDING), ("estado_pago", ASCENDING), ("fecha_creacion", ASCENDING), ("id", ASCENDING)]},
+        {"keys": [("empresa_id", ASCENDING), ("fecha_factura", ASCENDING), ("id", ASCENDING)]},
+        {"keys": [("empresa_id", ASCENDING), ("estado_pago", ASCENDING), ("fecha_factura", ASCENDING), ("id", ASCENDING)]},
+        {"keys": [("empresa_id", ASCENDING), ("monto", ASCENDING), ("id", ASCENDING)]},
+        # Búsqueda por prefijo, autocompletado y orden por proveedor
+        {"keys": [("empresa_id", ASCENDING), ("proveedor_normalizado", ASCENDING), ("id", ASCENDING)]},
+    ],
+}
+
+
+def _normalize_keys(keys):
+    # Índices creados desde la shell pueden traer la dirección como double (1.0)
+    return tuple((field, int(direction) if isinstance(direction, (int, float)) else direction) for field, direction in keys)
+
+
+def _options(spec):
+    return {name: value for name, value in spec.items() if name != "keys"}
+
+
+def _existing_options(info):
+    options = {}
+    for name in ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression"):
+        if info.get(name) not in (None, False):
+            options[name] = info[name]
+    return options
+
+
+async def ensure_indexes(db, required=REQUIRED_INDEXES):
+    """Crea los índices declarados que falten; un índice que no se pueda crear no detiene el arranque"""
+    errors = []
+    for collection_name, specs in required.items():
+        for spec in specs:
+            try:
+                await db[collection_name].create_index(spec["keys"], **_options(spec))
+            except Exception as e:
+                # P. ej. ids duplicados impiden el índice único: se reporta en /api/admin/indexes
+                logging.error(f"No se pudo crear el índice {spec['keys']} en {collection_name}: {str(e)}")
+                errors.append({"coleccion": collection_name, "indice": spec["keys"], "error": str(e)})
+    return errors
+
+
+async def index_drift(db, required=REQUIRED_INDEXES):
+    """Compara los índices declarados con los existentes
+
+    Por colección devuelve los que faltan, los que existen con otras opciones
+    (p. ej. sin `unique`) y los que existen sin estar declarados.
+    """
+    report = {}
+    for collection_name, specs in required.items():
+        existing = await db[collection_name].index_information()
+        existing_by_keys = {
+            _normalize_keys(info["key"]): (name, info)
+            for name, info in existing.items()
+            if name != "_id_"
+        }
+
+        faltantes, diferentes = [], []
+        for spec in specs:
+            keys = _normalize_keys(spec["keys"])
+            if keys not in existing_by_keys:
+                faltantes.append({"keys": [list(k) for k in keys], **_options(spec)})
+                continue
+            name, info = existing_by_keys.pop(keys)
+            actual = _existing_options(info)
+            if actual != _options(spec):
+                diferentes.append({"nombre": name, "esperado": _options(spec), "actual": actual})
+
+        sobrantes = [name for name, _info in existing_by_keys.values()]
+        report[collection_name] = {"faltantes": faltantes, "diferentes": diferentes, "sobrantes": sobrantes}
+
+    return {
+        "sin_drift": all(not (r["faltantes"] or r["diferentes"] or r["sobrantes"]) for r in report.values()),
+        "colecciones": report
+    }
@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+
+class EmpresaCache:
+    """Empresas activas en memoria durante `ttl_seconds`
+
+    Son pocas y casi todas las peticiones buscan una, así que se cargan todas
+    juntas. Las altas, cambios y bajas hechas en este proceso la invalidan; las
+    de otros procesos se ven al vencer el TTL. Un id que no está en la caché
+    siempre se confirma en Mongo, así que una empresa nueva nunca da 404.
+    """
+
+    def __init__(self, collection, ttl_seconds=30):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self._empresas = None  # id -> documento, en el orden de Mongo
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self):
+        self._empresas = None
+        self._generation += 1
+
+    def _fresh(self):
+        return self._empresas is not None and time.monotonic() - self._loaded_at < self.ttl_seconds
+
+    async def _load(self):
+        async with self._lock:
+            # Otra petición pudo recargarla mientras se esperaba el lock
+            if self._fresh():
+                return self._empresas
+            generation = self._generation
+            documents = await self.collection.find({"activa": True}, {"_id": 0}).to_list(1000)
+            empresas = {doc["id"]: doc for doc in documents}
+            # Si se invalidó durante la consulta, el resultado puede estar viejo: no se guarda
+            if generation == self._generation:
+                self._empresas = empresas
+                self._loaded_at = time.monotonic()
+            return empresas
+
+    async def _current(self):
+        if self._fresh():
+            self.hits += 1
+            return self._empresas
+        self.misses += 1
+        return await self._load()
+
+    async def all(self):
+        """Empresas activas (copias: quien las reciba puede modificarlas)"""
+        if self.ttl_seconds <= 0:
+            return await self.collection.find({"activa": True}, {"_id": 0}).to_list(1000)
+        return [dict(doc) for doc in (await self._current()).values()]
+
+    async def get(self, empresa_id):
+        """Empresa activa con ese id, o None"""
+        if self.ttl_seconds <= 0:
+            return await self.collection.find_one({"id": empresa_id, "activa": True}, {"_id": 0})
+        empresa = (await self._current()).get(empresa_id)
+        if empresa is not None:
+            return dict(empresa)
+        # Puede haberse creado en otro proceso después de la última carga
+        empresa = await self.collection.find_one({"id": empresa_id, "activa": True}, {"_id": 0})
+        if empresa is not None:
+            self.invalidate()
+        return empresa
+
+    def stats(self):
+        return {
+            "ttl_segundos": self.ttl_seconds,
+            "empresas": len(self._empresas) if self._fresh() else None,
+            "aciertos": self.hits,
+            "fallos": self.misses
+        }
@@ -2,6 +2,7 @@ from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill, Alignment
 from datetime import datetime
 import io
+from invoice_fields import parse_fecha_factura, to_centavos, centavos_to_monto
 
 def create_invoices_excel(invoices, estado_filter, empresa_nombre):
     """Crea un archivo Excel con las facturas filtradas"""
@@ -60,14 +61,11 @@ def create_invoices_excel(invoices, estado_filter, empresa_nombre):
         ws.cell(row=row, column=2, value=invoice.get('numero_contrato', '') or 'Sin asignar')
         ws.cell(row=row, column=3, value=invoice.get('nombre_proveedor', ''))
         
-        # Formatear fecha
-        fecha_str = invoice.get('fecha_factura', '')
-        if fecha_str:
-            try:
-                fecha_obj = datetime.fromisoformat(fecha_str.replace('Z', '+00:00')) if 'T' in fecha_str else datetime.strptime(fecha_str, '%Y-%m-%d')
-                ws.cell(row=row, column=4, value=fecha_obj.strftime('%d/%m/%Y'))
-            except:
-                ws.cell(row=row, column=4, value=fecha_str)
+        # Formatear fecha (ya migrada es datetime; texto en facturas sin migrar)
+        fecha = invoice.get('fecha_factura', '')
+        if fecha:
+            fecha_obj = parse_fecha_factura(fecha)
+            ws.cell(row=row, column=4, value=fecha_obj.strftime('%d/%m/%Y') if fecha_obj else fecha)
         
         # Formatear monto
         monto = invoice.get('monto', 0)
@@ -89,7 +87,7 @@ def create_invoices_excel(invoices, estado_filter, empresa_nombre):
         ws[f'A{total_row}'].font = Font(bold=True)
         ws[f'A{total_row}'].alignment = Alignment(horizontal="right")
         
-        total_monto = sum(invoice.get('monto', 0) for invoice in invoices)
+        total_monto = centavos_to_monto(sum(invoice.get('monto_centavos') or to_centavos(invoice.get('monto', 0)) or 0 for invoice in invoices))
         ws[f'E{total_row}'] = f"${total_monto:,.2f}"
         ws[f'E{total_row}'].font = Font(bold=True)
     
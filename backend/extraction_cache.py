@@ -0,0 +1,82 @@
+import logging
+from datetime import datetime, timezone
+
+
+CACHED_FIELDS = ['numero_factura', 'nombre_proveedor', 'fecha_factura', 'monto']
+
+
+class ExtractionCache:
+    """Caché de datos extraídos de PDFs, indexada por hash del archivo y versión del prompt"""
+
+    def __init__(self, collection, prompt_version):
+        self.collection = collection
+        self.prompt_version = prompt_version
+        self.hits = 0
+        self.misses = 0
+        self.llm_seconds_spent = 0.0
+        self.llm_seconds_saved = 0.0
+        self.errors = 0
+
+    def _key(self, sha256):
+        return f"{sha256}:{self.prompt_version}"
+
+    async def get(self, sha256):
+        """Devuelve los datos extraídos previamente o None si no hay entrada
+
+        Si Mongo falla se trata como un miss: la caché nunca debe romper una extracción.
+        """
+        try:
+            doc = await self.collection.find_one({"_id": self._key(sha256)})
+        except Exception as e:
+            self.errors += 1
+            self.misses += 1
+            logging.warning(f"No se pudo leer la caché de extracciones: {str(e)}")
+            return None
+        if not doc:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.llm_seconds_saved += doc.get('llm_seconds', 0.0)
+        try:
+            await self.collection.update_one(
+                {"_id": doc['_id']},
+                {"$inc": {"hits": 1}, "$set": {"ultimo_uso": datetime.now(timezone.utc)}}
+            )
+        except Exception as e:
+            logging.warning(f"No se pudo registrar el uso de la caché de extracciones: {str(e)}")
+        return {field: doc['data'].get(field) for field in CACHED_FIELDS}
+
+    async def put(self, sha256, data, llm_seconds):
+        """Guarda el resultado de una extracción exitosa"""
+        self.llm_seconds_spent += llm_seconds
+        try:
+            await self.collection.update_one(
+                {"_id": self._key(sha256)},
+                {"$setOnInsert": {
+                    "sha256": sha256,
+                    "prompt_version": self.prompt_version,
+                    "data": {field: data.get(field) for field in CACHED_FIELDS},
+                    "llm_seconds": llm_seconds,
+                    "hits": 0,
+                    "fecha_creacion": datetime.now(timezone.utc)
+                }},
+                upsert=True
+            )
+        except Exception as e:
+            # La caché nunca debe romper una carga exitosa
+            self.errors += 1
+            logging.warning(f"No se pudo guardar la extracción en caché: {str(e)}")
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "prompt_version": self.prompt_version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "llm_calls_saved": self.hits,
+            "llm_seconds_spent": round(self.llm_seconds_spent, 3),
+            "llm_seconds_saved": round(self.llm_seconds_saved, 3),
+            "errors": self.errors
+        }
@@ -0,0 +1,244 @@
+import abc
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import time
+from collections import deque
+from datetime import datetime
+
+import storage
+from latency import span
+from llm_client import CircuitOpenError, LlmError, estimate_request_tokens
+from local_extractor import extract_invoice_from_pdf
+
+
+REQUIRED_FIELDS = ('numero_factura', 'nombre_proveedor', 'fecha_factura', 'monto')
+
+
+class Extractor(abc.ABC):
+    """Interfaz de los backends de extracción de datos de facturas
+
+    `extract(file_path)` devuelve un dict con los campos de la factura (los que
+    no encuentre, en None). Errores del proveedor se reportan con LlmError y una
+    respuesta ilegible con json.JSONDecodeError.
+
+    - `cacheable`: el resultado puede guardarse en la caché de extracciones.
+    - `preprocess`: conviene la pasada local, el recorte de páginas y la
+      normalización de imágenes antes de llamarlo (backends remotos o que los simulan).
+    """
+
+    name = "base"
+    cacheable = False
+    preprocess = False
+
+    @abc.abstractmethod
+    async def extract(self, file_path: str) -> dict:
+        """Extrae los datos de la factura en `file_path`"""
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+def parse_llm_json(text):
+    """Convierte la respuesta del modelo en dict, quitando el bloque ```json si viene"""
+    response_text = text.strip()
+    if response_text.startswith('```json'):
+        response_text = response_text.replace('```json', '').replace('```', '').strip()
+    return json.loads(response_text)
+
+
+class GeminiExtractor(Extractor):
+    """Extracción con Gemini a través del ExtractionClient compartido"""
+
+    name = "gemini"
+    cacheable = True
+    preprocess = True
+
+    def __init__(self, client, prompt, model=None):
+        self.client = client
+        self.prompt = prompt
+        self.model = model
+
+    async def extract(self, file_path):
+        # Cuota compartida, plazo, reintentos y circuit breaker los maneja el cliente
+        file_stat = await storage.stat(file_path)
+        tokens = estimate_request_tokens(self.prompt, file_stat.st_size if file_stat else 0)
+        with span("llm"):
+            response = await self.client.extract(self.prompt, file_path, model=self.model, tokens=tokens)
+
+        with span("parseo_json"):
+            return parse_llm_json(response)
+
+    def stats(self):
+        return {"backend": self.name, **self.client.stats()}
+
+
+class LocalTextExtractor(Extractor):
+    """Extracción solo con la capa de texto del PDF, sin red ni costo"""
+
+    name = "local-text"
+
+    async def extract(self, file_path):
+        with span("extraccion_local"):
+            data, _confidence = await storage.run_io(extract_invoice_from_pdf, file_path)
+        return data
+
+
+class StubExtractor(Extractor):
+    """Backend simulado para pruebas de carga sin red
+
+    Devuelve datos fijos (el número de factura se deriva del nombre del archivo
+    para no repetirlo), tras esperar `latency` segundos (± `jitter`), y falla con
+    LlmError con probabilidad `error_rate`. Con `seed` la secuencia es reproducible.
+    """
+
+    name = "stub"
+    preprocess = True
+
+    def __init__(self, latency=0.5, jitter=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.errors = 0
+
+    async def extract(self, file_path):
+        self.calls += 1
+        with span("llm"):
+            delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.random.random() < self.error_rate:
+                self.errors += 1
+                raise LlmError("Error simulado del extractor de prueba")
+
+        digest = hashlib.sha256(os.path.basename(file_path).encode()).hexdigest()
+        return {
+            "numero_factura": f"STUB-{digest[:8].upper()}",
+            "nombre_proveedor": "Proveedor de Prueba S.A.",
+            "fecha_factura": "2024-01-15",
+            "monto": 1160.0
+        }
+
+    def stats(self):
+        return {
+            "backend": self.name,
+            "latencia": self.latency,
+            "tasa_error": self.error_rate,
+            "llamadas": self.calls,
+            "errores": self.errors
+        }
+
+
+def validate_invoice_fields(data):
+    """Problemas que impiden aceptar una extracción: campos faltantes, fecha no YYYY-MM-DD o monto no numérico"""
+    if not isinstance(data, dict):
+        return ["respuesta no es un objeto"]
+    problems = [f"falta {field}" for field in REQUIRED_FIELDS if data.get(field) in (None, "")]
+    fecha = data.get("fecha_factura")
+    if fecha not in (None, ""):
+        try:
+            datetime.strptime(str(fecha), "%Y-%m-%d")
+        except ValueError:
+            problems.append(f"fecha_factura con formato inválido: {fecha}")
+    monto = data.get("monto")
+    if monto not in (None, ""):
+        try:
+            if isinstance(monto, bool) or not math.isfinite(float(monto)):
+                raise ValueError
+        except (TypeError, ValueError):
+            problems.append(f"monto no numérico: {monto}")
+    return problems
+
+
+class CascadeTier:
+    """Un nivel de la cascada con sus métricas"""
+
+    def __init__(self, name, extractor, cost_per_million_tokens=0.0):
+        self.name = name
+        self.extractor = extractor
+        self.cost_per_million_tokens = cost_per_million_tokens
+        self.calls = 0
+        self.successes = 0
+        self.seconds = 0.0
+        self.tokens = 0
+        self.latencies = deque(maxlen=500)
+
+    def stats(self):
+        ordered = sorted(self.latencies)
+        return {
+            "modelo": self.name,
+            "llamadas": self.calls,
+            "exitos": self.successes,
+            "tasa_exito": round(self.successes / self.calls, 4) if self.calls else 0.0,
+            "latencia_media_ms": round(self.seconds / self.calls * 1000, 1) if self.calls else 0.0,
+            "latencia_p95_ms": round(ordered[int(0.95 * (len(ordered) - 1))] * 1000, 1) if ordered else 0.0,
+            "tokens_estimados": self.tokens,
+            "costo_estimado_usd": round(self.tokens * self.cost_per_million_tokens / 1_000_000, 6)
+        }
+
+
+class CascadeExtractor(Extractor):
+    """Prueba los modelos del más barato al más capaz y escala solo si la extracción no valida
+
+    Una respuesta se acepta si trae los cuatro campos, la fecha en YYYY-MM-DD y
+    un monto numérico. Respuestas ilegibles o errores del modelo también escalan;
+    con el circuito abierto no tiene sentido probar otro modelo del mismo proveedor.
+    El último nivel devuelve lo que obtenga y la validación final decide.
+    """
+
+    name = "cascada"
+    cacheable = True
+    preprocess = True
+
+    def __init__(self, tiers, prompt=""):
+        self.tiers = tiers
+        self.prompt = prompt
+        self.escalations = 0
+
+    async def extract(self, file_path):
+        file_stat = await storage.stat(file_path)
+        tokens = estimate_request_tokens(self.prompt, file_stat.st_size if file_stat else 0)
+
+        for index, tier in enumerate(self.tiers):
+            is_last = index == len(self.tiers) - 1
+            tier.calls += 1
+            tier.tokens += tokens
+            started = time.perf_counter()
+            try:
+                data = await tier.extractor.extract(file_path)
+                problems = validate_invoice_fields(data)
+            except CircuitOpenError:
+                raise
+            except (LlmError, json.JSONDecodeError) as e:
+                if is_last:
+                    raise
+                problems = [str(e) or type(e).__name__]
+                data = None
+            finally:
+                elapsed = time.perf_counter() - started
+                tier.seconds += elapsed
+                tier.latencies.append(elapsed)
+
+            if not problems:
+                tier.successes += 1
+                return data
+            if is_last:
+                return data
+            self.escalations += 1
+            logging.info(f"Extracción con {tier.name} no válida ({'; '.join(problems)}), escalando a {self.tiers[index + 1].name}")
+
+    def stats(self):
+        first = self.tiers[0].extractor
+        stats = first.stats() if isinstance(first, GeminiExtractor) else {}
+        stats.update({
+            "backend": self.name,
+            "escalamientos": self.escalations,
+            "niveles": [tier.stats() for tier in self.tiers]
+        })
+        return stats
@@ -0,0 +1,37 @@
+import json
+from datetime import datetime, timezone
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional: sin él se usa json de la biblioteca estándar
+    orjson = None
+
+
+# Serialización directa a bytes para respuestas grandes armadas con documentos
+# de Mongo confiables: evita crear un modelo por documento y la segunda
+# validación de response_model. Produce el mismo JSON que los modelos pydantic
+# (fechas UTC con "Z", sin espacios).
+
+def _default(value):
+    if isinstance(value, datetime):
+        text = value.isoformat()
+        if value.utcoffset() == timezone.utc.utcoffset(None):
+            text = text[:-6] + "Z"
+        return text
+    # ObjectId, Decimal128, etc.
+    return str(value)
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=str, option=orjson.OPT_UTC_Z)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
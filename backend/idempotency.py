@@ -0,0 +1,291 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from datetime import datetime, timezone, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+
+IDEMPOTENCY_HEADER = b"idempotency-key"
+IDEMPOTENT_METHODS = ("POST", "PUT")
+
+
+def _json_error(status, detail):
+    body = json.dumps({"detail": detail}, ensure_ascii=False).encode()
+    return status, [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())], body
+
+
+class RequestFingerprint:
+    """Huella de una petición (método, ruta, query y cuerpo), calculada por bloques
+
+    En multipart/form-data no se usan los bytes crudos: cada envío del mismo
+    formulario lleva un boundary aleatorio distinto. Se usan las partes ya
+    separadas: nombre del campo, nombre de archivo, tipo y SHA-256 del contenido.
+    """
+
+    def __init__(self, scope):
+        self.digest = hashlib.sha256()
+        self.digest.update(scope["method"].encode())
+        self.digest.update(scope["path"].encode())
+        self.digest.update(scope.get("query_string", b""))
+        self.parser = None
+
+        content_type = dict(scope["headers"]).get(b"content-type", b"")
+        mime, params = parse_options_header(content_type)
+        if mime == b"multipart/form-data" and params.get(b"boundary"):
+            self._part_headers = {}
+            self._header_field = bytearray()
+            self._header_value = bytearray()
+            self._part_digest = None
+            self.parser = MultipartParser(params[b"boundary"], {
+                "on_part_begin": self._on_part_begin,
+                "on_header_field": lambda data, start, end: self._header_field.extend(data[start:end]),
+                "on_header_value": lambda data, start, end: self._header_value.extend(data[start:end]),
+                "on_header_end": self._on_header_end,
+                "on_part_data": lambda data, start, end: self._part_digest.update(data[start:end]),
+                "on_part_end": self._on_part_end,
+            })
+
+    def _on_part_begin(self):
+        self._part_headers = {}
+        self._part_digest = hashlib.sha256()
+
+    def _on_header_end(self):
+        name = bytes(self._header_field).strip().lower()
+        value = bytes(self._header_value).strip()
+        if name == b"content-disposition":
+            # El orden de name/filename puede variar entre clientes
+            disposition, options = parse_options_header(value)
+            value = disposition + b";" + b";".join(k + b"=" + options[k] for k in sorted(options))
+        self._part_headers[name] = value
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+
+    def _on_part_end(self):
+        for name in (b"content-disposition", b"content-type"):
+            self.digest.update(name + b":" + self._part_headers.get(name, b"") + b"\n")
+        self.digest.update(self._part_digest.digest())
+
+    def update(self, chunk):
+        if self.parser is None:
+            self.digest.update(chunk)
+            return
+        try:
+            self.parser.write(chunk)
+        except Exception:
+            # Multipart mal formado: el resto del cuerpo se compara byte a byte
+            self.parser = None
+            self.digest.update(b"multipart-invalido")
+            self.digest.update(chunk)
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+class IdempotencyStore:
+    """Claves de idempotencia en MongoDB: huella de la petición y respuesta guardada
+
+    El primer intento reserva la clave insertando un documento en estado
+    'procesando' (el _id único resuelve la carrera entre reintentos simultáneos).
+    Al terminar guarda la respuesta; los documentos expiran por índice TTL.
+    """
+
+    def __init__(self, collection, ttl_seconds=24 * 3600, lock_seconds=300):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.lock_seconds = lock_seconds
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expira", expireAfterSeconds=0)
+
+    async def reserve(self, record_id, key):
+        """Reserva la clave; devuelve None si la reservó o el documento existente"""
+        now = datetime.now(timezone.utc)
+        try:
+            await self.collection.insert_one({
+                "_id": record_id,
+                "clave": key,
+                "estado": "procesando",
+                "fecha_creacion": now,
+                "bloqueo_expira": now + timedelta(seconds=self.lock_seconds),
+                "expira": now + timedelta(seconds=self.ttl_seconds)
+            })
+            return None
+        except DuplicateKeyError:
+            existing = await self.collection.find_one({"_id": record_id})
+            if existing is None:
+                # Expiró entre el insert y la lectura
+                return await self.reserve(record_id, key)
+            return existing
+
+    async def take_over(self, record_id):
+        """Toma una clave cuyo primer intento murió sin terminar (bloqueo vencido)"""
+        now = datetime.now(timezone.utc)
+        taken = await self.collection.find_one_and_update(
+            {"_id": record_id, "estado": "procesando", "bloqueo_expira": {"$lt": now}},
+            {"$set": {"bloqueo_expira": now + timedelta(seconds=self.lock_seconds)}},
+            return_document=ReturnDocument.AFTER
+        )
+        return taken is not None
+
+    async def complete(self, record_id, fingerprint, status, headers, body):
+        await self.collection.update_one(
+            {"_id": record_id},
+            {"$set": {
+                "estado": "completado",
+                "huella": fingerprint,
+                "status": status,
+                "headers": headers,
+                "body": body,
+                "fecha_completado": datetime.now(timezone.utc)
+            }}
+        )
+
+    async def release(self, record_id):
+        await self.collection.delete_one({"_id": record_id, "estado": "procesando"})
+
+    async def wait_completed(self, record_id, timeout, poll_interval=0.2):
+        """Espera a que el intento original termine; devuelve el documento, o None si se liberó"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            record = await self.collection.find_one({"_id": record_id})
+            if record is None or record["estado"] == "completado":
+                return record
+            if record["bloqueo_expira"].replace(tzinfo=timezone.utc) < datetime.now(timezone.utc):
+                return record
+            await asyncio.sleep(poll_interval)
+        return await self.collection.find_one({"_id": record_id})
+
+
+class IdempotencyMiddleware:
+    """Middleware ASGI para el header Idempotency-Key en POST y PUT
+
+    - Primera petición con una clave: se ejecuta y se guarda su respuesta.
+    - Reintento con la misma clave y el mismo cuerpo: se devuelve la respuesta guardada
+      sin volver a ejecutar el endpoint (header Idempotent-Replayed: true).
+    - Reintento mientras el original sigue en curso: espera a que termine.
+    - Misma clave con otro cuerpo o ruta: 422.
+
+    La huella (RequestFingerprint) se calcula mientras el cuerpo fluye hacia el
+    endpoint, sin cargar uploads en memoria. Las respuestas 5xx no se guardan
+    para que el cliente pueda reintentar.
+    """
+
+    def __init__(self, app, store, excluded_paths=(), wait_seconds=60, max_response_bytes=1024 * 1024):
+        self.app = app
+        self.store = store
+        self.excluded_paths = set(excluded_paths)
+        self.wait_seconds = wait_seconds
+        self.max_response_bytes = max_response_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in IDEMPOTENT_METHODS or scope["path"] in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        key = headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            await self.app(scope, receive, send)
+            return
+
+        key = key.decode("latin-1")
+        # La clave vale por usuario (token) y endpoint: dos usuarios no comparten respuestas
+        record_id = hashlib.sha256(b"|".join([
+            headers.get(b"authorization", b""), scope["method"].encode(), scope["path"].encode(), key.encode("latin-1")
+        ])).hexdigest()
+
+        while True:
+            existing = await self.store.reserve(record_id, key)
+            if existing is None:
+                await self._execute(scope, receive, send, record_id)
+                return
+            if existing["estado"] == "procesando":
+                existing = await self.store.wait_completed(record_id, self.wait_seconds)
+                if existing is None:
+                    # El original falló y liberó la clave: este reintento la vuelve a reservar
+                    continue
+            if existing["estado"] == "completado":
+                await self._replay(scope, receive, send, existing)
+                return
+            if await self.store.take_over(record_id):
+                await self._execute(scope, receive, send, record_id)
+                return
+            await self._send(send, *_json_error(409, "La petición original con esta Idempotency-Key sigue en curso"))
+            return
+
+    async def _execute(self, scope, receive, send, record_id):
+        digest = RequestFingerprint(scope)
+        response = {"status": None, "headers": [], "body": bytearray(), "too_large": False}
+
+        async def hashing_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                digest.update(message.get("body", b""))
+            return message
+
+        async def capturing_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [
+                    (name.decode("latin-1"), value.decode("latin-1"))
+                    for name, value in message.get("headers", [])
+                    if name.lower() in (b"content-type", b"content-disposition")
+                ]
+            elif message["type"] == "http.response.body" and not response["too_large"]:
+                response["body"].extend(message.get("body", b""))
+                if len(response["body"]) > self.max_response_bytes:
+                    response["too_large"] = True
+                    response["body"] = bytearray()
+            await send(message)
+
+        try:
+            await self.app(scope, hashing_receive, capturing_send)
+        except BaseException:
+            await self.store.release(record_id)
+            raise
+
+        if response["status"] is None or response["status"] >= 500:
+            await self.store.release(record_id)
+            return
+        body = None if response["too_large"] else bytes(response["body"])
+        try:
+            await self.store.complete(record_id, digest.hexdigest(), response["status"], response["headers"], body)
+        except Exception as e:
+            logging.warning(f"No se pudo guardar la respuesta idempotente: {str(e)}")
+
+    async def _replay(self, scope, receive, send, record):
+        # Leer (y descartar) el cuerpo para comparar la huella con la del original
+        digest = RequestFingerprint(scope)
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                return
+            digest.update(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+
+        if digest.hexdigest() != record.get("huella"):
+            await self._send(send, *_json_error(422, "La Idempotency-Key ya se usó con otra petición"))
+            return
+        if record.get("body") is None:
+            await self._send(send, *_json_error(409, "La petición ya se procesó; su respuesta es demasiado grande para repetirla"))
+            return
+
+        body = bytes(record["body"])
+        headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in record.get("headers", [])]
+        headers.append((b"content-length", str(len(body)).encode()))
+        headers.append((b"idempotent-replayed", b"true"))
+        await self._send(send, record["status"], headers, body)
+
+    @staticmethod
+    async def _send(send, status, headers, body):
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
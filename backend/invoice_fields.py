@@ -0,0 +1,72 @@
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP, InvalidOperation
+
+
+# Tipos de almacenamiento de las facturas:
+# - fecha_factura: fecha BSON (medianoche UTC), para rangos y orden por índice.
+#   La API la sigue exponiendo como texto YYYY-MM-DD.
+# - monto_centavos: entero junto a `monto`; las sumas se hacen en centavos y no
+#   acumulan error de punto flotante. `monto` se conserva para la API y los filtros.
+
+FECHA_FORMATS = ("%Y-%m-%d", "%d/%m/%Y")
+
+
+def parse_fecha_factura(value):
+    """Convierte la fecha de una factura a datetime; None si no se reconoce el formato"""
+    if isinstance(value, datetime):
+        return datetime(value.year, value.month, value.day)
+    if not isinstance(value, str) or not value.strip():
+        return None
+    text = value.strip()
+    # ISO completo (2024-01-15T10:00:00Z): basta la parte de fecha
+    if len(text) > 10 and text[10] in "T ":
+        text = text[:10]
+    for fmt in FECHA_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def fecha_factura_str(value):
+    """Fecha de factura como texto YYYY-MM-DD para la API (acepta datos ya migrados o no)"""
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d")
+    return value
+
+
+def to_centavos(monto):
+    """Monto a centavos enteros redondeando al centavo (1.005 -> 101)"""
+    if monto is None:
+        return None
+    try:
+        return int((Decimal(str(monto)) * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+    except (InvalidOperation, ValueError):
+        return None
+
+
+def centavos_to_monto(centavos):
+    return round((centavos or 0) / 100, 2)
+
+
+# Centavos de una factura en un pipeline de agregación; las facturas aún no
+# migradas no tienen monto_centavos y se calculan desde `monto`
+MONTO_CENTAVOS_EXPR = {
+    "$ifNull": ["$monto_centavos", {"$toLong": {"$round": [{"$multiply": ["$monto", 100]}, 0]}}]
+}
+
+
+def typed_invoice_fields(doc):
+    """Campos tipados que le faltan a un documento de factura (para inserts y la migración)"""
+    updates = {}
+    fecha = doc.get("fecha_factura")
+    if isinstance(fecha, str):
+        parsed = parse_fecha_factura(fecha)
+        if parsed is not None:
+            updates["fecha_factura"] = parsed
+    if "monto" in doc:
+        centavos = to_centavos(doc["monto"])
+        if centavos is not None and doc.get("monto_centavos") != centavos:
+            updates["monto_centavos"] = centavos
+    return updates
@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timezone, timedelta
+
+from pymongo import ReturnDocument
+
+
+class PermanentJobError(Exception):
+    """Error que no se resuelve reintentando (p. ej. datos no extraíbles del PDF)"""
+
+
+class RetryLaterError(Exception):
+    """El trabajo no puede procesarse ahora (p. ej. circuito de IA abierto); se reencola sin gastar un intento"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class JobQueue:
+    """Cola de trabajos persistida en MongoDB con un pool de workers asíncronos
+
+    Los workers reclaman trabajos de forma atómica con find_one_and_update. Un
+    trabajo reclamado guarda un lease corto que el worker renueva mientras el
+    handler sigue corriendo (heartbeat); si el proceso muere, el lease vence en
+    `lease_seconds` y otro worker (o este mismo al reiniciar) vuelve a tomarlo.
+    """
+
+    def __init__(self, collection, handler, workers=2, lease_seconds=60, max_attempts=3, poll_interval=1.0, retry_backoff=10.0):
+        self.collection = collection
+        self.handler = handler
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = lease_seconds / 3
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.retry_backoff = retry_backoff
+        self.worker_id = f"worker-{uuid.uuid4()}"
+        self._tasks = []
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+
+    async def enqueue(self, tipo, payload):
+        """Crea un trabajo pendiente y despierta a los workers locales"""
+        now = datetime.now(timezone.utc)
+        job = {
+            "id": str(uuid.uuid4()),
+            "tipo": tipo,
+            "estado": "pendiente",
+            "payload": payload,
+            "intentos": 0,
+            "resultado": None,
+            "error": None,
+            "fecha_creacion": now,
+            "fecha_actualizacion": now,
+            "disponible_desde": now
+        }
+        await self.collection.insert_one(job)
+        self._wakeup.set()
+        return job
+
+    async def get(self, job_id):
+        return await self.collection.find_one({"id": job_id}, {"_id": 0})
+
+    async def claim(self):
+        """Reclama atómicamente el trabajo pendiente más antiguo o uno con lease vencido"""
+        now = datetime.now(timezone.utc)
+        return await self.collection.find_one_and_update(
+            {"$or": [
+                {"estado": "pendiente", "disponible_desde": {"$lte": now}},
+                {"estado": "pendiente", "disponible_desde": {"$exists": False}},
+                {"estado": "procesando", "lease_expira": {"$lt": now}}
+            ]},
+            {
+                "$set": {
+                    "estado": "procesando",
+                    "worker": self.worker_id,
+                    "lease_expira": now + timedelta(seconds=self.lease_seconds),
+                    "fecha_actualizacion": now
+                },
+                "$inc": {"intentos": 1}
+            },
+            sort=[("fecha_creacion", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _finish(self, job, estado, resultado=None, error=None, retry_after=0.0, refund_attempt=False):
+        now = datetime.now(timezone.utc)
+        update = {
+            "$set": {
+                "estado": estado,
+                "resultado": resultado,
+                "error": error,
+                "fecha_actualizacion": now,
+                "disponible_desde": now + timedelta(seconds=retry_after)
+            },
+            "$unset": {"lease_expira": ""}
+        }
+        if refund_attempt:
+            update["$inc"] = {"intentos": -1}
+        await self.collection.update_one({"id": job["id"], "worker": self.worker_id}, update)
+
+    async def _heartbeat(self, job):
+        """Renueva el lease del trabajo mientras el handler sigue corriendo"""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                renewed = await self.collection.update_one(
+                    {"id": job["id"], "worker": self.worker_id, "estado": "procesando"},
+                    {"$set": {"lease_expira": datetime.now(timezone.utc) + timedelta(seconds=self.lease_seconds)}}
+                )
+                if renewed.matched_count == 0:
+                    logging.warning(f"Trabajo {job['id']}: el lease ya no pertenece a este worker")
+                    return
+            except Exception as e:
+                logging.warning(f"No se pudo renovar el lease del trabajo {job['id']}: {str(e)}")
+
+    async def _run_handler(self, job):
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            return await self.handler(job)
+        finally:
+            heartbeat.cancel()
+
+    async def run_job(self, job):
+        try:
+            resultado = await self._run_handler(job)
+            await self._finish(job, "completado", resultado=resultado)
+        except PermanentJobError as e:
+            logging.warning(f"Trabajo {job['id']} falló: {str(e)}")
+            await self._finish(job, "error", error=str(e))
+        except RetryLaterError as e:
+            logging.info(f"Trabajo {job['id']} reencolado por {e.retry_after:.0f}s: {str(e)}")
+            await self._finish(job, "pendiente", error=str(e), retry_after=e.retry_after, refund_attempt=True)
+        except Exception as e:
+            logging.error(f"Error procesando trabajo {job['id']} (intento {job['intentos']}): {str(e)}")
+            if job["intentos"] >= self.max_attempts:
+                await self._finish(job, "error", error=str(e))
+            else:
+                # Backoff exponencial entre intentos
+                await self._finish(job, "pendiente", error=str(e), retry_after=self.retry_backoff * (2 ** (job["intentos"] - 1)))
+
+    async def _worker(self):
+        while not self._stopping:
+            try:
+                job = await self.claim()
+            except Exception as e:
+                logging.error(f"Error reclamando trabajo: {str(e)}")
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self.run_job(job)
+            except Exception as e:
+                # P. ej. Mongo falló al guardar el resultado: el trabajo se retoma al vencer su
+                # lease, pero el worker debe seguir vivo para no achicar el pool
+                logging.error(f"Error inesperado en el worker con el trabajo {job['id']}: {str(e)}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def start(self):
+        """Arranca los workers; los trabajos de un proceso caído se retoman al vencer su lease (sin heartbeat)"""
+        await self.collection.create_index("id", unique=True)
+        await self.collection.create_index([("estado", 1), ("disponible_desde", 1), ("fecha_creacion", 1)])
+        pendientes = await self.collection.count_documents({"estado": {"$in": ["pendiente", "procesando"]}})
+        if pendientes:
+            logging.info(f"Retomando {pendientes} trabajos sin terminar")
+        self._stopping = False
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        # Devolver a la cola los trabajos interrumpidos para que se retomen al reiniciar
+        await self.collection.update_many(
+            {"estado": "procesando", "worker": self.worker_id},
+            {
+                "$set": {"estado": "pendiente", "fecha_actualizacion": datetime.now(timezone.utc)},
+                "$unset": {"lease_expira": ""},
+                "$inc": {"intentos": -1}
+            }
+        )
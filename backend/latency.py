@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from pymongo.errors import CollectionInvalid
+
+
+# Traza activa de la petición o trabajo en curso: las funciones internas
+# (extracción, IA, Mongo) agregan sus etapas sin recibirla como parámetro
+_current_trace = ContextVar("current_trace", default=None)
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class RequestStartMiddleware:
+    """Middleware ASGI que anota cuándo llegó la petición, antes de leer el cuerpo multipart"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            scope.setdefault("state", {})["recibido"] = time.perf_counter()
+        await self.app(scope, receive, send)
+
+
+def request_started(request):
+    return getattr(request.state, "recibido", None)
+
+
+def _percentile(sorted_values, p):
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Trace:
+    """Tiempos por etapa de una operación; se registra en el tracker al cerrarse"""
+
+    def __init__(self, tracker, operation, started=None):
+        self.tracker = tracker
+        self.operation = operation
+        self.started = time.perf_counter()
+        self.stages = {}
+        self._last = self.started
+        if started is not None and started < self.started:
+            # Lo transcurrido antes de entrar al endpoint: cuerpo multipart, autenticación
+            self.stages["recepcion"] = self.started - started
+            self.started = started
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def span(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+
+class LatencyTracker:
+    """Percentiles móviles de latencia por operación y etapa, en memoria
+
+    Guarda las últimas `window` muestras de cada etapa. Si se configura una
+    colección (capped), cada traza se guarda también en MongoDB para ver tendencias.
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.samples = defaultdict(lambda: deque(maxlen=window))
+        self.errors = defaultdict(int)
+        self.collection = None
+        self._pending = set()
+
+    async def enable_persistence(self, db, name="latency_samples", size_mb=16):
+        try:
+            await db.create_collection(name, capped=True, size=size_mb * 1024 * 1024)
+        except CollectionInvalid:
+            pass  # ya existe
+        self.collection = db[name]
+
+    def record(self, operation, stage, seconds):
+        self.samples[(operation, stage)].append(seconds)
+
+    def trace(self, operation, started=None):
+        return _TraceContext(self, operation, started)
+
+    def _finish(self, trace, error):
+        total = time.perf_counter() - trace.started
+        for stage, seconds in trace.stages.items():
+            self.record(trace.operation, stage, seconds)
+        self.record(trace.operation, "total", total)
+        if error:
+            self.errors[trace.operation] += 1
+
+        if self.collection is not None:
+            doc = {
+                "operacion": trace.operation,
+                "fecha": datetime.now(timezone.utc),
+                "error": error,
+                "total_ms": round(total * 1000, 2),
+                "etapas_ms": {stage: round(seconds * 1000, 2) for stage, seconds in trace.stages.items()}
+            }
+            # Sin esperar a Mongo: la medición no debe sumar latencia a la petición
+            task = asyncio.create_task(self._persist(doc))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    async def _persist(self, doc):
+        try:
+            await self.collection.insert_one(doc)
+        except Exception as e:
+            logging.warning(f"No se pudo guardar la muestra de latencia: {str(e)}")
+
+    def stats(self):
+        operations = defaultdict(dict)
+        for (operation, stage), values in self.samples.items():
+            ordered = sorted(values)
+            stage_stats = {"muestras": len(ordered)}
+            for p in PERCENTILES:
+                stage_stats[f"p{p}_ms"] = round(_percentile(ordered, p) * 1000, 2)
+            stage_stats["max_ms"] = round(ordered[-1] * 1000, 2)
+            operations[operation][stage] = stage_stats
+        return {
+            "ventana": self.window,
+            "operaciones": {
+                operation: {"errores": self.errors[operation], "etapas": stages}
+                for operation, stages in operations.items()
+            }
+        }
+
+
+class _TraceContext:
+    def __init__(self, tracker, operation, started):
+        self.tracker = tracker
+        self.trace = Trace(tracker, operation, started)
+        self._token = None
+
+    async def __aenter__(self):
+        self._token = _current_trace.set(self.trace)
+        return self.trace
+
+    async def __aexit__(self, exc_type, exc, tb):
+        _current_trace.reset(self._token)
+        self.tracker._finish(self.trace, error=exc_type is not None)
+        return False
+
+
+@contextmanager
+def span(stage):
+    """Mide una etapa dentro de la traza activa; no hace nada si no hay traza"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(stage):
+        yield
@@ -0,0 +1,323 @@
+import asyncio
+import base64
+import logging
+import random
+import time
+import uuid
+from collections import deque
+
+import httpx
+
+from rate_limiter import RateLimitTimeout
+from storage import run_io
+
+
+class LlmError(Exception):
+    """Error al llamar al modelo; `retryable` indica si tiene sentido reintentar
+
+    `reached_provider` es False cuando la petición no llegó a enviarse (p. ej. no se
+    pudo conectar): su cupo del limitador se devuelve.
+    """
+
+    def __init__(self, message, retryable=True, reached_provider=True):
+        super().__init__(message)
+        self.retryable = retryable
+        self.reached_provider = reached_provider
+
+
+class LlmTimeoutError(LlmError):
+    """Se agotó el plazo total de la llamada"""
+
+
+class CircuitOpenError(LlmError):
+    """El circuito está abierto: el proveedor está fallando y no se intenta la llamada"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Servicio de IA no disponible, reintentar en {retry_after:.0f}s", retryable=False)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Circuit breaker por tasa de errores sobre una ventana de las últimas llamadas
+
+    cerrado -> abierto cuando la tasa de error de la ventana supera el umbral;
+    abierto -> semiabierto al pasar `cooldown` segundos, donde se deja pasar una
+    sola llamada de prueba que decide si vuelve a cerrarse o a abrirse.
+    """
+
+    def __init__(self, window=20, min_calls=5, failure_threshold=0.5, cooldown=30.0, clock=time.monotonic):
+        self.window = deque(maxlen=window)
+        self.min_calls = min_calls
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.state = "cerrado"
+        self.opened_at = None
+        self.times_opened = 0
+        self._probe_started_at = None
+
+    def retry_after(self):
+        if self.state != "abierto":
+            return 0.0
+        return max(0.0, self.cooldown - (self.clock() - self.opened_at))
+
+    def before_call(self):
+        """Lanza CircuitOpenError si la llamada no debe intentarse"""
+        if self.state == "abierto":
+            if self.retry_after() > 0:
+                raise CircuitOpenError(self.retry_after())
+            self.state = "semiabierto"
+            self._probe_started_at = None
+        if self.state == "semiabierto":
+            # Una sola llamada de prueba; si se quedó colgada (o fue cancelada) se permite otra tras el cooldown
+            if self._probe_started_at is not None and self.clock() - self._probe_started_at < self.cooldown:
+                raise CircuitOpenError(self.cooldown)
+            self._probe_started_at = self.clock()
+
+    def record_success(self):
+        if self.state == "semiabierto":
+            self.state = "cerrado"
+            self.window.clear()
+            self._probe_started_at = None
+        self.window.append(True)
+
+    def record_failure(self):
+        self.window.append(False)
+        if self.state == "semiabierto":
+            self._open()
+            return
+        failures = self.window.count(False)
+        if len(self.window) >= self.min_calls and failures / len(self.window) >= self.failure_threshold:
+            self._open()
+
+    def _open(self):
+        self.state = "abierto"
+        self.opened_at = self.clock()
+        self.times_opened += 1
+        self._probe_started_at = None
+        logging.warning(f"Circuito de IA abierto por {self.cooldown:.0f}s")
+
+    def stats(self):
+        total = len(self.window)
+        return {
+            "estado": self.state,
+            "tasa_error": round(self.window.count(False) / total, 4) if total else 0.0,
+            "llamadas_en_ventana": total,
+            "veces_abierto": self.times_opened,
+            "reintentar_en": round(self.retry_after(), 1)
+        }
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class EmergentTransport:
+    """Envía la petición a través de emergentintegrations (LlmChat)
+
+    LlmChat guarda el historial de la sesión y lo reenvía en cada mensaje, así que
+    cada llamada crea un LlmChat nuevo: reutilizarlo haría crecer cada petición con
+    las facturas anteriores. La librería no expone su cliente HTTP, por lo que este
+    transporte no garantiza keep-alive entre extracciones; con LLM_TRANSPORT=gemini_http
+    (GeminiHttpTransport) las conexiones sí se reutilizan.
+    """
+
+    def __init__(self, api_key, provider="gemini"):
+        from emergentintegrations.llm.chat import LlmChat, UserMessage, FileContentWithMimeType
+        self._LlmChat = LlmChat
+        self._UserMessage = UserMessage
+        self._FileContent = FileContentWithMimeType
+        self.api_key = api_key
+        self.provider = provider
+
+    async def send(self, model, system_message, prompt, file_path, mime_type, timeout):
+        chat = self._LlmChat(
+            api_key=self.api_key,
+            session_id=f"pdf-extract-{uuid.uuid4()}",
+            system_message=system_message
+        ).with_model(self.provider, model)
+        user_message = self._UserMessage(
+            text=prompt,
+            file_contents=[self._FileContent(file_path=file_path, mime_type=mime_type)]
+        )
+        return await chat.send_message(user_message)
+
+    async def aclose(self):
+        pass
+
+
+class GeminiHttpTransport:
+    """Llama a la API REST generateContent de Gemini con un httpx.AsyncClient de larga vida (keep-alive)"""
+
+    def __init__(self, api_key, base_url="https://generativelanguage.googleapis.com", max_connections=10):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(60.0)
+        )
+
+    async def send(self, model, system_message, prompt, file_path, mime_type, timeout):
+        data = base64.b64encode(await run_io(_read_file, file_path)).decode("ascii")
+        body = {
+            "systemInstruction": {"parts": [{"text": system_message}]},
+            "contents": [{"role": "user", "parts": [
+                {"text": prompt},
+                {"inline_data": {"mime_type": mime_type, "data": data}}
+            ]}]
+        }
+        try:
+            response = await self.client.post(
+                f"{self.base_url}/v1beta/models/{model}:generateContent",
+                params={"key": self.api_key},
+                json=body,
+                timeout=timeout
+            )
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+            raise LlmError(f"No se pudo conectar con Gemini: {str(e)}", reached_provider=False)
+        except httpx.TimeoutException as e:
+            raise LlmError(f"Timeout llamando a Gemini: {str(e)}")
+        except httpx.TransportError as e:
+            raise LlmError(f"Error de conexión con Gemini: {str(e)}")
+
+        if response.status_code != 200:
+            retryable = response.status_code == 429 or response.status_code >= 500
+            raise LlmError(f"Gemini respondió {response.status_code}: {response.text[:200]}", retryable=retryable)
+
+        try:
+            return response.json()["candidates"][0]["content"]["parts"][0]["text"]
+        except (KeyError, IndexError, ValueError):
+            raise LlmError("Respuesta de Gemini sin texto", retryable=False)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+# Gemini cobra ~258 tokens por página de PDF; sin contar páginas se estima por tamaño
+TOKENS_PER_PDF_PAGE = 258
+BYTES_PER_PDF_PAGE_ESTIMATE = 100_000
+
+
+def estimate_request_tokens(prompt, file_size):
+    """Estimación conservadora de tokens de entrada para reservar cupo antes de la llamada"""
+    pages = max(1, file_size // BYTES_PER_PDF_PAGE_ESTIMATE)
+    return len(prompt) // 4 + pages * TOKENS_PER_PDF_PAGE
+
+
+class ExtractionClient:
+    """Cliente de extracción de larga vida con plazo por llamada, reintentos con backoff y circuit breaker"""
+
+    def __init__(self, transport, model, system_message, deadline=60.0, attempt_timeout=30.0,
+                 max_retries=3, backoff_base=0.5, backoff_max=8.0, breaker=None, rate_limiter=None):
+        self.transport = transport
+        self.model = model
+        self.system_message = system_message
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.rate_limiter = rate_limiter
+        self.calls = 0
+        self.attempts = 0
+        self.failures = 0
+
+    def _backoff(self, attempt):
+        # Full jitter: evita que todos los workers reintenten al mismo tiempo
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def _acquire_quota(self, tokens, timeout):
+        if self.rate_limiter is None:
+            return
+        try:
+            await self.rate_limiter.acquire(tokens, timeout=timeout)
+        except RateLimitTimeout as e:
+            raise LlmTimeoutError(str(e))
+
+    async def _refund_quota(self, tokens):
+        if self.rate_limiter is None:
+            return
+        try:
+            await self.rate_limiter.refund(tokens)
+        except Exception as e:
+            logging.warning(f"No se pudo devolver el cupo de la petición: {str(e)}")
+
+    async def _record_output_tokens(self, text):
+        if self.rate_limiter is None:
+            return
+        try:
+            await self.rate_limiter.add_tokens(len(text) // 4)
+        except Exception as e:
+            logging.warning(f"No se pudieron registrar los tokens de la respuesta: {str(e)}")
+
+    async def extract(self, prompt, file_path, mime_type="application/pdf", model=None, tokens=0):
+        """Envía el archivo y el prompt al modelo y devuelve el texto de la respuesta
+
+        `tokens` es la estimación de tokens de entrada para el limitador de cuota.
+        La primera espera por cuota no consume el plazo: la llamada espera su turno.
+        """
+        self.calls += 1
+        self.breaker.before_call()
+        await self._acquire_quota(tokens, timeout=None)
+        started = time.monotonic()
+        last_error = None
+
+        for attempt in range(self.max_retries + 1):
+            remaining = self.deadline - (time.monotonic() - started)
+            if remaining <= 0:
+                last_error = LlmTimeoutError(f"Se agotó el plazo de {self.deadline:.0f}s para la extracción con IA")
+                break
+
+            if attempt > 0:
+                self.breaker.before_call()
+                await self._acquire_quota(tokens, timeout=remaining)
+                remaining = self.deadline - (time.monotonic() - started)
+                if remaining <= 0:
+                    continue
+            self.attempts += 1
+            timeout = min(self.attempt_timeout, remaining)
+            try:
+                text = await asyncio.wait_for(
+                    self.transport.send(model or self.model, self.system_message, prompt, file_path, mime_type, timeout),
+                    timeout=timeout
+                )
+                self.breaker.record_success()
+                await self._record_output_tokens(text)
+                return text
+            except asyncio.TimeoutError:
+                last_error = LlmTimeoutError(f"Sin respuesta del modelo en {timeout:.1f}s")
+            except LlmError as e:
+                last_error = e
+                if not e.reached_provider:
+                    await self._refund_quota(tokens)
+            except Exception as e:
+                last_error = LlmError(str(e))
+
+            if last_error.retryable:
+                # Un 4xx es un error de la petición, no del proveedor: no abre el circuito
+                self.breaker.record_failure()
+            self.failures += 1
+            logging.warning(f"Intento {attempt + 1} de extracción con IA falló: {str(last_error)}")
+            if not last_error.retryable or attempt == self.max_retries:
+                break
+
+            delay = min(self._backoff(attempt), self.deadline - (time.monotonic() - started))
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        raise last_error
+
+    def stats(self):
+        return {
+            "modelo": self.model,
+            "llamadas": self.calls,
+            "intentos": self.attempts,
+            "fallos": self.failures,
+            "circuito": self.breaker.stats(),
+            "limite": self.rate_limiter.stats() if self.rate_limiter is not None else None
+        }
+
+    async def aclose(self):
+        await self.transport.aclose()
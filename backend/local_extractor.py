@@ -0,0 +1,136 @@
+import io
+import logging
+import re
+from datetime import datetime
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # pypdf es opcional: sin él siempre se usa Gemini
+    PdfReader = None
+
+
+# Solo se leen las primeras páginas: los datos de la factura casi siempre están ahí
+MAX_TEXT_PAGES = 2
+
+NUMERO_PATTERNS = [
+    re.compile(r'Serie\s*[:.]?\s*([A-Z]{1,10})\s+Folio\s*[:.]?\s*(\d[\w-]*)', re.IGNORECASE),
+    re.compile(r'(?:No\.?|N[úu]mero|N°|#)\s*(?:de\s*)?Factura\s*[:.]?\s*([A-Z0-9][\w-]*)', re.IGNORECASE),
+    re.compile(r'Factura\s*(?:No\.?|N°|#)\s*[:.]?\s*([A-Z0-9][\w-]*)', re.IGNORECASE),
+    re.compile(r'(?<!Fiscal\s)Folio(?!\s*Fiscal)\s*(?:interno)?\s*[:.]?\s*([A-Z0-9][\w-]*)', re.IGNORECASE),
+]
+
+# [ \t]* y no \s*: el nombre debe estar en la misma línea que la etiqueta
+PROVEEDOR_PATTERNS = [
+    re.compile(r'(?:Nombre|Raz[óo]n[ \t]+Social)[ \t]+(?:del[ \t]+)?Emisor[ \t]*[:.]?[ \t]*(.+)', re.IGNORECASE),
+    re.compile(r'Emisor[ \t]*[:.][ \t]*(.+)', re.IGNORECASE),
+    re.compile(r'Proveedor[ \t]*[:.][ \t]*(.+)', re.IGNORECASE),
+]
+
+# Tras "Emisor:" a veces viene el RFC y no el nombre ("Emisor: RFC: XAXX010101000")
+RFC_VALUE = re.compile(r'^(?:R\.?[ \t]*F\.?[ \t]*C\.?(?![A-ZÑ&])|[A-ZÑ&]{3,4}\d{6}[A-Z0-9]{3}\b)', re.IGNORECASE)
+
+FECHA_LABEL = re.compile(
+    r'Fecha\s*(?:y\s+hora\s+)?(?:de\s+)?(?:emisi[óo]n|expedici[óo]n|factura)?\s*[:.]?\s*'
+    r'(\d{4}-\d{2}-\d{2}|\d{1,2}/\d{1,2}/\d{4})',
+    re.IGNORECASE
+)
+FECHA_ANY = re.compile(r'\b(\d{4}-\d{2}-\d{2})(?:T\d{2}:\d{2}:\d{2})?\b')
+
+TOTAL_PATTERN = re.compile(r'(?<!Sub)(?<!Sub\s)\bTotal\b(?:\s+a\s+pagar)?\s*[:.]?\s*(?:MXN|\$)?\s*\$?\s*([\d,]+\.\d{2})', re.IGNORECASE)
+
+# Etiquetas genéricas: se aceptan pero con la mitad de confianza
+NUMERO_FALLBACK = re.compile(r'N[úu]mero\s*[:.]\s*([A-Z0-9][\w-]*)', re.IGNORECASE)
+MONTO_FALLBACK = re.compile(r'(?:Monto|Importe)\s*[:.]?\s*\$?\s*([\d,]+\.\d{2})\b', re.IGNORECASE)
+
+
+def extract_pdf_text(source):
+    """Devuelve el texto de la capa de texto del PDF (cadena vacía si no tiene o no se puede leer)
+
+    `source` puede ser la ruta del archivo guardado o su contenido en bytes.
+    """
+    if PdfReader is None:
+        return ""
+    try:
+        reader = PdfReader(io.BytesIO(source) if isinstance(source, bytes) else source)
+        pages = reader.pages[:MAX_TEXT_PAGES]
+        return "\n".join(page.extract_text() or "" for page in pages)
+    except Exception as e:
+        logging.info(f"No se pudo leer la capa de texto del PDF: {str(e)}")
+        return ""
+
+
+def _normalize_date(value):
+    for fmt in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(value, fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return None
+
+
+def _clean_line(value):
+    value = value.split('  ')[0].strip(' :-\t')
+    # Cortar etiquetas que comparten la línea con el nombre (p. ej. "ACME SA DE CV RFC: ...")
+    value = re.split(r'\s+RFC\b', value, flags=re.IGNORECASE)[0]
+    return value.strip()
+
+
+def extract_invoice_fields(text):
+    """Busca los cuatro campos de la factura en el texto
+
+    Devuelve (datos, confianza) donde confianza va de 0 a 1: cada campo aporta un
+    cuarto, completo si se encontró junto a su etiqueta y la mitad si se infirió.
+    """
+    data = {'numero_factura': None, 'nombre_proveedor': None, 'fecha_factura': None, 'monto': None}
+    scores = {field: 0.0 for field in data}
+    if not text or not text.strip():
+        return data, 0.0
+
+    for pattern in NUMERO_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            data['numero_factura'] = '-'.join(match.groups()) if len(match.groups()) > 1 else match.group(1)
+            scores['numero_factura'] = 1.0
+            break
+    else:
+        match = NUMERO_FALLBACK.search(text)
+        if match:
+            data['numero_factura'] = match.group(1)
+            scores['numero_factura'] = 0.5
+
+    for pattern in PROVEEDOR_PATTERNS:
+        match = pattern.search(text)
+        nombre = _clean_line(match.group(1)) if match else None
+        # Un RFC en lugar del nombre no cuenta: sin nombre la confianza baja y se usa la IA
+        if nombre and not RFC_VALUE.match(nombre):
+            data['nombre_proveedor'] = nombre
+            scores['nombre_proveedor'] = 1.0
+            break
+
+    match = FECHA_LABEL.search(text)
+    if match and _normalize_date(match.group(1)):
+        data['fecha_factura'] = _normalize_date(match.group(1))
+        scores['fecha_factura'] = 1.0
+    else:
+        match = FECHA_ANY.search(text)
+        if match and _normalize_date(match.group(1)):
+            data['fecha_factura'] = _normalize_date(match.group(1))
+            scores['fecha_factura'] = 0.5
+
+    totals = TOTAL_PATTERN.findall(text)
+    if totals:
+        # El último "Total" suele ser el importe final después de impuestos
+        data['monto'] = float(totals[-1].replace(',', ''))
+        scores['monto'] = 1.0 if len(set(totals)) == 1 else 0.5
+    else:
+        match = MONTO_FALLBACK.search(text)
+        if match:
+            data['monto'] = float(match.group(1).replace(',', ''))
+            scores['monto'] = 0.5
+
+    return data, sum(scores.values()) / len(scores)
+
+
+def extract_invoice_from_pdf(source):
+    """Extrae los datos de la factura desde la capa de texto del PDF: (datos, confianza)"""
+    return extract_invoice_fields(extract_pdf_text(source))
@@ -0,0 +1,118 @@
+"""Migra facturas existentes a fecha_factura como fecha BSON y monto_centavos entero
+
+Uso (desde backend/, con el mismo .env del servidor):
+
+    python migrate_invoice_fields.py [--lote 500] [--pausa 0.05] [--reiniciar]
+
+Recorre la colección por _id en lotes y aplica cada lote con un solo
+bulk_write. El avance se guarda en la colección `migrations` después de cada
+lote, así que si se interrumpe continúa donde quedó. Puede correr con la
+aplicación en servicio: cada update solo aplica si el documento no cambió
+desde que se leyó, y las facturas nuevas ya se guardan con los tipos correctos.
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from invoice_fields import typed_invoice_fields
+
+
+MIGRATION_ID = "invoice_typed_fields_v1"
+
+
+async def migrate(db, batch_size=500, pause=0.05, restart=False):
+    """Ejecuta (o reanuda) la migración; devuelve el estado final guardado"""
+    if restart:
+        await db.migrations.delete_one({"_id": MIGRATION_ID})
+    state = await db.migrations.find_one({"_id": MIGRATION_ID}) or {}
+    if state.get("completada"):
+        logging.info("La migración ya estaba completa")
+        return state
+
+    last_id = state.get("ultimo_id")
+    revisados = state.get("revisados", 0)
+    actualizados = state.get("actualizados", 0)
+    sin_fecha = state.get("fechas_no_reconocidas", 0)
+
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        batch = await db.invoices.find(
+            query, {"_id": 1, "fecha_factura": 1, "monto": 1, "monto_centavos": 1}
+        ).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+
+        operations = []
+        for doc in batch:
+            updates = typed_invoice_fields(doc)
+            if isinstance(doc.get("fecha_factura"), str) and "fecha_factura" not in updates:
+                sin_fecha += 1
+            if updates:
+                # Solo si nadie modificó fecha o monto desde la lectura
+                operations.append(UpdateOne(
+                    {"_id": doc["_id"], "fecha_factura": doc.get("fecha_factura"), "monto": doc.get("monto")},
+                    {"$set": updates}
+                ))
+        if operations:
+            result = await db.invoices.bulk_write(operations, ordered=False)
+            actualizados += result.modified_count
+
+        revisados += len(batch)
+        last_id = batch[-1]["_id"]
+        await db.migrations.update_one(
+            {"_id": MIGRATION_ID},
+            {"$set": {
+                "ultimo_id": last_id,
+                "revisados": revisados,
+                "actualizados": actualizados,
+                "fechas_no_reconocidas": sin_fecha,
+                "fecha_actualizacion": datetime.now(timezone.utc)
+            }},
+            upsert=True
+        )
+        logging.info(f"Migración: {revisados} revisadas, {actualizados} actualizadas")
+        # Ceder la base de datos al tráfico de la aplicación entre lotes
+        if pause:
+            await asyncio.sleep(pause)
+
+    await db.migrations.update_one(
+        {"_id": MIGRATION_ID},
+        {"$set": {"completada": True, "revisados": revisados, "actualizados": actualizados,
+                  "fechas_no_reconocidas": sin_fecha, "fecha_actualizacion": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    if sin_fecha:
+        logging.warning(f"{sin_fecha} facturas tienen una fecha_factura no reconocida y quedaron como texto")
+    return await db.migrations.find_one({"_id": MIGRATION_ID})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migra fecha_factura y monto de las facturas a tipos nativos")
+    parser.add_argument("--lote", type=int, default=500, help="Documentos por bulk_write")
+    parser.add_argument("--pausa", type=float, default=0.05, help="Segundos de pausa entre lotes")
+    parser.add_argument("--reiniciar", action="store_true", help="Ignorar el avance guardado y empezar de cero")
+    args = parser.parse_args()
+
+    load_dotenv(Path(__file__).parent / '.env')
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    async def run():
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        try:
+            state = await migrate(client[os.environ['DB_NAME']], args.lote, args.pausa, args.reiniciar)
+            logging.info(f"Migración completa: {state.get('revisados', 0)} revisadas, {state.get('actualizados', 0)} actualizadas")
+        finally:
+            client.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from collections import deque
+
+from pymongo import monitoring
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+
+
+READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+
+def _env_int(name, default=None):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+
+def client_options_from_env():
+    """Opciones del pool y timeouts de AsyncIOMotorClient; sin la variable se usa el valor de pymongo"""
+    options = {
+        "maxPoolSize": _env_int("MONGO_MAX_POOL_SIZE", 100),
+        "minPoolSize": _env_int("MONGO_MIN_POOL_SIZE", 0),
+        "maxIdleTimeMS": _env_int("MONGO_MAX_IDLE_TIME_MS"),
+        "waitQueueTimeoutMS": _env_int("MONGO_WAIT_QUEUE_TIMEOUT_MS"),
+        "serverSelectionTimeoutMS": _env_int("MONGO_SERVER_SELECTION_TIMEOUT_MS", 30000),
+        "connectTimeoutMS": _env_int("MONGO_CONNECT_TIMEOUT_MS", 20000),
+        "socketTimeoutMS": _env_int("MONGO_SOCKET_TIMEOUT_MS"),
+    }
+    return {name: value for name, value in options.items() if value is not None}
+
+
+def read_preference(name, max_staleness=-1):
+    """Read preference por nombre ("secondaryPreferred"); max_staleness en segundos, -1 sin límite"""
+    mode = READ_PREFERENCES.get(name)
+    if mode is None:
+        raise ValueError(f"Read preference no soportada: {name}. Opciones: {', '.join(READ_PREFERENCES)}")
+    if mode is Primary:
+        return Primary()
+    return mode(max_staleness=max_staleness)
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Métricas del pool de conexiones por servidor
+
+    Conexiones abiertas y en uso, operaciones esperando una conexión libre
+    (la cola de espera), checkouts fallidos por causa y tiempo de espera.
+    pymongo publica los eventos desde los hilos de Motor, de ahí el lock.
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._lock = threading.Lock()
+        self._servers = {}
+        self._waiting_since = {}
+
+    def _server(self, address):
+        server = self._servers.get(address)
+        if server is None:
+            server = self._servers[address] = {
+                "abiertas": 0,
+                "en_uso": 0,
+                "esperando": 0,
+                "max_esperando": 0,
+                "checkouts": 0,
+                "fallidos": {},
+                "limpiezas": 0,
+                "esperas": deque(maxlen=self.window),
+            }
+        return server
+
+    # Un checkout empieza y termina en el mismo hilo
+    def connection_check_out_started(self, event):
+        with self._lock:
+            server = self._server(event.address)
+            server["esperando"] += 1
+            server["max_esperando"] = max(server["max_esperando"], server["esperando"])
+            self._waiting_since[(event.address, threading.get_ident())] = time.monotonic()
+
+    def _end_wait(self, address):
+        server = self._server(address)
+        server["esperando"] = max(0, server["esperando"] - 1)
+        started = self._waiting_since.pop((address, threading.get_ident()), None)
+        if started is not None:
+            server["esperas"].append(time.monotonic() - started)
+        return server
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            server = self._end_wait(event.address)
+            server["checkouts"] += 1
+            server["en_uso"] += 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            server = self._end_wait(event.address)
+            reason = str(event.reason)
+            server["fallidos"][reason] = server["fallidos"].get(reason, 0) + 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            server = self._server(event.address)
+            server["en_uso"] = max(0, server["en_uso"] - 1)
+
+    def connection_created(self, event):
+        with self._lock:
+            self._server(event.address)["abiertas"] += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            server = self._server(event.address)
+            server["abiertas"] = max(0, server["abiertas"] - 1)
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self._server(event.address)["limpiezas"] += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        with self._lock:
+            self._servers.pop(event.address, None)
+
+    def stats(self):
+        with self._lock:
+            servers = {}
+            for address, server in self._servers.items():
+                waits = sorted(server["esperas"])
+                stats = {name: value for name, value in server.items() if name != "esperas"}
+                stats["fallidos"] = dict(server["fallidos"])
+                if waits:
+                    stats["espera_p50_ms"] = round(waits[len(waits) // 2] * 1000, 2)
+                    stats["espera_p95_ms"] = round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 2)
+                    stats["espera_max_ms"] = round(waits[-1] * 1000, 2)
+                servers[f"{address[0]}:{address[1]}"] = stats
+        return {"ventana": self.window, "servidores": servers}
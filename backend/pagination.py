@@ -0,0 +1,88 @@
+import base64
+import json
+from datetime import datetime
+
+
+# Paginación por keyset: el cursor guarda el valor del campo de orden y el id
+# del último elemento entregado; la página siguiente empieza justo después
+# usando el índice, sin skip() y sin importar cuántas páginas se hayan leído.
+# El cursor también guarda el orden con el que se generó: no sirve para otro.
+
+DEFAULT_SORT = "-fecha_creacion"
+
+
+def _encode_value(value):
+    # Las fechas BSON (fecha_factura) deben volver como datetime para compararse en Mongo
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and set(value) == {"$date"}:
+        return datetime.fromisoformat(value["$date"])
+    return value
+
+
+def encode_cursor(sort_value, last_id, sort=DEFAULT_SORT):
+    payload = json.dumps([_encode_value(sort_value), last_id, sort], separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort=DEFAULT_SORT):
+    """Devuelve (valor_de_orden, id); lanza ValueError si el cursor no es válido o es de otro orden"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_value, last_id, cursor_sort = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        sort_value = _decode_value(sort_value)
+    except Exception:
+        raise ValueError("Cursor inválido")
+    if not isinstance(last_id, str):
+        raise ValueError("Cursor inválido")
+    if cursor_sort != sort:
+        raise ValueError("El cursor corresponde a otro orden")
+    return sort_value, last_id
+
+
+# Orden BSON entre los tipos que pueden tener los campos de orden. $gt/$lt solo
+# comparan valores del mismo tipo: mientras fecha_factura mezcla texto (facturas
+# sin migrar o con fecha no reconocida) y fechas, el cursor debe poder cruzar de
+# un tipo al siguiente. null también cubre los documentos sin el campo.
+_BSON_TYPE_ORDER = ("null", "number", "string", "date")
+
+
+def _bson_type(value):
+    if value is None:
+        return "null"
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, datetime):
+        return "date"
+    return None
+
+
+def _type_condition(sort_field, bson_type):
+    if bson_type == "null":
+        return {sort_field: None}
+    return {sort_field: {"$type": bson_type}}
+
+
+def keyset_condition(sort_field, direction, sort_value, last_id):
+    """Condición para los documentos posteriores a (sort_value, last_id) en el orden (sort_field, id)"""
+    op = "$lt" if direction < 0 else "$gt"
+    branches = [
+        {sort_field: {op: sort_value}},
+        {sort_field: sort_value, "id": {op: last_id}}
+    ]
+    value_type = _bson_type(sort_value)
+    if value_type is not None:
+        position = _BSON_TYPE_ORDER.index(value_type)
+        following = _BSON_TYPE_ORDER[position + 1:] if direction > 0 else _BSON_TYPE_ORDER[:position]
+        branches.extend(_type_condition(sort_field, bson_type) for bson_type in following)
+    return {"$or": branches}
+
+
+def keyset_sort(sort_field, direction):
+    return [(sort_field, direction), ("id", direction)]
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+import re
+import tempfile
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:  # pypdf es opcional: sin él se envía siempre el documento completo
+    PdfReader = None
+    PdfWriter = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+# La normalización de imágenes es CPU pura: corre en procesos aparte para no
+# bloquear el event loop ni competir por el GIL con las peticiones
+PDF_PREPROCESS_PROCESSES = int(os.environ.get('PDF_PREPROCESS_PROCESSES', '2'))
+_process_pool = None
+
+
+# "Total" pero no "Sub Total" ("Subtotal" ya no coincide por el límite de palabra)
+TOTAL_RE = re.compile(r'(?<!sub\s)\btotal\b', re.IGNORECASE)
+
+
+def _temp_pdf_path(prefix):
+    return os.path.join(tempfile.gettempdir(), f"{prefix}_{uuid.uuid4()}.pdf")
+
+
+def _pages_to_keep(reader, max_pages):
+    """Primeras `max_pages` páginas más la última página que menciona el Total, si quedó fuera"""
+    keep = list(range(min(max_pages, len(reader.pages))))
+    for index in range(len(reader.pages) - 1, max_pages - 1, -1):
+        try:
+            text = reader.pages[index].extract_text() or ""
+        except Exception:
+            continue
+        if TOTAL_RE.search(text):
+            keep.append(index)
+            break
+    return keep
+
+
+def trim_pdf(src_path, max_pages):
+    """Crea una copia reducida del PDF para la extracción
+
+    Devuelve (ruta_recortada, paginas_originales, paginas_enviadas), o ruta None
+    cuando no hace falta recortar (pocas páginas, PDF ilegible o pypdf ausente).
+    El original no se modifica.
+    """
+    if PdfReader is None or max_pages <= 0:
+        return None, None, None
+
+    try:
+        reader = PdfReader(src_path)
+        total_pages = len(reader.pages)
+        if total_pages <= max_pages:
+            return None, total_pages, total_pages
+
+        writer = PdfWriter()
+        keep = _pages_to_keep(reader, max_pages)
+        for index in keep:
+            writer.add_page(reader.pages[index])
+
+        trimmed_path = _temp_pdf_path("trim")
+        with open(trimmed_path, "wb") as f:
+            writer.write(f)
+        return trimmed_path, total_pages, len(keep)
+    except Exception as e:
+        logging.info(f"No se pudo recortar el PDF {src_path}: {str(e)}")
+        return None, None, None
+
+
+def _downscale_image(image_file, page_width_in, page_height_in, target_dpi, quality):
+    """Reemplaza la imagen por una remuestreada a `target_dpi`; devuelve True si la cambió
+
+    La resolución se estima suponiendo que la imagen ocupa la página completa,
+    que es el caso de escaneos y fotos de teléfono.
+    """
+    image = image_file.image
+    if image.mode in ("1", "RGBA", "LA", "PA"):
+        # Imágenes bitonales ya vienen comprimidas (CCITT/JBIG2); las de transparencia no se tocan
+        return False
+    dpi = max(image.width / page_width_in, image.height / page_height_in)
+    if dpi <= target_dpi * 1.1:
+        return False
+
+    scale = target_dpi / dpi
+    size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+    image = image.resize(size, Image.LANCZOS)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    image_file.replace(image, quality=quality)
+    return True
+
+
+def normalize_pdf_images(src_path, target_dpi, quality=75):
+    """Crea una copia del PDF con las imágenes de página remuestreadas a `target_dpi` y recodificadas en JPEG
+
+    Devuelve (ruta_normalizada, bytes_originales, bytes_normalizados); la ruta es
+    None si no hubo imágenes que reducir o la copia no resultó más chica.
+    """
+    original_size = os.path.getsize(src_path)
+    if PdfReader is None or Image is None or target_dpi <= 0:
+        return None, original_size, original_size
+
+    try:
+        writer = PdfWriter(clone_from=PdfReader(src_path))
+        changed = False
+        for page in writer.pages:
+            width_in = float(page.mediabox.width) / 72
+            height_in = float(page.mediabox.height) / 72
+            if width_in <= 0 or height_in <= 0:
+                continue
+            for image_file in page.images:
+                try:
+                    changed = _downscale_image(image_file, width_in, height_in, target_dpi, quality) or changed
+                except Exception as e:
+                    logging.info(f"Imagen no normalizada en {src_path}: {str(e)}")
+        if not changed:
+            return None, original_size, original_size
+
+        normalized_path = _temp_pdf_path("norm")
+        with open(normalized_path, "wb") as f:
+            writer.write(f)
+        normalized_size = os.path.getsize(normalized_path)
+        if normalized_size >= original_size:
+            os.remove(normalized_path)
+            return None, original_size, original_size
+        return normalized_path, original_size, normalized_size
+    except Exception as e:
+        logging.info(f"No se pudieron normalizar las imágenes del PDF {src_path}: {str(e)}")
+        return None, original_size, original_size
+
+
+async def run_in_process(func, *args):
+    """Ejecuta una función CPU-bound en el pool de procesos de preprocesamiento"""
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=PDF_PREPROCESS_PROCESSES)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_process_pool, func, *args)
+
+
+def shutdown():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timezone, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+
+class RateLimitTimeout(Exception):
+    """No hubo cupo dentro del tiempo máximo de espera"""
+
+
+class MongoRateLimiter:
+    """Token bucket de peticiones y tokens por minuto compartido por todos los workers
+
+    El balde es un documento en MongoDB con el cupo disponible y el instante de su
+    última actualización. Se rellena de forma continua a `rpm`/`tpm` por ventana
+    hasta su capacidad (el cupo de una ventana, que admite ráfagas). Reservar lee el
+    balde, calcula el relleno y escribe el nuevo saldo condicionado a `version`
+    (concurrencia optimista): si otro worker escribió antes, se vuelve a leer. Sin
+    cupo, el llamador duerme lo que tarda en rellenarse lo que le falta. Dentro del
+    proceso los llamadores esperan en orden de llegada (asyncio.Lock es FIFO).
+    """
+
+    def __init__(self, collection, name="llm", rpm=60, tpm=0, window_seconds=60):
+        self.collection = collection
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window_seconds = window_seconds
+        self._lock = asyncio.Lock()
+        self.acquired = 0
+        self.waits = 0
+        self.seconds_waited = 0.0
+        self.refunds = 0
+
+    @property
+    def enabled(self):
+        return self.rpm > 0 or self.tpm > 0
+
+    async def ensure_indexes(self):
+        # Un balde sin uso estaría lleno de todos modos: se borra solo
+        await self.collection.create_index("expira", expireAfterSeconds=0)
+
+    def _expira(self, now):
+        return datetime.fromtimestamp(now + self.window_seconds, timezone.utc) + timedelta(minutes=5)
+
+    def _refill(self, doc, now):
+        """Cupo disponible ahora: el saldo guardado más lo rellenado desde `actualizado`, sin pasar la capacidad"""
+        elapsed = max(0.0, now - doc["actualizado"])
+        requests = min(self.rpm, doc.get("requests", 0) + elapsed * self.rpm / self.window_seconds)
+        tokens = min(self.tpm, doc.get("tokens", 0) + elapsed * self.tpm / self.window_seconds)
+        return requests, tokens
+
+    async def _load(self, now):
+        doc = await self.collection.find_one({"_id": self.name})
+        if doc is not None:
+            return doc
+        doc = {
+            "_id": self.name,
+            "requests": float(self.rpm),
+            "tokens": float(self.tpm),
+            "actualizado": now,
+            "version": 0,
+            "expira": self._expira(now)
+        }
+        try:
+            await self.collection.insert_one(doc)
+            return doc
+        except DuplicateKeyError:
+            # Otro worker creó el balde al mismo tiempo
+            return await self.collection.find_one({"_id": self.name})
+
+    async def _try_reserve(self, tokens):
+        """Intenta reservar cupo; devuelve None si lo obtuvo o los segundos hasta que el balde alcance"""
+        now = time.time()
+        doc = await self._load(now)
+        if doc is None:
+            return 0.0
+        requests, available = self._refill(doc, now)
+
+        wait = 0.0
+        if self.rpm > 0 and requests < 1:
+            wait = (1 - requests) * self.window_seconds / self.rpm
+        if self.tpm > 0 and available < tokens:
+            wait = max(wait, (tokens - available) * self.window_seconds / self.tpm)
+        if wait > 0:
+            return wait
+
+        result = await self.collection.update_one(
+            {"_id": self.name, "version": doc["version"]},
+            {
+                "$set": {
+                    "requests": requests - 1 if self.rpm > 0 else 0.0,
+                    "tokens": available - tokens if self.tpm > 0 else 0.0,
+                    "actualizado": now,
+                    "expira": self._expira(now)
+                },
+                "$inc": {"version": 1}
+            }
+        )
+        # Otro worker cambió el balde entre la lectura y la escritura: reintentar ya
+        return None if result.matched_count else 0.0
+
+    async def acquire(self, tokens=0, timeout=None):
+        """Espera hasta tener cupo para una petición de `tokens` tokens; devuelve los segundos esperados"""
+        if not self.enabled:
+            return 0.0
+        if self.tpm > 0:
+            # Una petición más grande que la capacidad nunca cabría: se le da el balde completo
+            tokens = min(tokens, self.tpm)
+
+        started = time.monotonic()
+        async with self._lock:
+            while True:
+                wait = await self._try_reserve(tokens)
+                waited = time.monotonic() - started
+                if wait is None:
+                    self.acquired += 1
+                    if waited > 0.001:
+                        self.waits += 1
+                        self.seconds_waited += waited
+                    return waited
+
+                if wait == 0.0:
+                    continue
+                # Jitter para que los workers no golpeen Mongo todos en el mismo instante
+                wait += random.uniform(0, 0.25)
+                if timeout is not None and waited + wait > timeout:
+                    raise RateLimitTimeout(f"Sin cupo de IA en los próximos {timeout:.0f}s")
+                logging.info(f"Límite de IA alcanzado, esperando {wait:.1f}s")
+                await asyncio.sleep(wait)
+
+    async def add_tokens(self, tokens):
+        """Descuenta del balde tokens conocidos después de la llamada (p. ej. los de la respuesta)
+
+        El saldo puede quedar negativo: las siguientes reservas esperan a que se rellene.
+        """
+        if self.tpm <= 0 or tokens <= 0:
+            return
+        # Subir `version` obliga a releer a quien esté reservando con el saldo anterior
+        await self.collection.update_one({"_id": self.name}, {"$inc": {"tokens": -tokens, "version": 1}})
+
+    async def refund(self, tokens=0):
+        """Devuelve al balde una reserva que no llegó al proveedor (la petición y sus tokens)"""
+        if not self.enabled:
+            return
+        inc = {"version": 1}
+        if self.rpm > 0:
+            inc["requests"] = 1
+        if self.tpm > 0 and tokens > 0:
+            inc["tokens"] = min(tokens, self.tpm)
+        # Si supera la capacidad, _refill lo recorta en la siguiente reserva
+        await self.collection.update_one({"_id": self.name}, {"$inc": inc})
+        self.refunds += 1
+
+    def stats(self):
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "reservas": self.acquired,
+            "esperas": self.waits,
+            "segundos_esperados": round(self.seconds_waited, 3),
+            "reembolsos": self.refunds
+        }
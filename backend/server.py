@@ -1,23 +1,43 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Depends, status
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Depends, Request, Query, status
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError
 import os
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Optional, Union
 import uuid
-from datetime import datetime, timezone, timedelta
-from emergentintegrations.llm.chat import LlmChat, UserMessage, FileContentWithMimeType
-import tempfile
+from datetime import date, datetime, timezone, timedelta
 import json
+import time
 from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill, Alignment
 import io
 from export_utils import create_invoices_excel, create_summary_excel
+from extraction_cache import ExtractionCache
+from job_queue import JobQueue, PermanentJobError, RetryLaterError
+from local_extractor import extract_invoice_from_pdf
+import pdf_preprocess
+from pdf_preprocess import trim_pdf, normalize_pdf_images
+from latency import LatencyTracker, RequestStartMiddleware, request_started, span
+from idempotency import IdempotencyStore, IdempotencyMiddleware
+from cfdi import parse_cfdi, compare_with_invoice, CfdiError
+import storage
+from llm_client import ExtractionClient, CircuitBreaker, EmergentTransport, GeminiHttpTransport, LlmError, CircuitOpenError
+from extractors import Extractor, GeminiExtractor, LocalTextExtractor, StubExtractor, CascadeExtractor, CascadeTier
+from rate_limiter import MongoRateLimiter
+from db_indexes import ensure_indexes, index_drift
+from mongo_pool import PoolMonitor, client_options_from_env, read_preference
+from pagination import DEFAULT_SORT, encode_cursor, decode_cursor, keyset_condition, keyset_sort
+from suppliers import normalize_supplier_name, supplier_prefix_query, backfill_supplier_keys
+from empresa_cache import EmpresaCache
+from fast_json import FastJSONResponse, dumps as dumps_bytes
+from invoice_fields import typed_invoice_fields, fecha_factura_str, to_centavos, centavos_to_monto, MONTO_CENTAVOS_EXPR
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 
@@ -27,12 +47,50 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# Pool y timeouts desde el entorno (MONGO_MAX_POOL_SIZE, MONGO_WAIT_QUEUE_TIMEOUT_MS, ...)
+MONGO_CLIENT_OPTIONS = client_options_from_env()
+mongo_pool_monitor = PoolMonitor()
+client = AsyncIOMotorClient(mongo_url, event_listeners=[mongo_pool_monitor], **MONGO_CLIENT_OPTIONS)
 db = client[os.environ['DB_NAME']]
 
+# Lecturas de reportes y exportaciones: con secondaryPreferred no compiten con las
+# escrituras del primario, a cambio de poder ir unos segundos atrás de la replicación.
+# MONGO_REPORTS_MAX_STALENESS_SECONDS acota ese retraso (MongoDB exige al menos 90; -1 sin límite)
+MONGO_REPORTS_READ_PREFERENCE = os.environ.get('MONGO_REPORTS_READ_PREFERENCE', 'primary')
+MONGO_REPORTS_MAX_STALENESS_SECONDS = int(os.environ.get('MONGO_REPORTS_MAX_STALENESS_SECONDS', '-1'))
+reports_db = client.get_database(
+    os.environ['DB_NAME'],
+    read_preference=read_preference(MONGO_REPORTS_READ_PREFERENCE, MONGO_REPORTS_MAX_STALENESS_SECONDS)
+)
+
+# maxTimeMS por clase de operación (0 = sin límite): listados, reportes (agregaciones) y exportaciones
+MONGO_MAX_TIME_MS = {
+    "consulta": int(os.environ.get('MONGO_QUERY_MAX_TIME_MS', '0')),
+    "reporte": int(os.environ.get('MONGO_REPORT_MAX_TIME_MS', '0')),
+    "exportacion": int(os.environ.get('MONGO_EXPORT_MAX_TIME_MS', '0')),
+}
+
+
+def max_time_ms(kind: str) -> Optional[int]:
+    """Límite para cursor.max_time_ms(); None si la clase no tiene límite"""
+    return MONGO_MAX_TIME_MS[kind] or None
+
+
+def max_time_option(kind: str) -> dict:
+    """Límite como opción de aggregate() y count_documents()"""
+    return {"maxTimeMS": MONGO_MAX_TIME_MS[kind]} if MONGO_MAX_TIME_MS[kind] else {}
+
 # Upload directory configuration
 UPLOAD_DIR = os.environ.get('UPLOAD_DIR', '/app/uploads')
 
+# Máximo de extracciones simultáneas en la carga por lotes
+BATCH_EXTRACTION_CONCURRENCY = int(os.environ.get('BATCH_EXTRACTION_CONCURRENCY', '4'))
+
+# Workers de la cola de extracción en segundo plano (por proceso)
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+# Lease de un trabajo en curso; se renueva cada tercio, así que es lo que tarda en retomarse si el proceso muere
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '60'))
+
 # Create uploads directory if it doesn't exist
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 logging.info(f"Upload directory configured: {UPLOAD_DIR}")
@@ -144,6 +202,7 @@ class Empresa(BaseModel):
     email: Optional[str] = None
     fecha_creacion: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     activa: bool = True
+    paginas_extraccion: Optional[int] = None  # Páginas enviadas a la IA; None usa el valor global, 0 envía el PDF completo
 
 class EmpresaCreate(BaseModel):
     nombre: str
@@ -151,6 +210,7 @@ class EmpresaCreate(BaseModel):
     direccion: Optional[str] = None
     telefono: Optional[str] = None
     email: Optional[str] = None
+    paginas_extraccion: Optional[int] = Field(default=None, ge=0)
 
 class Invoice(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -168,6 +228,12 @@ class Invoice(BaseModel):
     comprobante_original: Optional[str] = None  # Nombre original del comprobante
     archivo_xml: Optional[str] = None  # Nombre único del archivo XML
     xml_original: Optional[str] = None  # Nombre original del archivo XML
+    verificacion_xml: Optional[dict] = None  # Resultado de comparar monto y fecha contra el CFDI
+
+class InvoicePage(BaseModel):
+    items: List[Invoice]
+    next_cursor: Optional[str] = None  # None cuando no hay más páginas
+    total: Optional[int] = None  # Solo si se pidió incluir_total
 
 class InvoiceCreate(BaseModel):
     empresa_id: str  # Nueva relación con empresa
@@ -214,14 +280,138 @@ def prepare_for_mongo(data):
     if isinstance(data, dict):
         if 'fecha_creacion' in data and isinstance(data['fecha_creacion'], datetime):
             data['fecha_creacion'] = data['fecha_creacion'].isoformat()
+        if 'nombre_proveedor' in data:
+            # Clave indexada para la búsqueda por prefijo y el autocompletado de proveedores
+            data['proveedor_normalizado'] = normalize_supplier_name(data['nombre_proveedor'])
+        # fecha_factura como fecha BSON y monto_centavos para sumas exactas
+        data.update(typed_invoice_fields(data))
     return data
 
 def parse_from_mongo(item):
     if 'fecha_creacion' in item and isinstance(item['fecha_creacion'], str):
         item['fecha_creacion'] = datetime.fromisoformat(item['fecha_creacion'])
+    if 'fecha_factura' in item:
+        item['fecha_factura'] = fecha_factura_str(item['fecha_factura'])
     return item
 
 
+# Extracción de datos de facturas con Gemini
+EXTRACTION_PROMPT_VERSION = "v1"  # Incrementar al cambiar el prompt para invalidar la caché
+
+EXTRACTION_PROMPT = """
+            Analiza este PDF de factura y extrae exactamente estos datos en formato JSON:
+            
+            {
+                "numero_factura": "número de factura encontrado",
+                "nombre_proveedor": "nombre del proveedor/empresa que emite la factura",
+                "fecha_factura": "fecha de la factura en formato YYYY-MM-DD",
+                "monto": "monto total a pagar como número decimal"
+            }
+            
+            IMPORTANTE:
+            - Devuelve SOLO el JSON sin texto adicional
+            - Si no encuentras algún dato, usa null
+            - El monto debe ser un número sin símbolos de moneda
+            - La fecha debe estar en formato YYYY-MM-DD
+            """
+
+REQUIRED_INVOICE_FIELDS = ['numero_factura', 'nombre_proveedor', 'fecha_factura', 'monto']
+
+# Confianza mínima (0-1) para aceptar la extracción local sin llamar a Gemini
+LOCAL_EXTRACTION_MIN_CONFIDENCE = float(os.environ.get('LOCAL_EXTRACTION_MIN_CONFIDENCE', '0.9'))
+
+# Páginas del PDF que se envían a la IA (más la página del Total); 0 envía siempre el documento completo
+PDF_EXTRACTION_PAGES = int(os.environ.get('PDF_EXTRACTION_PAGES', '2'))
+
+# Resolución a la que se remuestrean las imágenes escaneadas antes de enviarlas a la IA; 0 desactiva
+PDF_IMAGE_TARGET_DPI = int(os.environ.get('PDF_IMAGE_TARGET_DPI', '0'))
+PDF_IMAGE_JPEG_QUALITY = int(os.environ.get('PDF_IMAGE_JPEG_QUALITY', '75'))
+
+# Latencia por etapa de las subidas: percentiles sobre las últimas N muestras y,
+# opcionalmente, cada muestra en una colección capped para ver tendencias
+LATENCY_WINDOW = int(os.environ.get('LATENCY_WINDOW', '1000'))
+LATENCY_PERSIST = os.environ.get('LATENCY_PERSIST', 'false').lower() == 'true'
+LATENCY_COLLECTION_MB = int(os.environ.get('LATENCY_COLLECTION_MB', '16'))
+latency_tracker = LatencyTracker(window=LATENCY_WINDOW)
+
+# Idempotency-Key en POST/PUT: respuestas guardadas por IDEMPOTENCY_TTL_HOURS
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+IDEMPOTENCY_WAIT_SECONDS = int(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', '60'))
+idempotency_store = IdempotencyStore(db.idempotency_keys, ttl_seconds=IDEMPOTENCY_TTL_HOURS * 3600)
+
+extraction_cache = ExtractionCache(db.extraction_cache, EXTRACTION_PROMPT_VERSION)
+
+
+def create_extraction_client() -> ExtractionClient:
+    """Crea el cliente de IA de larga vida que comparten todas las extracciones"""
+    if os.environ.get('LLM_TRANSPORT', 'emergent') == 'gemini_http':
+        transport = GeminiHttpTransport(
+            api_key=os.environ.get('GOOGLE_API_KEY', ''),
+            base_url=os.environ.get('GEMINI_BASE_URL', 'https://generativelanguage.googleapis.com')
+        )
+    else:
+        transport = EmergentTransport(api_key=os.environ.get('EMERGENT_LLM_KEY'))
+    
+    return ExtractionClient(
+        transport=transport,
+        model="gemini-2.0-flash",
+        system_message="Eres un experto en extracción de datos de facturas. Extrae la información solicitada de manera precisa.",
+        deadline=float(os.environ.get('LLM_DEADLINE_SECONDS', '60')),
+        attempt_timeout=float(os.environ.get('LLM_ATTEMPT_TIMEOUT_SECONDS', '30')),
+        max_retries=int(os.environ.get('LLM_MAX_RETRIES', '3')),
+        breaker=CircuitBreaker(cooldown=float(os.environ.get('LLM_CIRCUIT_COOLDOWN_SECONDS', '30'))),
+        rate_limiter=llm_rate_limiter
+    )
+
+
+# Cuota del proveedor compartida por todos los workers de uvicorn (0 desactiva el límite)
+llm_rate_limiter = MongoRateLimiter(
+    db.llm_rate_limits,
+    rpm=int(os.environ.get('LLM_RPM_LIMIT', '60')),
+    tpm=int(os.environ.get('LLM_TPM_LIMIT', '0'))
+)
+
+# Backend de extracción: gemini | local-text | stub (pruebas de carga sin red)
+EXTRACTOR_BACKEND = os.environ.get('EXTRACTOR_BACKEND', 'gemini')
+
+# Cascada de modelos de Gemini, del más barato al más capaz (p. ej. "gemini-2.0-flash-lite,gemini-2.0-flash"),
+# y su costo en USD por millón de tokens de entrada para estimar el gasto de cada nivel
+LLM_CASCADE_MODELS = [m.strip() for m in os.environ.get('LLM_CASCADE_MODELS', '').split(',') if m.strip()]
+LLM_CASCADE_COSTS = [float(c) for c in os.environ.get('LLM_CASCADE_COSTS', '').split(',') if c.strip()]
+
+
+def create_extractor() -> Extractor:
+    """Crea el backend de extracción configurado en EXTRACTOR_BACKEND"""
+    if EXTRACTOR_BACKEND == 'gemini':
+        if len(LLM_CASCADE_MODELS) > 1:
+            tiers = [
+                CascadeTier(
+                    model,
+                    GeminiExtractor(extraction_client, EXTRACTION_PROMPT, model=model),
+                    LLM_CASCADE_COSTS[i] if i < len(LLM_CASCADE_COSTS) else 0.0
+                )
+                for i, model in enumerate(LLM_CASCADE_MODELS)
+            ]
+            return CascadeExtractor(tiers, EXTRACTION_PROMPT)
+        return GeminiExtractor(extraction_client, EXTRACTION_PROMPT)
+    if EXTRACTOR_BACKEND == 'local-text':
+        return LocalTextExtractor()
+    if EXTRACTOR_BACKEND == 'stub':
+        seed = os.environ.get('STUB_EXTRACTOR_SEED')
+        return StubExtractor(
+            latency=float(os.environ.get('STUB_EXTRACTOR_LATENCY_MS', '500')) / 1000,
+            jitter=float(os.environ.get('STUB_EXTRACTOR_JITTER_MS', '0')) / 1000,
+            error_rate=float(os.environ.get('STUB_EXTRACTOR_ERROR_RATE', '0')),
+            seed=int(seed) if seed else None
+        )
+    raise ValueError(f"EXTRACTOR_BACKEND desconocido: {EXTRACTOR_BACKEND}")
+
+
+# El cliente de Gemini solo se crea si se usa: el stub no necesita credenciales ni red
+extraction_client = create_extraction_client() if EXTRACTOR_BACKEND == 'gemini' else None
+extractor = create_extractor()
+
+
 # Routes
 @api_router.get("/")
 async def root():
@@ -294,12 +484,26 @@ async def logout():
     return {"message": "Logout successful"}
 
 
+# Empresas activas en memoria: casi todos los endpoints empiezan por buscar la empresa.
+# Los cambios hechos en otros procesos tardan hasta este TTL en verse (0 desactiva la caché)
+EMPRESA_CACHE_TTL_SECONDS = float(os.environ.get('EMPRESA_CACHE_TTL_SECONDS', '30'))
+empresa_cache = EmpresaCache(db.empresas, EMPRESA_CACHE_TTL_SECONDS)
+
+
+async def get_active_empresa(empresa_id: str) -> dict:
+    """Dependencia: la empresa activa del path o 404"""
+    empresa = await empresa_cache.get(empresa_id)
+    if not empresa:
+        raise HTTPException(status_code=404, detail="Empresa no encontrada")
+    return empresa
+
+
 # ENDPOINTS DE EMPRESAS
 @api_router.get("/empresas", response_model=List[Empresa])
 async def get_empresas(current_user: UserData = Depends(get_current_user)):
     """Obtiene todas las empresas - Requiere autenticación"""
     try:
-        empresas = await db.empresas.find({"activa": True}).to_list(1000)
+        empresas = await empresa_cache.all()
         return [Empresa(**parse_from_mongo(empresa)) for empresa in empresas]
     except Exception as e:
         logging.error(f"Error obteniendo empresas: {str(e)}")
@@ -315,6 +519,7 @@ async def create_empresa(empresa: EmpresaCreate, current_user: UserData = Depend
         empresa_dict = prepare_for_mongo(empresa_obj.dict())
         
         await db.empresas.insert_one(empresa_dict)
+        empresa_cache.invalidate()
         return empresa_obj
     except Exception as e:
         logging.error(f"Error creando empresa: {str(e)}")
@@ -322,12 +527,9 @@ async def create_empresa(empresa: EmpresaCreate, current_user: UserData = Depend
 
 
 @api_router.get("/empresas/{empresa_id}", response_model=Empresa)
-async def get_empresa(empresa_id: str, current_user: UserData = Depends(get_current_user)):
+async def get_empresa(empresa_id: str, current_user: UserData = Depends(get_current_user), empresa: dict = Depends(get_active_empresa)):
     """Obtiene una empresa específica - Requiere autenticación"""
     try:
-        empresa = await db.empresas.find_one({"id": empresa_id, "activa": True})
-        if not empresa:
-            raise HTTPException(status_code=404, detail="Empresa no encontrada")
         return Empresa(**parse_from_mongo(empresa))
     except HTTPException:
         raise
@@ -344,6 +546,7 @@ async def update_empresa(empresa_id: str, empresa_update: EmpresaCreate, current
             {"id": empresa_id, "activa": True},
             {"$set": empresa_update.dict(exclude_unset=True)}
         )
+        empresa_cache.invalidate()
         
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Empresa no encontrada")
@@ -357,169 +560,556 @@ async def update_empresa(empresa_id: str, empresa_update: EmpresaCreate, current
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@api_router.post("/upload-pdf/{empresa_id}")
-async def upload_pdf(empresa_id: str, file: UploadFile = File(...), current_user: UserData = Depends(require_admin)):
-    """Procesa un PDF y extrae datos de la factura usando Gemini 2.5 Pro - Solo admin"""
+async def save_pdf_upload(file: UploadFile):
+    """Guarda un PDF subido con un nombre único en una sola pasada y devuelve (nombre_unico, ruta, sha256)"""
+    # Crear nombre único para el archivo
+    file_id = str(uuid.uuid4())
+    file_extension = ".pdf"
+    unique_filename = f"{file_id}{file_extension}"
+    upload_path = f"{UPLOAD_DIR}/{unique_filename}"
+    
+    # Guardar archivo permanentemente, calculando tamaño y hash mientras se escribe
+    size, content_hash = await storage.save_upload_stream(file, upload_path)
+    
+    logging.info(f"PDF saved successfully: {upload_path} ({size} bytes)")
+    return unique_filename, upload_path, content_hash
+
+
+async def normalize_for_llm(path: str) -> str:
+    """Devuelve una copia con las imágenes remuestreadas si reduce el tamaño; si no, la misma ruta"""
+    if PDF_IMAGE_TARGET_DPI <= 0:
+        return path
+    normalized_path, original_size, normalized_size = await pdf_preprocess.run_in_process(
+        normalize_pdf_images, path, PDF_IMAGE_TARGET_DPI, PDF_IMAGE_JPEG_QUALITY
+    )
+    if normalized_path is None:
+        return path
+    saved = original_size - normalized_size
+    logging.info(
+        f"Imágenes de {os.path.basename(path)} normalizadas a {PDF_IMAGE_TARGET_DPI} DPI: "
+        f"{original_size} -> {normalized_size} bytes (-{saved} bytes, {saved * 100 / original_size:.0f}%)"
+    )
+    return normalized_path
+
+
+async def extract_pdf_invoice_data(upload_path: str, content_hash: str, max_pages: int = PDF_EXTRACTION_PAGES) -> dict:
+    """Obtiene y valida los datos de la factura con el backend de extracción configurado
+
+    Con Gemini se usa antes la caché y la capa de texto del PDF, y el modelo recibe
+    solo las primeras `max_pages` páginas; el documento completo se envía únicamente
+    si con el recorte no se obtienen los campos requeridos.
+    """
+    if extractor.cacheable:
+        with span("cache"):
+            extracted_data = await extraction_cache.get(content_hash)
+        if extracted_data:
+            logging.info(f"Extracción obtenida de caché: {content_hash}")
+            return extracted_data
+    
+    if extractor.preprocess:
+        # Intentar primero con la capa de texto del PDF: milisegundos y sin costo de IA
+        with span("extraccion_local"):
+            local_data, confidence = await storage.run_io(extract_invoice_from_pdf, upload_path)
+        if confidence >= LOCAL_EXTRACTION_MIN_CONFIDENCE:
+            logging.info(f"Extracción local aceptada (confianza {confidence:.2f}): {content_hash}")
+            return local_data
+        logging.info(f"Extracción local insuficiente (confianza {confidence:.2f}), usando {extractor.name}")
+    
+    # Enviar solo las primeras páginas (y la del Total); el original completo queda guardado
+    trimmed_path = None
+    temp_paths = []
+    if max_pages and extractor.preprocess:
+        with span("recorte"):
+            trimmed_path, total_pages, sent_pages = await storage.run_io(trim_pdf, upload_path, max_pages)
+        if trimmed_path:
+            temp_paths.append(trimmed_path)
+            logging.info(f"PDF recortado para extracción: {sent_pages} de {total_pages} páginas")
+    
     try:
-        # Verificar que la empresa existe
-        empresa = await db.empresas.find_one({"id": empresa_id, "activa": True})
-        if not empresa:
-            raise HTTPException(status_code=404, detail="Empresa no encontrada")
+        candidates = [trimmed_path, upload_path] if trimmed_path else [upload_path]
+        for path in candidates:
+            is_full_document = path == upload_path
+            send_path = path
+            if extractor.preprocess:
+                with span("normalizacion"):
+                    send_path = await normalize_for_llm(path)
+                if send_path != path:
+                    temp_paths.append(send_path)
+            try:
+                started = time.perf_counter()
+                extracted_data = await extractor.extract(send_path)
+                llm_seconds = time.perf_counter() - started
+            except json.JSONDecodeError:
+                if not is_full_document:
+                    logging.info("Respuesta de IA inválida con el PDF recortado, reintentando con el documento completo")
+                    continue
+                # Si falla el procesamiento de IA, eliminar el archivo guardado
+                await storage.delete(upload_path)
+                raise HTTPException(status_code=500, detail="Error al procesar la respuesta de IA")
+            except CircuitOpenError:
+                raise
+            except LlmError as e:
+                raise HTTPException(status_code=503, detail=f"Servicio de IA no disponible: {str(e)}")
+            
+            # Validar datos extraídos
+            missing = [field for field in REQUIRED_INVOICE_FIELDS if extracted_data.get(field) is None]
+            if not missing:
+                break
+            if is_full_document:
+                raise HTTPException(status_code=400, detail=f"No se pudo extraer: {missing[0]}")
+            logging.info(f"Faltan {missing} en el PDF recortado, reintentando con el documento completo")
+    finally:
+        for temp_path in temp_paths:
+            await storage.delete(temp_path)
+    
+    if extractor.cacheable:
+        await extraction_cache.put(content_hash, extracted_data, llm_seconds)
+    return extracted_data
+
+
+def build_invoice_document(empresa_id: str, extracted_data: dict, unique_filename: str, original_filename: str) -> dict:
+    """Construye el documento de factura listo para insertarse en MongoDB"""
+    invoice_data = {
+        'id': str(uuid.uuid4()),
+        'empresa_id': empresa_id,  # Asociar con la empresa
+        'numero_factura': str(extracted_data['numero_factura']),
+        'numero_contrato': None,  # Se agregará manualmente
+        'nombre_proveedor': str(extracted_data['nombre_proveedor']),
+        'fecha_factura': str(extracted_data['fecha_factura']),
+        'monto': float(extracted_data['monto']),
+        'estado_pago': 'pendiente',
+        'fecha_creacion': datetime.now(timezone.utc),
+        'archivo_pdf': unique_filename,  # Guardar nombre único del archivo
+        'archivo_original': original_filename  # Guardar nombre original
+    }
+    
+    # Preparar para MongoDB
+    return prepare_for_mongo(invoice_data)
+
+
+def extraction_pages_for(empresa: Optional[dict]) -> int:
+    """Páginas a enviar a la IA según la configuración de la empresa"""
+    if empresa and empresa.get('paginas_extraccion') is not None:
+        return empresa['paginas_extraccion']
+    return PDF_EXTRACTION_PAGES
+
+
+def invoice_response_data(invoice_data: dict) -> dict:
+    """Crea la respuesta de una factura subida sin objetos datetime"""
+    return {
+        "id": invoice_data['id'],
+        "empresa_id": invoice_data['empresa_id'],
+        "numero_factura": invoice_data['numero_factura'],
+        "numero_contrato": invoice_data['numero_contrato'],  # NUEVO CAMPO
+        "nombre_proveedor": invoice_data['nombre_proveedor'],
+        "fecha_factura": fecha_factura_str(invoice_data['fecha_factura']),
+        "monto": invoice_data['monto'],
+        "estado_pago": invoice_data['estado_pago'],
+        "archivo_pdf": invoice_data['archivo_pdf'],
+        "archivo_original": invoice_data['archivo_original']
+    }
+
+
+async def process_pdf_job(job: dict) -> dict:
+    """Worker de la cola: extrae los datos del PDF guardado y crea la factura"""
+    async with latency_tracker.trace("procesar_pdf"):
+        payload = job['payload']
         
-        # Verificar que es un PDF
-        if not file.filename.endswith('.pdf'):
-            raise HTTPException(status_code=400, detail="Solo se permiten archivos PDF")
+        # Si un intento previo alcanzó a insertar la factura, no duplicarla
+        existing = await db.invoices.find_one({"archivo_pdf": payload['archivo_pdf']})
+        if existing:
+            return invoice_response_data(existing)
         
-        # Crear nombre único para el archivo
-        file_id = str(uuid.uuid4())
-        file_extension = ".pdf"
-        unique_filename = f"{file_id}{file_extension}"
-        upload_path = f"{UPLOAD_DIR}/{unique_filename}"
+        upload_path = f"{UPLOAD_DIR}/{payload['archivo_pdf']}"
+        if not await storage.exists(upload_path):
+            raise PermanentJobError(f"Archivo PDF no encontrado: {payload['archivo_pdf']}")
         
-        # Ensure upload directory exists
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        # Trabajos encolados antes de guardar el hash en el payload
+        content_hash = payload.get('sha256') or await storage.file_sha256(upload_path)
         
-        # Guardar archivo permanentemente
-        with open(upload_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        empresa = await empresa_cache.get(payload['empresa_id'])
         
-        logging.info(f"PDF saved successfully: {upload_path}")
+        try:
+            extracted_data = await extract_pdf_invoice_data(upload_path, content_hash, extraction_pages_for(empresa))
+        except CircuitOpenError as e:
+            # La IA está caída: el trabajo espera en la cola en vez de fallar
+            raise RetryLaterError(str(e), e.retry_after)
+        except HTTPException as e:
+            if e.status_code == 503:
+                raise
+            raise PermanentJobError(e.detail)
         
-        # Guardar temporalmente para procesamiento con Gemini
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            temp_file.write(content)
-            temp_file_path = temp_file.name
+        invoice_data = build_invoice_document(payload['empresa_id'], extracted_data, payload['archivo_pdf'], payload['archivo_original'])
+        with span("insertar"):
+            await db.invoices.insert_one(invoice_data)
+        return invoice_response_data(invoice_data)
 
-        try:
-            # Configurar Gemini para extraer datos
-            chat = LlmChat(
-                api_key=os.environ['EMERGENT_LLM_KEY'],
-                session_id=f"pdf-extract-{uuid.uuid4()}",
-                system_message="Eres un experto en extracción de datos de facturas. Extrae la información solicitada de manera precisa."
-            ).with_model("gemini", "gemini-2.0-flash")
-
-            # Crear el objeto de archivo para Gemini
-            pdf_file = FileContentWithMimeType(
-                file_path=temp_file_path,
-                mime_type="application/pdf"
-            )
 
-            # Prompt para extraer datos específicos
-            prompt = """
-            Analiza este PDF de factura y extrae exactamente estos datos en formato JSON:
-            
-            {
-                "numero_factura": "número de factura encontrado",
-                "nombre_proveedor": "nombre del proveedor/empresa que emite la factura",
-                "fecha_factura": "fecha de la factura en formato YYYY-MM-DD",
-                "monto": "monto total a pagar como número decimal"
-            }
-            
-            IMPORTANTE:
-            - Devuelve SOLO el JSON sin texto adicional
-            - Si no encuentras algún dato, usa null
-            - El monto debe ser un número sin símbolos de moneda
-            - La fecha debe estar en formato YYYY-MM-DD
-            """
+job_queue = JobQueue(db.jobs, process_pdf_job, workers=JOB_WORKERS, lease_seconds=JOB_LEASE_SECONDS)
 
-            user_message = UserMessage(
-                text=prompt,
-                file_contents=[pdf_file]
-            )
 
-            # Obtener respuesta de Gemini
-            response = await chat.send_message(user_message)
+@api_router.post("/upload-pdf/{empresa_id}")
+async def upload_pdf(empresa_id: str, request: Request, file: UploadFile = File(...), current_user: UserData = Depends(require_admin)):
+    """Recibe un PDF y encola la extracción de datos de la factura con Gemini - Solo admin"""
+    try:
+        async with latency_tracker.trace("upload_pdf", request_started(request)):
+            # Verificar que la empresa existe
+            with span("buscar_empresa"):
+                empresa = await empresa_cache.get(empresa_id)
+            if not empresa:
+                raise HTTPException(status_code=404, detail="Empresa no encontrada")
             
-            # Procesar la respuesta
-            try:
-                # Extraer JSON de la respuesta
-                response_text = response.strip()
-                if response_text.startswith('```json'):
-                    response_text = response_text.replace('```json', '').replace('```', '').strip()
-                
-                extracted_data = json.loads(response_text)
-                
-                # Validar datos extraídos
-                required_fields = ['numero_factura', 'nombre_proveedor', 'fecha_factura', 'monto']
-                for field in required_fields:
-                    if field not in extracted_data or extracted_data[field] is None:
-                        raise HTTPException(status_code=400, detail=f"No se pudo extraer: {field}")
-                
-                # Crear factura en la base de datos
-                invoice_data = {
-                    'id': str(uuid.uuid4()),
-                    'empresa_id': empresa_id,  # Asociar con la empresa
-                    'numero_factura': str(extracted_data['numero_factura']),
-                    'numero_contrato': None,  # Se agregará manualmente
-                    'nombre_proveedor': str(extracted_data['nombre_proveedor']),
-                    'fecha_factura': str(extracted_data['fecha_factura']),
-                    'monto': float(extracted_data['monto']),
-                    'estado_pago': 'pendiente',
-                    'fecha_creacion': datetime.now(timezone.utc),
-                    'archivo_pdf': unique_filename,  # Guardar nombre único del archivo
-                    'archivo_original': file.filename  # Guardar nombre original
-                }
-                
-                # Preparar para MongoDB
-                invoice_data = prepare_for_mongo(invoice_data)
-                
-                # Insertar en la base de datos
-                await db.invoices.insert_one(invoice_data)
-                
-                # Crear respuesta sin objetos datetime
-                response_data = {
-                    "id": invoice_data['id'],
-                    "empresa_id": invoice_data['empresa_id'],
-                    "numero_factura": invoice_data['numero_factura'],
-                    "numero_contrato": invoice_data['numero_contrato'],  # NUEVO CAMPO
-                    "nombre_proveedor": invoice_data['nombre_proveedor'],
-                    "fecha_factura": invoice_data['fecha_factura'],
-                    "monto": invoice_data['monto'],
-                    "estado_pago": invoice_data['estado_pago'],
-                    "archivo_pdf": invoice_data['archivo_pdf'],
-                    "archivo_original": invoice_data['archivo_original']
-                }
-                
-                return JSONResponse(content={
-                    "success": True,
-                    "message": "PDF procesado exitosamente",
-                    "data": response_data
+            # Verificar que es un PDF
+            if not file.filename.endswith('.pdf'):
+                raise HTTPException(status_code=400, detail="Solo se permiten archivos PDF")
+            
+            with span("guardar_archivo"):
+                unique_filename, upload_path, content_hash = await save_pdf_upload(file)
+            
+            # La extracción se hace en segundo plano; el cliente consulta /api/jobs/{id}
+            with span("encolar"):
+                job = await job_queue.enqueue("upload_pdf", {
+                    "empresa_id": empresa_id,
+                    "archivo_pdf": unique_filename,
+                    "archivo_original": file.filename,
+                    "sha256": content_hash
                 })
-                
-            except json.JSONDecodeError:
-                # Si falla el procesamiento de IA, eliminar el archivo guardado
-                if os.path.exists(upload_path):
-                    os.unlink(upload_path)
-                raise HTTPException(status_code=500, detail="Error al procesar la respuesta de IA")
-                
-        finally:
-            # Limpiar archivo temporal
-            os.unlink(temp_file_path)
+        
+        return JSONResponse(status_code=202, content={
+            "success": True,
+            "message": "PDF recibido, procesando en segundo plano",
+            "job_id": job['id'],
+            "estado": job['estado']
+        })
             
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error procesando PDF: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error procesando el PDF: {str(e)}")
 
 
-@api_router.get("/invoices/{empresa_id}", response_model=List[Invoice])
-async def get_invoices(empresa_id: str, estado: Optional[str] = None, proveedor: Optional[str] = None, current_user: UserData = Depends(get_current_user)):
-    """Obtiene todas las facturas de una empresa - Requiere autenticación"""
+# Lotes en curso: siguen aunque el cliente se desconecte (la referencia evita que el GC los recolecte)
+batch_tasks = set()
+
+
+def batch_task_done(task: asyncio.Task):
+    batch_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logging.error(f"Error procesando lote de PDFs: {str(task.exception())}")
+
+
+async def insert_batch_invoices(invoices: List[dict]) -> dict:
+    """Inserta las facturas del lote con un solo insert_many; borra los PDFs de las que no quedaron guardadas"""
     try:
-        # Verificar que la empresa existe
-        empresa = await db.empresas.find_one({"id": empresa_id, "activa": True})
-        if not empresa:
-            raise HTTPException(status_code=404, detail="Empresa no encontrada")
-        
-        filter_query = {"empresa_id": empresa_id}
-        
-        if estado:
-            filter_query['estado_pago'] = estado
-        if proveedor:
-            filter_query['nombre_proveedor'] = {"$regex": proveedor, "$options": "i"}
-        
-        invoices = await db.invoices.find(filter_query).to_list(1000)
-        return [Invoice(**parse_from_mongo(invoice)) for invoice in invoices]
+        await db.invoices.insert_many(invoices, ordered=False)
+        return {"insertadas": len(invoices)}
+    except BulkWriteError as e:
+        logging.error(f"Error insertando facturas del lote: {str(e)}")
+        resumen = {"error": "Algunas facturas no se pudieron insertar"}
+    except Exception as e:
+        logging.error(f"Error insertando facturas del lote: {str(e)}")
+        resumen = {"error": str(e)}
+    
+    # Con ordered=False pudo quedar guardada una parte: se confirma en la base por el
+    # _id que insert_many asigna a cada documento antes de enviarlo
+    ids = [invoice['_id'] for invoice in invoices if '_id' in invoice]
+    inserted = {doc['_id'] for doc in await db.invoices.find({"_id": {"$in": ids}}, {"_id": 1}).to_list(len(ids))}
+    for invoice in invoices:
+        if invoice.get('_id') not in inserted:
+            await storage.delete(f"{UPLOAD_DIR}/{invoice['archivo_pdf']}")
+    resumen["insertadas"] = len(inserted)
+    return resumen
+
+
+@api_router.post("/upload-pdf-batch/{empresa_id}")
+async def upload_pdf_batch(empresa_id: str, files: List[UploadFile] = File(...), current_user: UserData = Depends(require_admin), empresa: dict = Depends(get_active_empresa)):
+    """Procesa varios PDFs en una sola petición con extracción concurrente - Solo admin
+    
+    Responde en NDJSON: una línea por archivo en cuanto termina su extracción y una
+    línea final de resumen cuando las facturas se insertan con un solo insert_many.
+    El lote corre en una tarea aparte: si el cliente se desconecta, las facturas
+    extraídas se insertan igual.
+    """
+    # Guardar todos los archivos antes de responder: FastAPI cierra los
+    # UploadFile al salir del endpoint, antes de que termine el streaming
+    stored = []
+    for file in files:
+        if not file.filename.endswith('.pdf'):
+            stored.append((file.filename, None, None, None))
+            continue
+        unique_filename, upload_path, content_hash = await save_pdf_upload(file)
+        stored.append((file.filename, unique_filename, upload_path, content_hash))
+    
+    semaphore = asyncio.Semaphore(BATCH_EXTRACTION_CONCURRENCY)
+    max_pages = extraction_pages_for(empresa)
+    
+    async def process(original_filename, unique_filename, upload_path, content_hash):
+        if unique_filename is None:
+            return {"archivo": original_filename, "success": False, "error": "Solo se permiten archivos PDF"}, None
+        async with semaphore:
+            try:
+                extracted_data = await extract_pdf_invoice_data(upload_path, content_hash, max_pages)
+                invoice_data = build_invoice_document(empresa_id, extracted_data, unique_filename, original_filename)
+                return {"archivo": original_filename, "success": True, "data": invoice_response_data(invoice_data)}, invoice_data
+            except Exception as e:
+                detail = e.detail if isinstance(e, HTTPException) else str(e)
+                logging.error(f"Error procesando PDF {original_filename} en lote: {detail}")
+                await storage.delete(upload_path)
+                result = {"archivo": original_filename, "success": False, "error": detail}
+                if isinstance(e, CircuitOpenError):
+                    result["reintentar_en"] = round(e.retry_after, 1)
+                return result, None
+    
+    results = asyncio.Queue()
+    
+    async def run_batch():
+        invoices = []
+        errores = 0
+        try:
+            for task in asyncio.as_completed([process(*item) for item in stored]):
+                result, invoice_data = await task
+                if invoice_data:
+                    invoices.append(invoice_data)
+                else:
+                    errores += 1
+                results.put_nowait(result)
+            
+            resumen = {"resumen": True, "total": len(stored), "insertadas": 0, "errores": errores}
+            if invoices:
+                resumen.update(await insert_batch_invoices(invoices))
+            results.put_nowait(resumen)
+        finally:
+            results.put_nowait(None)
+    
+    batch = asyncio.create_task(run_batch())
+    batch_tasks.add(batch)
+    batch.add_done_callback(batch_task_done)
+    
+    async def stream_results():
+        while True:
+            line = await results.get()
+            if line is None:
+                break
+            yield json.dumps(line) + "\n"
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
+@api_router.get("/jobs/{job_id}")
+async def get_job(job_id: str, current_user: UserData = Depends(get_current_user)):
+    """Consulta el estado de un trabajo de extracción - Requiere autenticación"""
+    try:
+        job = await job_queue.get(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+        job.pop('lease_expira', None)
+        job.pop('worker', None)
+        return job
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error obteniendo trabajo: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def requested_invoice_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Convierte `?fields=a,b` en la lista de campos de factura pedidos (siempre con id); None si no se pidió"""
+    if not fields:
+        return None
+    requested = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in requested if field not in Invoice.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Campos desconocidos: {', '.join(unknown)}")
+    if 'id' not in requested:
+        requested.insert(0, 'id')
+    return requested
+
+
+def fields_projection(fields: List[str], *internal: str) -> dict:
+    """Proyección de Mongo con los campos pedidos más los que el endpoint necesita internamente"""
+    projection = {"_id": 0}
+    for field in [*fields, *internal]:
+        projection[field] = 1
+    return projection
+
+
+def partial_documents(documents: List[dict], fields: List[str]) -> List[dict]:
+    return [parse_from_mongo({field: doc[field] for field in fields if field in doc}) for doc in documents]
+
+
+def partial_response(content) -> Response:
+    """Respuesta JSON sin pasar por los modelos: los objetos parciales no validarían contra Invoice"""
+    return FastJSONResponse(content)
+
+
+# Valor por defecto de cada campo de Invoice, en el orden del modelo
+INVOICE_DEFAULTS = {
+    name: None if field.is_required() or field.default_factory else field.default
+    for name, field in Invoice.model_fields.items()
+}
+
+
+def invoice_document(doc: dict) -> dict:
+    """Factura de Mongo con la misma forma y JSON que `Invoice`, sin crear ni validar el modelo
+
+    Solo para documentos que escribe la propia aplicación (ya validados al insertarse).
+    """
+    item = {name: doc.get(name, default) for name, default in INVOICE_DEFAULTS.items()}
+    item['fecha_factura'] = fecha_factura_str(item['fecha_factura'])
+    if item['monto'] is not None:
+        item['monto'] = float(item['monto'])
+    if isinstance(item['fecha_creacion'], str):
+        item['fecha_creacion'] = datetime.fromisoformat(item['fecha_creacion'])
+    return item
+
+
+# Listado sin paginar (hasta 1000 facturas) cuando no se pide limit ni cursor; el frontend actual lo usa
+INVOICES_LEGACY_LIST = os.environ.get('INVOICES_LEGACY_LIST', 'true').lower() == 'true'
+INVOICES_PAGE_SIZE = int(os.environ.get('INVOICES_PAGE_SIZE', '100'))
+INVOICES_MAX_PAGE_SIZE = 500
+# Serializar los listados completos directo a bytes, sin modelos por documento ni response_model
+INVOICES_FAST_JSON = os.environ.get('INVOICES_FAST_JSON', 'true').lower() == 'true'
+# Documentos que Mongo entrega por lote al exportar en streaming, y líneas por bloque enviado
+INVOICES_STREAM_BATCH_SIZE = int(os.environ.get('INVOICES_STREAM_BATCH_SIZE', '1000'))
+INVOICES_STREAM_CHUNK_LINES = 200
+
+# Campos por los que se puede ordenar (`sort=monto`, `sort=-fecha_factura`) y el campo de Mongo que usan
+INVOICE_SORT_FIELDS = {
+    "fecha_creacion": "fecha_creacion",
+    "fecha_factura": "fecha_factura",
+    "monto": "monto",
+    "proveedor": "proveedor_normalizado",
+}
+
+
+def invoice_filters(
+    estado: Optional[str] = None,
+    proveedor: Optional[str] = None,
+    fecha_desde: Optional[date] = None,
+    fecha_hasta: Optional[date] = None,
+    monto_min: Optional[float] = None,
+    monto_max: Optional[float] = None
+) -> dict:
+    """Filtros comunes de los listados de facturas (sin empresa_id) como condición de Mongo"""
+    filter_query = {}
+    if estado:
+        filter_query['estado_pago'] = estado
+    if proveedor:
+        filter_query['proveedor_normalizado'] = supplier_prefix_query(proveedor)
+    
+    # fecha_factura se guarda como fecha BSON; las facturas que aún no pasan por
+    # migrate_invoice_fields.py la tienen como texto YYYY-MM-DD y se comparan como texto
+    fecha_range, fecha_text_range = {}, {}
+    if fecha_desde:
+        fecha_range['$gte'] = datetime.combine(fecha_desde, datetime.min.time())
+        fecha_text_range['$gte'] = fecha_desde.isoformat()
+    if fecha_hasta:
+        fecha_range['$lte'] = datetime.combine(fecha_hasta, datetime.min.time())
+        fecha_text_range['$lte'] = fecha_hasta.isoformat()
+    if fecha_range:
+        filter_query['$or'] = [{'fecha_factura': fecha_range}, {'fecha_factura': fecha_text_range}]
+    
+    monto_range = {}
+    if monto_min is not None:
+        monto_range['$gte'] = monto_min
+    if monto_max is not None:
+        monto_range['$lte'] = monto_max
+    if monto_range:
+        filter_query['monto'] = monto_range
+    return filter_query
+
+
+def parse_invoice_sort(sort: Optional[str]):
+    """`-campo` ordena descendente; devuelve (campo_mongo, dirección)"""
+    sort = sort or DEFAULT_SORT
+    direction = -1 if sort.startswith('-') else 1
+    field = INVOICE_SORT_FIELDS.get(sort.lstrip('-'))
+    if field is None:
+        raise HTTPException(status_code=400, detail=f"Orden no soportado: {sort}. Opciones: {', '.join(INVOICE_SORT_FIELDS)}")
+    return field, direction
+
+
+@api_router.get("/invoices/{empresa_id}", response_model=Union[InvoicePage, List[Invoice]])
+async def get_invoices(
+    empresa_id: str,
+    filters: dict = Depends(invoice_filters),
+    sort: Optional[str] = None,
+    limit: Optional[int] = Query(default=None, ge=1, le=INVOICES_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    incluir_total: bool = False,
+    fields: Optional[str] = None,
+    current_user: UserData = Depends(get_current_user),
+    empresa: dict = Depends(get_active_empresa)
+):
+    """Obtiene las facturas de una empresa - Requiere autenticación
+    
+    Filtros: estado, proveedor (prefijo), fecha_desde/fecha_hasta (fecha_factura)
+    y monto_min/monto_max. `sort` acepta fecha_creacion, fecha_factura, monto o
+    proveedor, con `-` para orden descendente (por defecto -fecha_creacion).
+    
+    Con `limit` y/o `cursor` responde por páginas: `next_cursor` se envía como
+    `cursor` para obtener la siguiente página (paginación por keyset sobre el
+    campo de orden e id) y `incluir_total` agrega el total de facturas del filtro.
+    `fields=id,monto,...` devuelve solo esos campos, sin validar contra el modelo.
+    """
+    try:
+        selected_fields = requested_invoice_fields(fields)
+        sort_field, sort_direction = parse_invoice_sort(sort)
+        
+        filter_query = {"empresa_id": empresa_id, **filters}
+        
+        if limit is None and cursor is None and INVOICES_LEGACY_LIST:
+            projection = fields_projection(selected_fields) if selected_fields else None
+            query = db.invoices.find(filter_query, projection).max_time_ms(max_time_ms("consulta"))
+            if sort:
+                query = query.sort(keyset_sort(sort_field, sort_direction))
+            invoices = await query.to_list(1000)
+            if selected_fields:
+                return partial_response(partial_documents(invoices, selected_fields))
+            if INVOICES_FAST_JSON:
+                return FastJSONResponse([invoice_document(invoice) for invoice in invoices])
+            return [Invoice(**parse_from_mongo(invoice)) for invoice in invoices]
+        
+        sort_key = sort or DEFAULT_SORT
+        page_size = limit or INVOICES_PAGE_SIZE
+        page_query = dict(filter_query)
+        if cursor:
+            try:
+                last_value, last_id = decode_cursor(cursor, sort_key)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            page_query = {"$and": [filter_query, keyset_condition(sort_field, sort_direction, last_value, last_id)]}
+        
+        # Se pide un documento extra para saber si hay otra página
+        # El cursor necesita el campo de orden aunque no se haya pedido
+        projection = fields_projection(selected_fields, sort_field) if selected_fields else None
+        invoices = await db.invoices.find(page_query, projection).sort(
+            keyset_sort(sort_field, sort_direction)
+        ).limit(page_size + 1).max_time_ms(max_time_ms("consulta")).to_list(page_size + 1)
+        next_cursor = None
+        if len(invoices) > page_size:
+            invoices = invoices[:page_size]
+            next_cursor = encode_cursor(invoices[-1].get(sort_field), invoices[-1]['id'], sort_key)
+        
+        total = await db.invoices.count_documents(filter_query, **max_time_option("consulta")) if incluir_total else None
+        if selected_fields:
+            return partial_response({
+                "items": partial_documents(invoices, selected_fields),
+                "next_cursor": next_cursor,
+                "total": total
+            })
+        if INVOICES_FAST_JSON:
+            return FastJSONResponse({
+                "items": [invoice_document(invoice) for invoice in invoices],
+                "next_cursor": next_cursor,
+                "total": total
+            })
+        return InvoicePage(
+            items=[Invoice(**parse_from_mongo(invoice)) for invoice in invoices],
+            next_cursor=next_cursor,
+            total=total
+        )
         
     except HTTPException:
         raise
@@ -528,6 +1118,51 @@ async def get_invoices(empresa_id: str, estado: Optional[str] = None, proveedor:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@api_router.get("/invoices/{empresa_id}/stream")
+async def stream_invoices(
+    empresa_id: str,
+    filters: dict = Depends(invoice_filters),
+    sort: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: UserData = Depends(get_current_user),
+    empresa: dict = Depends(get_active_empresa)
+):
+    """Exporta todas las facturas de una empresa como NDJSON (una factura por línea) - Requiere autenticación
+    
+    Sin límite de filas: recorre el cursor de Mongo por lotes y envía las líneas
+    conforme llegan, sin armar la lista en memoria. Acepta los mismos filtros,
+    `sort` y `fields` que GET /api/invoices/{empresa_id}. Si la exportación falla
+    a medias, la última línea es {"error": "..."}.
+    """
+    selected_fields = requested_invoice_fields(fields)
+    sort_field, sort_direction = parse_invoice_sort(sort)
+    
+    projection = fields_projection(selected_fields) if selected_fields else {"_id": 0}
+    cursor = reports_db.invoices.find(
+        {"empresa_id": empresa_id, **filters}, projection
+    ).sort(keyset_sort(sort_field, sort_direction)).batch_size(INVOICES_STREAM_BATCH_SIZE).max_time_ms(max_time_ms("exportacion"))
+    
+    async def stream_lines():
+        lines = []
+        try:
+            async for invoice in cursor:
+                item = partial_documents([invoice], selected_fields)[0] if selected_fields else invoice_document(invoice)
+                lines.append(dumps_bytes(item))
+                if len(lines) >= INVOICES_STREAM_CHUNK_LINES:
+                    yield b"\n".join(lines) + b"\n"
+                    lines = []
+            if lines:
+                yield b"\n".join(lines) + b"\n"
+        except Exception as e:
+            # El estado 200 ya se envió: el error va como última línea
+            logging.error(f"Error exportando facturas en streaming: {str(e)}")
+            yield dumps_bytes({"error": str(e)}) + b"\n"
+        finally:
+            await cursor.close()
+    
+    return StreamingResponse(stream_lines(), media_type="application/x-ndjson")
+
+
 @api_router.put("/invoices/{invoice_id}/estado")
 async def update_invoice_status(invoice_id: str, update: InvoiceUpdate, current_user: UserData = Depends(require_admin)):
     """Actualiza el estado de pago de una factura - Solo admin"""
@@ -576,7 +1211,10 @@ async def update_invoice_provider(invoice_id: str, update: InvoiceProviderUpdate
     try:
         result = await db.invoices.update_one(
             {"id": invoice_id},
-            {"$set": {"nombre_proveedor": update.nombre_proveedor}}
+            {"$set": {
+                "nombre_proveedor": update.nombre_proveedor,
+                "proveedor_normalizado": normalize_supplier_name(update.nombre_proveedor)
+            }}
         )
         
         if result.matched_count == 0:
@@ -617,43 +1255,42 @@ async def update_invoice_number(invoice_id: str, update: InvoiceNumberUpdate, cu
 
 
 @api_router.post("/invoices/{invoice_id}/upload-comprobante")
-async def upload_comprobante_pago(invoice_id: str, file: UploadFile = File(...), current_user: UserData = Depends(require_admin)):
+async def upload_comprobante_pago(invoice_id: str, request: Request, file: UploadFile = File(...), current_user: UserData = Depends(require_admin)):
     """Sube un comprobante de pago para una factura - Solo admin"""
     try:
-        # Verificar que la factura existe
-        invoice = await db.invoices.find_one({"id": invoice_id})
-        if not invoice:
-            raise HTTPException(status_code=404, detail="Factura no encontrada")
-        
-        # Verificar que es un PDF
-        if not file.filename.endswith('.pdf'):
-            raise HTTPException(status_code=400, detail="Solo se permiten archivos PDF")
-        
-        # Crear nombre único para el archivo
-        unique_filename = f"comprobante_{uuid.uuid4()}_{file.filename}"
-        file_path = f"{UPLOAD_DIR}/{unique_filename}"
-        
-        # Ensure upload directory exists
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
-        
-        # Guardar archivo
-        content = await file.read()
-        with open(file_path, "wb") as buffer:
-            buffer.write(content)
-        
-        logging.info(f"Comprobante saved successfully: {file_path}")
-        
-        # Actualizar la factura con la información del comprobante
-        result = await db.invoices.update_one(
-            {"id": invoice_id},
-            {"$set": {
-                "comprobante_pago": unique_filename,
-                "comprobante_original": file.filename
-            }}
-        )
-        
-        if result.matched_count == 0:
-            raise HTTPException(status_code=404, detail="Factura no encontrada")
+        async with latency_tracker.trace("upload_comprobante_pago", request_started(request)):
+            # Verificar que la factura existe
+            with span("buscar_factura"):
+                invoice = await db.invoices.find_one({"id": invoice_id})
+            if not invoice:
+                raise HTTPException(status_code=404, detail="Factura no encontrada")
+            
+            # Verificar que es un PDF
+            if not file.filename.endswith('.pdf'):
+                raise HTTPException(status_code=400, detail="Solo se permiten archivos PDF")
+            
+            # Crear nombre único para el archivo
+            unique_filename = f"comprobante_{uuid.uuid4()}_{file.filename}"
+            file_path = f"{UPLOAD_DIR}/{unique_filename}"
+            
+            # Guardar archivo por bloques
+            with span("guardar_archivo"):
+                await storage.save_upload_stream(file, file_path)
+            
+            logging.info(f"Comprobante saved successfully: {file_path}")
+            
+            # Actualizar la factura con la información del comprobante
+            with span("actualizar_factura"):
+                result = await db.invoices.update_one(
+                    {"id": invoice_id},
+                    {"$set": {
+                        "comprobante_pago": unique_filename,
+                        "comprobante_original": file.filename
+                    }}
+                )
+            
+            if result.matched_count == 0:
+                raise HTTPException(status_code=404, detail="Factura no encontrada")
         
         return {
             "success": True,
@@ -666,15 +1303,29 @@ async def upload_comprobante_pago(invoice_id: str, file: UploadFile = File(...),
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@api_router.post("/invoices/{invoice_id}/upload-xml")
-async def upload_xml_file(invoice_id: str, file: UploadFile = File(...), current_user: UserData = Depends(require_admin)):
-    """Sube un archivo XML para una factura - Solo admin"""
+async def verify_invoice_against_cfdi(invoice: dict, xml_path: str) -> Optional[dict]:
+    """Compara una factura con su CFDI; devuelve None si el XML no es un CFDI legible"""
+    try:
+        cfdi_data = await storage.run_io(parse_cfdi, xml_path)
+    except CfdiError as e:
+        logging.info(f"XML sin datos CFDI verificables para factura {invoice['id']}: {str(e)}")
+        return None
+    
+    verificacion = compare_with_invoice(cfdi_data, invoice)
+    verificacion["fecha_verificacion"] = datetime.now(timezone.utc).isoformat()
+    if not verificacion["coincide"]:
+        logging.warning(f"Factura {invoice['id']} no coincide con su CFDI: {verificacion['diferencias']}")
+    return verificacion
+
+
+@api_router.post("/upload-xml/{empresa_id}")
+async def upload_xml_invoice(empresa_id: str, file: UploadFile = File(...), current_user: UserData = Depends(require_admin), empresa: dict = Depends(get_active_empresa)):
+    """Crea una factura directamente desde un CFDI XML, sin IA - Solo admin
+    
+    Si la empresa ya tiene una factura del mismo proveedor con el mismo número y sin XML (p. ej. extraída
+    de su PDF), el XML se asocia a ella y se verifican monto y fecha.
+    """
     try:
-        # Verificar que la factura existe
-        invoice = await db.invoices.find_one({"id": invoice_id})
-        if not invoice:
-            raise HTTPException(status_code=404, detail="Factura no encontrada")
-        
         # Verificar que es un archivo XML
         if not file.filename.lower().endswith('.xml'):
             raise HTTPException(status_code=400, detail="Solo se permiten archivos XML")
@@ -683,27 +1334,121 @@ async def upload_xml_file(invoice_id: str, file: UploadFile = File(...), current
         unique_filename = f"xml_{uuid.uuid4()}_{file.filename}"
         file_path = f"{UPLOAD_DIR}/{unique_filename}"
         
-        # Guardar archivo
-        content = await file.read()
-        with open(file_path, "wb") as buffer:
-            buffer.write(content)
+        # Guardar archivo por bloques
+        await storage.save_upload_stream(file, file_path)
         
-        # Actualizar la factura con la información del XML
-        result = await db.invoices.update_one(
-            {"id": invoice_id},
-            {"$set": {
-                "archivo_xml": unique_filename,
-                "xml_original": file.filename
-            }}
-        )
+        try:
+            cfdi_data = await storage.run_io(parse_cfdi, file_path)
+        except CfdiError as e:
+            await storage.delete(file_path)
+            raise HTTPException(status_code=400, detail=f"CFDI inválido: {str(e)}")
+        
+        # Asociar a la factura existente (extraída del PDF) si la hay. Los folios se
+        # repiten entre proveedores ("A-1", "1"): debe coincidir también el emisor
+        existing = await db.invoices.find_one({
+            "empresa_id": empresa_id,
+            "numero_factura": cfdi_data['numero_factura'],
+            "proveedor_normalizado": normalize_supplier_name(cfdi_data['nombre_proveedor']),
+            "archivo_xml": None
+        })
+        if existing:
+            verificacion = compare_with_invoice(cfdi_data, existing)
+            verificacion["fecha_verificacion"] = datetime.now(timezone.utc).isoformat()
+            await db.invoices.update_one(
+                {"id": existing['id']},
+                {"$set": {
+                    "archivo_xml": unique_filename,
+                    "xml_original": file.filename,
+                    "verificacion_xml": verificacion
+                }}
+            )
+            return {
+                "success": True,
+                "message": "XML asociado a la factura existente",
+                "invoice_id": existing['id'],
+                "xml_filename": unique_filename,
+                "verificacion": verificacion
+            }
         
-        if result.matched_count == 0:
-            raise HTTPException(status_code=404, detail="Factura no encontrada")
+        # Crear factura en la base de datos
+        invoice_data = {
+            'id': str(uuid.uuid4()),
+            'empresa_id': empresa_id,
+            'numero_factura': cfdi_data['numero_factura'],
+            'numero_contrato': None,  # Se agregará manualmente
+            'nombre_proveedor': cfdi_data['nombre_proveedor'],
+            'fecha_factura': cfdi_data['fecha_factura'],
+            'monto': cfdi_data['monto'],
+            'estado_pago': 'pendiente',
+            'fecha_creacion': datetime.now(timezone.utc),
+            'archivo_pdf': None,
+            'archivo_original': None,
+            'archivo_xml': unique_filename,
+            'xml_original': file.filename
+        }
+        invoice_data = prepare_for_mongo(invoice_data)
+        await db.invoices.insert_one(invoice_data)
+        
+        # Misma forma que el resto de endpoints de facturas, sin los campos internos (monto_centavos...)
+        return FastJSONResponse({
+            "success": True,
+            "message": "Factura creada desde XML exitosamente",
+            "data": invoice_document(invoice_data)
+        })
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error procesando XML: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error procesando el XML: {str(e)}")
+
+
+@api_router.post("/invoices/{invoice_id}/upload-xml")
+async def upload_xml_file(invoice_id: str, request: Request, file: UploadFile = File(...), current_user: UserData = Depends(require_admin)):
+    """Sube un archivo XML para una factura - Solo admin"""
+    try:
+        async with latency_tracker.trace("upload_xml_file", request_started(request)):
+            # Verificar que la factura existe
+            with span("buscar_factura"):
+                invoice = await db.invoices.find_one({"id": invoice_id})
+            if not invoice:
+                raise HTTPException(status_code=404, detail="Factura no encontrada")
+            
+            # Verificar que es un archivo XML
+            if not file.filename.lower().endswith('.xml'):
+                raise HTTPException(status_code=400, detail="Solo se permiten archivos XML")
+            
+            # Crear nombre único para el archivo
+            unique_filename = f"xml_{uuid.uuid4()}_{file.filename}"
+            file_path = f"{UPLOAD_DIR}/{unique_filename}"
+            
+            # Guardar archivo por bloques
+            with span("guardar_archivo"):
+                await storage.save_upload_stream(file, file_path)
+            
+            # Verificar monto y fecha de la factura contra el CFDI (si lo es)
+            with span("verificar_cfdi"):
+                verificacion = await verify_invoice_against_cfdi(invoice, file_path)
+            
+            # Actualizar la factura con la información del XML
+            with span("actualizar_factura"):
+                result = await db.invoices.update_one(
+                    {"id": invoice_id},
+                    {"$set": {
+                        "archivo_xml": unique_filename,
+                        "xml_original": file.filename,
+                        "verificacion_xml": verificacion
+                    }}
+                )
+            
+            if result.matched_count == 0:
+                raise HTTPException(status_code=404, detail="Factura no encontrada")
         
         return {
             "success": True,
             "message": "Archivo XML subido correctamente",
-            "xml_filename": unique_filename
+            "xml_filename": unique_filename,
+            "verificacion": verificacion
         }
         
     except Exception as e:
@@ -731,13 +1476,14 @@ async def download_invoice_pdf(invoice_id: str, current_user: UserData = Depends
         logging.info(f"Intentando descargar: {file_path}")
         logging.info(f"UPLOAD_DIR: {UPLOAD_DIR}")
         logging.info(f"archivo_pdf: {invoice['archivo_pdf']}")
-        logging.info(f"¿Existe el archivo?: {os.path.exists(file_path)}")
+        file_exists = await storage.exists(file_path)
+        logging.info(f"¿Existe el archivo?: {file_exists}")
         
         # Verificar que el archivo existe
-        if not os.path.exists(file_path):
+        if not file_exists:
             # Intentar listar archivos en el directorio
             try:
-                files_in_dir = os.listdir(UPLOAD_DIR)
+                files_in_dir = await storage.listdir(UPLOAD_DIR)
                 logging.error(f"Archivos en {UPLOAD_DIR}: {len(files_in_dir)} archivos")
                 logging.error(f"Archivo buscado: {invoice['archivo_pdf']}")
             except Exception as e:
@@ -779,7 +1525,7 @@ async def download_comprobante_pago(invoice_id: str, current_user: UserData = De
         file_path = f"{UPLOAD_DIR}/{invoice['comprobante_pago']}"
         
         # Verificar que el archivo existe
-        if not os.path.exists(file_path):
+        if not await storage.exists(file_path):
             raise HTTPException(status_code=404, detail="Archivo de comprobante no encontrado en el servidor")
         
         # Obtener el nombre original o usar uno por defecto
@@ -816,7 +1562,7 @@ async def download_xml_file(invoice_id: str, current_user: UserData = Depends(ge
         file_path = f"{UPLOAD_DIR}/{invoice['archivo_xml']}"
         
         # Verificar que el archivo existe
-        if not os.path.exists(file_path):
+        if not await storage.exists(file_path):
             raise HTTPException(status_code=404, detail="Archivo XML no encontrado en el servidor")
         
         # Obtener el nombre original o usar uno por defecto
@@ -851,12 +1597,11 @@ async def delete_comprobante_pago(invoice_id: str, current_user: UserData = Depe
         
         # Eliminar el archivo del servidor si existe
         file_path = f"{UPLOAD_DIR}/{invoice['comprobante_pago']}"
-        if os.path.exists(file_path):
-            try:
-                os.unlink(file_path)
+        try:
+            if await storage.delete(file_path):
                 logging.info(f"Comprobante eliminado del servidor: {file_path}")
-            except Exception as e:
-                logging.warning(f"No se pudo eliminar el archivo del comprobante: {str(e)}")
+        except Exception as e:
+            logging.warning(f"No se pudo eliminar el archivo del comprobante: {str(e)}")
         
         # Actualizar la factura para remover la información del comprobante
         result = await db.invoices.update_one(
@@ -894,32 +1639,29 @@ async def delete_invoice(invoice_id: str, current_user: UserData = Depends(requi
         # Eliminar el archivo PDF si existe
         if invoice.get('archivo_pdf'):
             file_path = f"{UPLOAD_DIR}/{invoice['archivo_pdf']}"
-            if os.path.exists(file_path):
-                try:
-                    os.unlink(file_path)
+            try:
+                if await storage.delete(file_path):
                     logging.info(f"Archivo PDF eliminado: {file_path}")
-                except Exception as e:
-                    logging.warning(f"No se pudo eliminar el archivo PDF: {str(e)}")
+            except Exception as e:
+                logging.warning(f"No se pudo eliminar el archivo PDF: {str(e)}")
         
         # Eliminar el comprobante de pago si existe
         if invoice.get('comprobante_pago'):
             comprobante_path = f"{UPLOAD_DIR}/{invoice['comprobante_pago']}"
-            if os.path.exists(comprobante_path):
-                try:
-                    os.unlink(comprobante_path)
+            try:
+                if await storage.delete(comprobante_path):
                     logging.info(f"Comprobante eliminado: {comprobante_path}")
-                except Exception as e:
-                    logging.warning(f"No se pudo eliminar el comprobante: {str(e)}")
+            except Exception as e:
+                logging.warning(f"No se pudo eliminar el comprobante: {str(e)}")
         
         # Eliminar el archivo XML si existe
         if invoice.get('archivo_xml'):
             xml_path = f"{UPLOAD_DIR}/{invoice['archivo_xml']}"
-            if os.path.exists(xml_path):
-                try:
-                    os.unlink(xml_path)
+            try:
+                if await storage.delete(xml_path):
                     logging.info(f"Archivo XML eliminado: {xml_path}")
-                except Exception as e:
-                    logging.warning(f"No se pudo eliminar el archivo XML: {str(e)}")
+            except Exception as e:
+                logging.warning(f"No se pudo eliminar el archivo XML: {str(e)}")
         
         # Eliminar la factura de la base de datos
         result = await db.invoices.delete_one({"id": invoice_id})
@@ -936,15 +1678,38 @@ async def delete_invoice(invoice_id: str, current_user: UserData = Depends(requi
         raise HTTPException(status_code=500, detail=f"Error eliminando la factura: {str(e)}")
 
 
+@api_router.get("/proveedores/suggest")
+async def suggest_proveedores(
+    empresa_id: str,
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(default=10, ge=1, le=50),
+    current_user: UserData = Depends(get_current_user),
+    empresa: dict = Depends(get_active_empresa)
+):
+    """Autocompletado de proveedores de una empresa por prefijo (sin acentos ni mayúsculas) - Requiere autenticación"""
+    prefix = normalize_supplier_name(q)
+    if not prefix:
+        return []
+    
+    pipeline = [
+        {"$match": {"empresa_id": empresa_id, "proveedor_normalizado": supplier_prefix_query(prefix)}},
+        {"$group": {
+            "_id": "$proveedor_normalizado",
+            "nombre_proveedor": {"$first": "$nombre_proveedor"},
+            "facturas": {"$sum": 1}
+        }},
+        {"$sort": {"_id": 1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "nombre_proveedor": 1, "facturas": 1}}
+    ]
+    return await db.invoices.aggregate(pipeline, **max_time_option("consulta")).to_list(limit)
+
+
 @api_router.get("/resumen/proveedor/{empresa_id}", response_model=List[ResumenProveedor])
-async def get_resumen_por_proveedor(empresa_id: str, current_user: UserData = Depends(get_current_user)):
+async def get_resumen_por_proveedor(empresa_id: str, current_user: UserData = Depends(get_current_user), empresa: dict = Depends(get_active_empresa)):
     """Obtiene resumen de deuda agrupado por proveedor para una empresa - Requiere autenticación"""
     try:
-        # Verificar que la empresa existe
-        empresa = await db.empresas.find_one({"id": empresa_id, "activa": True})
-        if not empresa:
-            raise HTTPException(status_code=404, detail="Empresa no encontrada")
-        
+        # Los montos se suman en centavos enteros y se convierten al final
         pipeline = [
             {"$match": {"empresa_id": empresa_id}},
             {
@@ -954,7 +1719,7 @@ async def get_resumen_por_proveedor(empresa_id: str, current_user: UserData = De
                         "$sum": {
                             "$cond": [
                                 {"$eq": ["$estado_pago", "pendiente"]},
-                                "$monto",
+                                MONTO_CENTAVOS_EXPR,
                                 0
                             ]
                         }
@@ -982,7 +1747,7 @@ async def get_resumen_por_proveedor(empresa_id: str, current_user: UserData = De
             {
                 "$project": {
                     "proveedor": "$_id",
-                    "total_deuda": 1,
+                    "total_deuda": {"$divide": ["$total_deuda", 100]},
                     "facturas_pendientes": 1,
                     "facturas_pagadas": 1,
                     "_id": 0
@@ -993,7 +1758,7 @@ async def get_resumen_por_proveedor(empresa_id: str, current_user: UserData = De
             }
         ]
         
-        result = await db.invoices.aggregate(pipeline).to_list(1000)
+        result = await reports_db.invoices.aggregate(pipeline, **max_time_option("reporte")).to_list(1000)
         return [ResumenProveedor(**item) for item in result]
         
     except HTTPException:
@@ -1004,16 +1769,11 @@ async def get_resumen_por_proveedor(empresa_id: str, current_user: UserData = De
 
 
 @api_router.get("/resumen/general/{empresa_id}", response_model=ResumenGeneral)
-async def get_resumen_general(empresa_id: str, current_user: UserData = Depends(get_current_user)):
+async def get_resumen_general(empresa_id: str, current_user: UserData = Depends(get_current_user), empresa: dict = Depends(get_active_empresa)):
     """Obtiene resumen general de todas las deudas de una empresa - Requiere autenticación"""
     try:
-        # Verificar que la empresa existe
-        empresa = await db.empresas.find_one({"id": empresa_id, "activa": True})
-        if not empresa:
-            raise HTTPException(status_code=404, detail="Empresa no encontrada")
-        
         # Obtener estadísticas generales
-        total_stats = await db.invoices.aggregate([
+        total_stats = await reports_db.invoices.aggregate([
             {"$match": {"empresa_id": empresa_id}},
             {
                 "$group": {
@@ -1022,7 +1782,7 @@ async def get_resumen_general(empresa_id: str, current_user: UserData = Depends(
                         "$sum": {
                             "$cond": [
                                 {"$eq": ["$estado_pago", "pendiente"]},
-                                "$monto",
+                                MONTO_CENTAVOS_EXPR,
                                 0
                             ]
                         }
@@ -1048,10 +1808,10 @@ async def get_resumen_general(empresa_id: str, current_user: UserData = Depends(
                     }
                 }
             }
-        ]).to_list(1)
+        ], **max_time_option("reporte")).to_list(1)
         
         # Obtener resumen por proveedor
-        proveedores = await get_resumen_por_proveedor(empresa_id)
+        proveedores = await get_resumen_por_proveedor(empresa_id, empresa=empresa)
         
         stats = total_stats[0] if total_stats else {
             "total_deuda_global": 0,
@@ -1061,7 +1821,7 @@ async def get_resumen_general(empresa_id: str, current_user: UserData = Depends(
         }
         
         return ResumenGeneral(
-            total_deuda_global=stats["total_deuda_global"],
+            total_deuda_global=centavos_to_monto(stats["total_deuda_global"]),
             total_facturas=stats["total_facturas"],
             facturas_pendientes=stats["facturas_pendientes"],
             facturas_pagadas=stats["facturas_pagadas"],
@@ -1076,20 +1836,30 @@ async def get_resumen_general(empresa_id: str, current_user: UserData = Depends(
 
 
 @api_router.get("/estado-cuenta/pagadas/{empresa_id}", response_model=EstadoCuentaPagadas)
-async def get_estado_cuenta_pagadas(empresa_id: str, current_user: UserData = Depends(get_current_user)):
-    """Obtiene el estado de cuenta de todas las facturas pagadas de una empresa - Requiere autenticación"""
+async def get_estado_cuenta_pagadas(empresa_id: str, fields: Optional[str] = None, current_user: UserData = Depends(get_current_user), empresa: dict = Depends(get_active_empresa)):
+    """Obtiene el estado de cuenta de todas las facturas pagadas de una empresa - Requiere autenticación
+    
+    Con `fields=id,monto,...` las facturas pagadas traen solo esos campos, sin validar contra el modelo.
+    """
     try:
-        # Verificar que la empresa existe
-        empresa = await db.empresas.find_one({"id": empresa_id, "activa": True})
-        if not empresa:
-            raise HTTPException(status_code=404, detail="Empresa no encontrada")
+        selected_fields = requested_invoice_fields(fields)
         
         # Obtener todas las facturas pagadas de la empresa
-        facturas_pagadas = await db.invoices.find({"empresa_id": empresa_id, "estado_pago": "pagado"}).to_list(1000)
-        facturas_pagadas_obj = [Invoice(**parse_from_mongo(factura)) for factura in facturas_pagadas]
-        
-        # Calcular total pagado
-        total_pagado = sum(factura.monto for factura in facturas_pagadas_obj)
+        if selected_fields:
+            facturas_pagadas = await reports_db.invoices.find(
+                {"empresa_id": empresa_id, "estado_pago": "pagado"},
+                fields_projection(selected_fields, "monto")
+            ).max_time_ms(max_time_ms("reporte")).to_list(1000)
+            total_pagado = centavos_to_monto(sum(to_centavos(factura.get('monto')) or 0 for factura in facturas_pagadas))
+            facturas_pagadas_obj = partial_documents(facturas_pagadas, selected_fields)
+        else:
+            facturas_pagadas = await reports_db.invoices.find(
+                {"empresa_id": empresa_id, "estado_pago": "pagado"}
+            ).max_time_ms(max_time_ms("reporte")).to_list(1000)
+            facturas_pagadas_obj = [Invoice(**parse_from_mongo(factura)) for factura in facturas_pagadas]
+            
+            # Calcular total pagado
+            total_pagado = centavos_to_monto(sum(to_centavos(factura.monto) for factura in facturas_pagadas_obj))
         
         # Obtener resumen por proveedor solo para facturas pagadas
         pipeline_pagadas = [
@@ -1097,14 +1867,14 @@ async def get_estado_cuenta_pagadas(empresa_id: str, current_user: UserData = De
             {
                 "$group": {
                     "_id": "$nombre_proveedor",
-                    "total_pagado": {"$sum": "$monto"},
+                    "total_pagado": {"$sum": MONTO_CENTAVOS_EXPR},
                     "facturas_pagadas": {"$sum": 1}
                 }
             },
             {
                 "$project": {
                     "proveedor": "$_id",
-                    "total_deuda": "$total_pagado",  # Usando el mismo campo para consistencia
+                    "total_deuda": {"$divide": ["$total_pagado", 100]},  # Usando el mismo campo para consistencia
                     "facturas_pendientes": {"$literal": 0},
                     "facturas_pagadas": 1,
                     "_id": 0
@@ -1115,9 +1885,17 @@ async def get_estado_cuenta_pagadas(empresa_id: str, current_user: UserData = De
             }
         ]
         
-        proveedores_pagadas = await db.invoices.aggregate(pipeline_pagadas).to_list(1000)
+        proveedores_pagadas = await reports_db.invoices.aggregate(pipeline_pagadas, **max_time_option("reporte")).to_list(1000)
         proveedores_obj = [ResumenProveedor(**item) for item in proveedores_pagadas]
         
+        if selected_fields:
+            return partial_response({
+                "total_pagado": total_pagado,
+                "cantidad_facturas_pagadas": len(facturas_pagadas_obj),
+                "facturas_por_proveedor": [item.dict() for item in proveedores_obj],
+                "facturas_pagadas": facturas_pagadas_obj
+            })
+        
         return EstadoCuentaPagadas(
             total_pagado=total_pagado,
             cantidad_facturas_pagadas=len(facturas_pagadas_obj),
@@ -1134,16 +1912,13 @@ async def get_estado_cuenta_pagadas(empresa_id: str, current_user: UserData = De
 
 # NUEVOS ENDPOINTS PARA EXPORTAR A EXCEL
 @api_router.get("/export/facturas-pendientes/{empresa_id}")
-async def export_facturas_pendientes_excel(empresa_id: str, current_user: UserData = Depends(get_current_user)):
+async def export_facturas_pendientes_excel(empresa_id: str, current_user: UserData = Depends(get_current_user), empresa: dict = Depends(get_active_empresa)):
     """Exporta facturas pendientes a Excel - Requiere autenticación"""
     try:
-        # Verificar que la empresa existe
-        empresa = await db.empresas.find_one({"id": empresa_id, "activa": True})
-        if not empresa:
-            raise HTTPException(status_code=404, detail="Empresa no encontrada")
-        
         # Obtener facturas pendientes
-        facturas = await db.invoices.find({"empresa_id": empresa_id, "estado_pago": "pendiente"}).to_list(1000)
+        facturas = await reports_db.invoices.find(
+            {"empresa_id": empresa_id, "estado_pago": "pendiente"}
+        ).max_time_ms(max_time_ms("exportacion")).to_list(1000)
         
         # Crear archivo Excel
         excel_buffer = create_invoices_excel(facturas, "pendientes", empresa['nombre'])
@@ -1153,9 +1928,7 @@ async def export_facturas_pendientes_excel(empresa_id: str, current_user: UserDa
         filename = f"facturas_pendientes_{empresa['nombre'].replace(' ', '_')}_{fecha_actual}.xlsx"
         
         # Crear archivo temporal
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as temp_file:
-            temp_file.write(excel_buffer.getvalue())
-            temp_file_path = temp_file.name
+        temp_file_path = await storage.write_temp_file(excel_buffer.getvalue(), '.xlsx')
         
         # Retornar archivo para descarga
         return FileResponse(
@@ -1172,16 +1945,13 @@ async def export_facturas_pendientes_excel(empresa_id: str, current_user: UserDa
 
 
 @api_router.get("/export/facturas-pagadas/{empresa_id}")
-async def export_facturas_pagadas_excel(empresa_id: str, current_user: UserData = Depends(get_current_user)):
+async def export_facturas_pagadas_excel(empresa_id: str, current_user: UserData = Depends(get_current_user), empresa: dict = Depends(get_active_empresa)):
     """Exporta facturas pagadas a Excel - Requiere autenticación"""
     try:
-        # Verificar que la empresa existe
-        empresa = await db.empresas.find_one({"id": empresa_id, "activa": True})
-        if not empresa:
-            raise HTTPException(status_code=404, detail="Empresa no encontrada")
-        
         # Obtener facturas pagadas
-        facturas = await db.invoices.find({"empresa_id": empresa_id, "estado_pago": "pagado"}).to_list(1000)
+        facturas = await reports_db.invoices.find(
+            {"empresa_id": empresa_id, "estado_pago": "pagado"}
+        ).max_time_ms(max_time_ms("exportacion")).to_list(1000)
         
         # Crear archivo Excel
         excel_buffer = create_invoices_excel(facturas, "pagadas", empresa['nombre'])
@@ -1191,9 +1961,7 @@ async def export_facturas_pagadas_excel(empresa_id: str, current_user: UserData
         filename = f"facturas_pagadas_{empresa['nombre'].replace(' ', '_')}_{fecha_actual}.xlsx"
         
         # Crear archivo temporal
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as temp_file:
-            temp_file.write(excel_buffer.getvalue())
-            temp_file_path = temp_file.name
+        temp_file_path = await storage.write_temp_file(excel_buffer.getvalue(), '.xlsx')
         
         # Retornar archivo para descarga
         return FileResponse(
@@ -1210,16 +1978,11 @@ async def export_facturas_pagadas_excel(empresa_id: str, current_user: UserData
 
 
 @api_router.get("/export/resumen-general/{empresa_id}")
-async def export_resumen_general_excel(empresa_id: str, current_user: UserData = Depends(get_current_user)):
+async def export_resumen_general_excel(empresa_id: str, current_user: UserData = Depends(get_current_user), empresa: dict = Depends(get_active_empresa)):
     """Exporta resumen general a Excel - Requiere autenticación"""
     try:
-        # Verificar que la empresa existe
-        empresa = await db.empresas.find_one({"id": empresa_id, "activa": True})
-        if not empresa:
-            raise HTTPException(status_code=404, detail="Empresa no encontrada")
-        
         # Obtener resumen general (reutilizar función existente)
-        resumen = await get_resumen_general(empresa_id)
+        resumen = await get_resumen_general(empresa_id, empresa=empresa)
         resumen_dict = resumen.dict()
         
         # Crear archivo Excel
@@ -1230,9 +1993,7 @@ async def export_resumen_general_excel(empresa_id: str, current_user: UserData =
         filename = f"resumen_general_{empresa['nombre'].replace(' ', '_')}_{fecha_actual}.xlsx"
         
         # Crear archivo temporal
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as temp_file:
-            temp_file.write(excel_buffer.getvalue())
-            temp_file_path = temp_file.name
+        temp_file_path = await storage.write_temp_file(excel_buffer.getvalue(), '.xlsx')
         
         # Retornar archivo para descarga
         return FileResponse(
@@ -1250,14 +2011,9 @@ async def export_resumen_general_excel(empresa_id: str, current_user: UserData =
 
 # ENDPOINT PARA ELIMINAR EMPRESA (SOFT DELETE)
 @api_router.delete("/empresas/{empresa_id}")
-async def delete_empresa(empresa_id: str, current_user: UserData = Depends(require_admin)):
+async def delete_empresa(empresa_id: str, current_user: UserData = Depends(require_admin), empresa: dict = Depends(get_active_empresa)):
     """Elimina una empresa (soft delete) y todas sus facturas - Solo admin"""
     try:
-        # Verificar que la empresa existe
-        empresa = await db.empresas.find_one({"id": empresa_id, "activa": True})
-        if not empresa:
-            raise HTTPException(status_code=404, detail="Empresa no encontrada")
-        
         # Contar facturas asociadas
         facturas_count = await db.invoices.count_documents({"empresa_id": empresa_id})
         
@@ -1267,12 +2023,11 @@ async def delete_empresa(empresa_id: str, current_user: UserData = Depends(requi
             # Eliminar archivo PDF si existe
             if factura.get('archivo_pdf'):
                 file_path = f"{UPLOAD_DIR}/{factura['archivo_pdf']}"
-                if os.path.exists(file_path):
-                    try:
-                        os.unlink(file_path)
+                try:
+                    if await storage.delete(file_path):
                         logging.info(f"Archivo PDF eliminado: {file_path}")
-                    except Exception as e:
-                        logging.warning(f"No se pudo eliminar el archivo PDF: {str(e)}")
+                except Exception as e:
+                    logging.warning(f"No se pudo eliminar el archivo PDF: {str(e)}")
         
         # Eliminar todas las facturas de la empresa
         await db.invoices.delete_many({"empresa_id": empresa_id})
@@ -1282,6 +2037,7 @@ async def delete_empresa(empresa_id: str, current_user: UserData = Depends(requi
             {"id": empresa_id},
             {"$set": {"activa": False, "fecha_eliminacion": datetime.now(timezone.utc)}}
         )
+        empresa_cache.invalidate()
         
         if result.modified_count == 0:
             raise HTTPException(status_code=404, detail="Empresa no encontrada")
@@ -1299,15 +2055,69 @@ async def delete_empresa(empresa_id: str, current_user: UserData = Depends(requi
         raise HTTPException(status_code=500, detail=f"Error eliminando la empresa: {str(e)}")
 
 
+# ENDPOINTS DE ADMINISTRACIÓN
+@api_router.get("/admin/extraction-cache")
+async def get_extraction_cache_stats(current_user: UserData = Depends(require_admin)):
+    """Estadísticas de la caché de extracción de PDFs (aciertos, fallos y tiempo de IA ahorrado) - Solo admin"""
+    stats = extraction_cache.stats()
+    stats["entradas"] = await db.extraction_cache.count_documents({"prompt_version": EXTRACTION_PROMPT_VERSION})
+    return stats
+
+
+@api_router.get("/admin/empresa-cache")
+async def get_empresa_cache_stats(current_user: UserData = Depends(require_admin)):
+    """Aciertos y fallos de la caché de empresas activas - Solo admin"""
+    return empresa_cache.stats()
+
+
+@api_router.get("/admin/mongo-pool")
+async def get_mongo_pool_stats(current_user: UserData = Depends(require_admin)):
+    """Configuración del pool de MongoDB, conexiones en uso y cola de espera por servidor - Solo admin"""
+    return {
+        "opciones": MONGO_CLIENT_OPTIONS,
+        "lecturas_reportes": MONGO_REPORTS_READ_PREFERENCE,
+        "max_time_ms": MONGO_MAX_TIME_MS,
+        **mongo_pool_monitor.stats()
+    }
+
+
+@api_router.get("/admin/llm")
+async def get_llm_client_stats(current_user: UserData = Depends(require_admin)):
+    """Estado del backend de extracción: llamadas, reintentos y circuit breaker - Solo admin"""
+    return extractor.stats()
+
+
+@api_router.get("/admin/indexes")
+async def get_index_drift(current_user: UserData = Depends(require_admin)):
+    """Diferencias entre los índices declarados y los existentes en MongoDB - Solo admin"""
+    return await index_drift(db)
+
+
+@api_router.get("/admin/latency")
+async def get_latency_stats(current_user: UserData = Depends(require_admin)):
+    """Percentiles de latencia por etapa de las subidas (últimas muestras en memoria) - Solo admin"""
+    return latency_tracker.stats()
+
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# El login no se guarda: la respuesta contiene el token
+app.add_middleware(
+    IdempotencyMiddleware,
+    store=idempotency_store,
+    excluded_paths=("/api/auth/login", "/api/auth/logout"),
+    wait_seconds=IDEMPOTENCY_WAIT_SECONDS
+)
+app.add_middleware(RequestStartMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Idempotent-Replayed"],
 )
 
 # Configure logging
@@ -1317,6 +2127,32 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def start_job_workers():
+    await ensure_indexes(db)
+    await llm_rate_limiter.ensure_indexes()
+    await idempotency_store.ensure_indexes()
+    if LATENCY_PERSIST:
+        await latency_tracker.enable_persistence(db, size_mb=LATENCY_COLLECTION_MB)
+    await job_queue.start()
+    # Facturas anteriores a la clave normalizada de proveedor; corre en segundo plano
+    app.state.supplier_backfill = asyncio.create_task(backfill_supplier_keys(db.invoices))
+    app.state.supplier_backfill.add_done_callback(supplier_backfill_done)
+
+def supplier_backfill_done(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logging.error(f"Error normalizando proveedores de facturas existentes: {str(task.exception())}")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    # El backfill no debe seguir escribiendo con el cliente de Mongo ya cerrado
+    backfill = getattr(app.state, "supplier_backfill", None)
+    if backfill is not None and not backfill.done():
+        backfill.cancel()
+        await asyncio.gather(backfill, return_exceptions=True)
+    await job_queue.stop()
+    if extraction_client is not None:
+        await extraction_client.aclose()
+    client.close()
+    pdf_preprocess.shutdown()
+    storage.shutdown()
\ No newline at end of file
@@ -0,0 +1,103 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Tamaño de bloque para leer uploads: la memoria usada no depende del tamaño del archivo
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Pool propio para disco: una escritura lenta no debe bloquear el event loop ni
+# competir con el threadpool por defecto que usan Starlette y UploadFile
+STORAGE_THREADS = int(os.environ.get('STORAGE_THREADS', '8'))
+_executor = ThreadPoolExecutor(max_workers=STORAGE_THREADS, thread_name_prefix="storage")
+
+
+async def run_io(func, *args):
+    """Ejecuta una operación de disco bloqueante en el pool de almacenamiento"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, func, *args)
+
+
+async def save_upload_stream(upload_file, path):
+    """Escribe un UploadFile en `path` por bloques en una sola pasada
+
+    Calcula tamaño y SHA-256 mientras escribe y devuelve (tamaño, sha256). Si algo
+    falla a mitad de la copia, borra el archivo parcial.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    await run_io(lambda: os.makedirs(os.path.dirname(path), exist_ok=True))
+    buffer = await run_io(open, path, "wb")
+    try:
+        while True:
+            chunk = await upload_file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            await run_io(buffer.write, chunk)
+            digest.update(chunk)
+            size += len(chunk)
+    except BaseException:
+        await run_io(buffer.close)
+        await delete(path)
+        raise
+    await run_io(buffer.close)
+    return size, digest.hexdigest()
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def file_sha256(path):
+    """Calcula el SHA-256 de un archivo ya guardado leyéndolo por bloques"""
+    return await run_io(_file_sha256, path)
+
+
+async def exists(path):
+    return await run_io(os.path.exists, path)
+
+
+async def stat(path):
+    """Devuelve os.stat_result o None si el archivo no existe"""
+    try:
+        return await run_io(os.stat, path)
+    except FileNotFoundError:
+        return None
+
+
+def _delete(path):
+    try:
+        os.unlink(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+async def delete(path):
+    """Elimina un archivo; devuelve False si ya no existía"""
+    return await run_io(_delete, path)
+
+
+async def listdir(path):
+    return await run_io(os.listdir, path)
+
+
+def _write_temp_file(content, suffix):
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+        temp_file.write(content)
+        return temp_file.name
+
+
+async def write_temp_file(content, suffix):
+    """Guarda un contenido ya generado en memoria (p. ej. un Excel) en un archivo temporal y devuelve su ruta"""
+    return await run_io(_write_temp_file, content, suffix)
+
+
+def shutdown():
+    _executor.shutdown(wait=True)
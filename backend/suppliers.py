@@ -0,0 +1,46 @@
+import logging
+import re
+import unicodedata
+
+from pymongo import UpdateOne
+
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_supplier_name(nombre):
+    """Clave de búsqueda del proveedor: minúsculas, sin acentos y con espacios colapsados
+
+    "  Papelería  LÓPEZ S.A. " -> "papeleria lopez s.a."
+    """
+    if not nombre:
+        return ""
+    decomposed = unicodedata.normalize('NFKD', str(nombre))
+    without_accents = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return _WHITESPACE_RE.sub(' ', without_accents).strip().lower()
+
+
+def supplier_prefix_query(texto):
+    """Condición de prefijo sobre la clave normalizada: un regex anclado y sin
+    metacaracteres del usuario, que MongoDB resuelve como rango sobre el índice"""
+    return {"$regex": f"^{re.escape(normalize_supplier_name(texto))}"}
+
+
+async def backfill_supplier_keys(collection, batch_size=500):
+    """Agrega proveedor_normalizado a las facturas que no lo tienen, por lotes"""
+    updated = 0
+    while True:
+        batch = await collection.find(
+            {"proveedor_normalizado": {"$exists": False}},
+            {"_id": 1, "nombre_proveedor": 1}
+        ).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+        result = await collection.bulk_write([
+            UpdateOne({"_id": doc["_id"]}, {"$set": {"proveedor_normalizado": normalize_supplier_name(doc.get("nombre_proveedor"))}})
+            for doc in batch
+        ], ordered=False)
+        updated += result.modified_count
+    if updated:
+        logging.info(f"Clave de proveedor normalizada agregada a {updated} facturas")
+    return updated
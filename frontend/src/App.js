@@ -21,6 +21,10 @@ import Login from "./components/Login";
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL || window.location.origin;
 const API = `${BACKEND_URL}/api`;
 
+// Consulta de trabajos en segundo plano (extracción de PDFs)
+const JOB_POLL_INTERVAL_MS = 1500;
+const JOB_POLL_MAX_MS = 5 * 60 * 1000;
+
 // Error Boundary to catch and handle React errors gracefully
 // Filters out removeChild errors and other benign errors (React 18 + Radix UI known issue)
 class ErrorBoundary extends React.Component {
@@ -2136,9 +2140,29 @@ function App() {
     formData.append("file", file);
     
     try {
-      await axios.post(`${API}/upload-pdf/${empresa.id}`, formData, {
+      const res = await axios.post(`${API}/upload-pdf/${empresa.id}`, formData, {
         headers: { "Content-Type": "multipart/form-data" }
       });
+      // La extracción corre en segundo plano: consultar el trabajo hasta que termine
+      let job = res.data;
+      const deadline = Date.now() + JOB_POLL_MAX_MS;
+      while (job.estado === "pendiente" || job.estado === "procesando") {
+        if (Date.now() > deadline) {
+          toast({
+            title: "Error",
+            description: "El PDF sigue en proceso. Recarga la lista en unos minutos para ver la factura.",
+            variant: "destructive"
+          });
+          return;
+        }
+        await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+        const jobRes = await axios.get(`${API}/jobs/${res.data.job_id}`);
+        job = jobRes.data;
+      }
+      if (job.estado === "error") {
+        toast({ title: "Error", description: job.error || "Error procesando PDF", variant: "destructive" });
+        return;
+      }
       toast({ title: "Éxito", description: "PDF procesado correctamente" });
       loadInvoices();
       loadResumen();
@@ -0,0 +1,70 @@
+import asyncio
+import itertools
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+# Los módulos del backend se importan como módulos de primer nivel (igual que en server.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+
+@pytest.fixture(scope="session")
+def server(tmp_path_factory):
+    """server.py contra una base de datos en memoria (mongomock) y el extractor simulado"""
+    import motor.motor_asyncio
+    from mongomock_motor import AsyncMongoMockClient
+
+    os.environ.update({
+        "MONGO_URL": "mongodb://localhost:27017",
+        "DB_NAME": "cuentas_por_pagar_test",
+        "UPLOAD_DIR": str(tmp_path_factory.mktemp("uploads")),
+        "EXTRACTOR_BACKEND": "stub",
+        "STUB_EXTRACTOR_LATENCY_MS": "0",
+    })
+    motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+    import server as server_module
+    return server_module
+
+
+@pytest.fixture
+def api(server):
+    from fastapi.testclient import TestClient
+    return TestClient(server.app)
+
+
+@pytest.fixture
+def admin_headers(server):
+    return {"Authorization": f"Bearer {server.create_access_token({'sub': 'admin', 'role': 'admin'})}"}
+
+
+@pytest.fixture
+def empresa_id(api, admin_headers):
+    return api.post("/api/empresas", json={"nombre": "Empresa de Prueba"}, headers=admin_headers).json()["id"]
+
+
+@pytest.fixture
+def insert_invoices(server, empresa_id):
+    """Inserta facturas de la empresa de prueba tal como las guarda la aplicación; cada argumento sobrescribe los valores por defecto"""
+    counter = itertools.count(1)
+
+    def insert(*overrides):
+        invoices = []
+        for override in overrides:
+            n = next(counter)
+            invoices.append(server.prepare_for_mongo({
+                "id": f"{empresa_id}-{n:03d}",
+                "empresa_id": empresa_id,
+                "numero_factura": f"F-{n}",
+                "numero_contrato": None,
+                "nombre_proveedor": "Proveedor de Prueba",
+                "fecha_factura": "2024-01-15",
+                "monto": 100.0,
+                "estado_pago": "pendiente",
+                "fecha_creacion": datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=n),
+                **override
+            }))
+        asyncio.run(server.db.invoices.insert_many(invoices))
+        return invoices
+    return insert
@@ -0,0 +1,135 @@
+import asyncio
+import io
+
+import pytest
+
+from cfdi import CfdiError, compare_with_invoice, parse_cfdi
+
+
+NAMESPACES = {
+    "3.3": "http://www.sat.gob.mx/cfd/3",
+    "4.0": "http://www.sat.gob.mx/cfd/4",
+}
+
+
+def cfdi_xml(version="4.0", comprobante='Serie="A" Folio="123"', total="1160.50", uuid="6F8B1C2D-0000-4000-8000-000000000001",
+             emisor=" Proveedor Ejemplo SA de CV "):
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<cfdi:Comprobante xmlns:cfdi="{NAMESPACES[version]}" xmlns:tfd="http://www.sat.gob.mx/TimbreFiscalDigital"
+    Version="{version}" {comprobante} Fecha="2024-03-15T10:20:30" Total="{total}">
+  <cfdi:Emisor Rfc="AAA010101AAA" Nombre="{emisor}"/>
+  <cfdi:Receptor Rfc="BBB010101BBB" Nombre="Cliente"/>
+  <cfdi:Complemento>
+    <tfd:TimbreFiscalDigital UUID="{uuid}"/>
+  </cfdi:Complemento>
+</cfdi:Comprobante>""".encode()
+
+
+@pytest.mark.parametrize("version", ["3.3", "4.0"])
+def test_parses_both_namespaces(version):
+    data = parse_cfdi(io.BytesIO(cfdi_xml(version)))
+    assert data == {
+        "numero_factura": "A-123",
+        "nombre_proveedor": "Proveedor Ejemplo SA de CV",
+        "fecha_factura": "2024-03-15",
+        "monto": 1160.50,
+        "rfc_emisor": "AAA010101AAA",
+        "uuid": None,  # con Folio no hace falta llegar al timbre
+    }
+
+
+@pytest.mark.parametrize("comprobante, numero", [
+    ('Serie="A" Folio="123"', "A-123"),
+    ('Folio="123"', "123"),
+    ('Serie="A"', "6F8B1C2D-0000-4000-8000-000000000001"),
+    ("", "6F8B1C2D-0000-4000-8000-000000000001"),
+])
+def test_numero_factura_from_serie_folio_or_uuid(comprobante, numero):
+    assert parse_cfdi(io.BytesIO(cfdi_xml(comprobante=comprobante)))["numero_factura"] == numero
+
+
+@pytest.mark.parametrize("xml, message", [
+    (b"<cfdi:Comprobante", "mal formado"),
+    (cfdi_xml(total="mil"), "Total"),
+    (cfdi_xml(total=""), "Total"),
+    (b"<factura><total>10</total></factura>", "Comprobante"),
+])
+def test_invalid_cfdi_raises(xml, message):
+    with pytest.raises(CfdiError, match=message):
+        parse_cfdi(io.BytesIO(xml))
+
+
+def test_parses_from_path(tmp_path):
+    path = tmp_path / "factura.xml"
+    path.write_bytes(cfdi_xml())
+    assert parse_cfdi(str(path))["numero_factura"] == "A-123"
+
+
+def test_rejects_entity_expansion():
+    bomb = b"""<?xml version="1.0"?>
+<!DOCTYPE cfdi [<!ENTITY a "aaaaaaaaaa"><!ENTITY b "&a;&a;&a;&a;&a;&a;&a;&a;&a;&a;">]>
+<cfdi:Comprobante xmlns:cfdi="http://www.sat.gob.mx/cfd/4" Folio="&b;" Fecha="2024-01-01" Total="1">
+  <cfdi:Emisor Nombre="X"/>
+</cfdi:Comprobante>"""
+    with pytest.raises(CfdiError, match="entidades"):
+        parse_cfdi(io.BytesIO(bomb))
+
+
+def test_compare_with_invoice():
+    cfdi_data = parse_cfdi(io.BytesIO(cfdi_xml()))
+    assert compare_with_invoice(cfdi_data, {"monto": 1160.5, "fecha_factura": "2024-03-15"})["coincide"]
+    resultado = compare_with_invoice(cfdi_data, {"monto": 1000, "fecha_factura": "2024-03-15"})
+    assert resultado["diferencias"] == [{"campo": "monto", "factura": 1000.0, "xml": 1160.5}]
+
+
+def test_upload_xml_creates_invoice_without_internal_fields(api, admin_headers, empresa_id):
+    response = api.post(
+        f"/api/upload-xml/{empresa_id}",
+        files={"file": ("factura.xml", cfdi_xml(comprobante='Serie="B" Folio="77"'), "application/xml")},
+        headers=admin_headers,
+    )
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert data["numero_factura"] == "B-77"
+    assert data["monto"] == 1160.5
+    assert data["fecha_factura"] == "2024-03-15"
+    assert "monto_centavos" not in data and "proveedor_normalizado" not in data
+
+    listed = api.get(f"/api/invoices/{empresa_id}", headers=admin_headers).json()
+    assert data in listed
+
+
+def test_upload_malformed_xml_returns_400(api, admin_headers, empresa_id):
+    response = api.post(
+        f"/api/upload-xml/{empresa_id}",
+        files={"file": ("factura.xml", b"<cfdi:Comprobante Total=", "application/xml")},
+        headers=admin_headers,
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("CFDI inválido")
+
+
+def test_upload_xml_attaches_only_to_the_same_supplier(server, api, admin_headers, empresa_id, insert_invoices):
+    # Dos proveedores con el mismo folio, ambos extraídos de su PDF y sin XML
+    otro, mismo = insert_invoices(
+        {"numero_factura": "A-1", "nombre_proveedor": "Otro Proveedor SA", "monto": 50.0},
+        {"numero_factura": "A-1", "nombre_proveedor": "PROVEEDOR  Ejemplo sa de cv", "monto": 1160.5, "fecha_factura": "2024-03-15"},
+    )
+
+    def upload(emisor):
+        return api.post(
+            f"/api/upload-xml/{empresa_id}",
+            files={"file": ("factura.xml", cfdi_xml(comprobante='Serie="A" Folio="1"', emisor=emisor), "application/xml")},
+            headers=admin_headers,
+        ).json()
+
+    attached = upload("Proveedor Ejemplo SA de CV")
+    assert attached["invoice_id"] == mismo["id"]
+    assert attached["verificacion"]["coincide"] is True
+
+    # Un tercer proveedor con el mismo folio crea su propia factura
+    created = upload("Tercer Proveedor SC")
+    assert "invoice_id" not in created
+    assert created["data"]["nombre_proveedor"] == "Tercer Proveedor SC"
+    stored = asyncio.run(server.db.invoices.find_one({"id": otro["id"]}))
+    assert stored.get("archivo_xml") is None
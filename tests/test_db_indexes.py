@@ -0,0 +1,36 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from db_indexes import ensure_indexes, index_drift
+
+
+def test_ensure_indexes_creates_declared_and_only_reports_extra():
+    async def run():
+        db = AsyncMongoMockClient()["test"]
+        # Índices que no están declarados (p. ej. creados a mano por un DBA)
+        await db.invoices.create_index([("empresa_id", 1), ("estado_pago", 1)])
+        await db.invoices.create_index([("numero_factura", 1)])
+        errors = await ensure_indexes(db)
+        return errors, await index_drift(db), await db.invoices.index_information()
+
+    errors, after, indexes = asyncio.run(run())
+    assert errors == []
+    # ensure_indexes nunca borra: los sobrantes solo se reportan
+    assert "empresa_id_1_estado_pago_1" in indexes
+    assert after["colecciones"]["invoices"] == {
+        "faltantes": [], "diferentes": [], "sobrantes": ["empresa_id_1_estado_pago_1", "numero_factura_1"]
+    }
+    assert after["colecciones"]["empresas"] == {"faltantes": [], "diferentes": [], "sobrantes": []}
+    assert not after["sin_drift"]
+
+
+def test_index_drift_reports_missing_and_different_options():
+    async def run():
+        db = AsyncMongoMockClient()["test"]
+        await db.empresas.create_index([("id", 1)])
+        return await index_drift(db)
+
+    report = asyncio.run(run())
+    assert report["colecciones"]["empresas"]["diferentes"] == [{"nombre": "id_1", "esperado": {"unique": True}, "actual": {}}]
+    assert len(report["colecciones"]["invoices"]["faltantes"]) == 8
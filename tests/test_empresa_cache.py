@@ -0,0 +1,82 @@
+import asyncio
+
+from empresa_cache import EmpresaCache
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    async def to_list(self, length):
+        return [dict(doc) for doc in self.documents[:length]]
+
+
+class FakeCollection:
+    """Colección en memoria que cuenta las consultas a Mongo"""
+
+    def __init__(self, *documents):
+        self.documents = list(documents)
+        self.finds = 0
+        self.find_ones = 0
+
+    def _matches(self, doc, query):
+        return all(doc.get(key) == value for key, value in query.items())
+
+    def find(self, query, projection=None):
+        self.finds += 1
+        return FakeCursor([doc for doc in self.documents if self._matches(doc, query)])
+
+    async def find_one(self, query, projection=None):
+        self.find_ones += 1
+        for doc in self.documents:
+            if self._matches(doc, query):
+                return dict(doc)
+        return None
+
+
+def test_lookups_are_served_from_memory_until_invalidated():
+    collection = FakeCollection({"id": "a", "nombre": "A", "activa": True}, {"id": "b", "nombre": "B", "activa": False})
+    cache = EmpresaCache(collection, ttl_seconds=60)
+
+    async def run():
+        assert (await cache.get("a"))["nombre"] == "A"
+        assert [e["id"] for e in await cache.all()] == ["a"]
+        assert collection.finds == 1
+
+        # Las copias entregadas no alteran la caché
+        (await cache.get("a"))["nombre"] = "cambiado"
+        assert (await cache.get("a"))["nombre"] == "A"
+        assert collection.finds == 1
+
+        collection.documents[0]["nombre"] = "A2"
+        cache.invalidate()
+        assert (await cache.get("a"))["nombre"] == "A2"
+        assert collection.finds == 2
+
+    asyncio.run(run())
+
+
+def test_unknown_id_is_checked_in_mongo():
+    collection = FakeCollection({"id": "a", "activa": True})
+    cache = EmpresaCache(collection, ttl_seconds=60)
+
+    async def run():
+        assert await cache.get("inactiva") is None
+        # Creada por otro proceso después de la carga
+        collection.documents.append({"id": "nueva", "activa": True})
+        assert (await cache.get("nueva"))["id"] == "nueva"
+        assert [e["id"] for e in await cache.all()] == ["a", "nueva"]
+
+    asyncio.run(run())
+
+
+def test_zero_ttl_always_reads_mongo():
+    collection = FakeCollection({"id": "a", "activa": True})
+    cache = EmpresaCache(collection, ttl_seconds=0)
+
+    async def run():
+        await cache.get("a")
+        await cache.get("a")
+        assert collection.find_ones == 2
+
+    asyncio.run(run())
@@ -0,0 +1,46 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from extraction_cache import ExtractionCache
+
+
+DATA = {"numero_factura": "A-1", "nombre_proveedor": "Proveedor", "fecha_factura": "2024-01-15", "monto": 100.0, "extra": "x"}
+
+
+def test_hit_after_put_and_miss_for_other_prompt_version():
+    async def run():
+        collection = AsyncMongoMockClient()["test"]["extraction_cache"]
+        cache = ExtractionCache(collection, "v1")
+        missed = await cache.get("abc")
+        await cache.put("abc", DATA, llm_seconds=2.5)
+        hit = await cache.get("abc")
+        other_version = await ExtractionCache(collection, "v2").get("abc")
+        return missed, hit, other_version, cache.stats(), await collection.find_one({"_id": "abc:v1"})
+
+    missed, hit, other_version, stats, doc = asyncio.run(run())
+    assert missed is None and other_version is None
+    assert hit == {field: DATA[field] for field in ("numero_factura", "nombre_proveedor", "fecha_factura", "monto")}
+    assert (stats["hits"], stats["misses"], stats["errors"]) == (1, 1, 0)
+    assert stats["llm_seconds_saved"] == 2.5
+    assert doc["hits"] == 1
+
+
+class FailingCollection:
+    async def find_one(self, *args, **kwargs):
+        raise ConnectionError("Mongo no disponible")
+
+    async def update_one(self, *args, **kwargs):
+        raise ConnectionError("Mongo no disponible")
+
+
+def test_failing_collection_is_a_miss():
+    async def run():
+        cache = ExtractionCache(FailingCollection(), "v1")
+        result = await cache.get("abc")
+        await cache.put("abc", DATA, llm_seconds=1.0)
+        return result, cache.stats()
+
+    result, stats = asyncio.run(run())
+    assert result is None
+    assert (stats["hits"], stats["misses"], stats["errors"]) == (0, 1, 2)
@@ -0,0 +1,96 @@
+import asyncio
+import json
+
+import pytest
+
+from extractors import CascadeExtractor, CascadeTier, Extractor, StubExtractor, validate_invoice_fields
+from llm_client import CircuitOpenError, LlmError
+
+
+VALID = {
+    "numero_factura": "A-1",
+    "nombre_proveedor": "Proveedor Test",
+    "fecha_factura": "2024-01-15",
+    "monto": 1500.0
+}
+
+
+class FakeExtractor(Extractor):
+    """Devuelve (o lanza) las respuestas indicadas en orden"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    async def extract(self, file_path):
+        self.calls += 1
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def cascade(*extractors):
+    return CascadeExtractor([CascadeTier(f"modelo-{i}", e, cost_per_million_tokens=1.0) for i, e in enumerate(extractors)])
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    path = tmp_path / "factura.pdf"
+    path.write_bytes(b"%PDF-1.4 test")
+    return str(path)
+
+
+def test_validate_invoice_fields():
+    assert validate_invoice_fields(VALID) == []
+    assert validate_invoice_fields({**VALID, "monto": "1,500.00"}) == ["monto no numérico: 1,500.00"]
+    assert validate_invoice_fields({**VALID, "fecha_factura": "15/01/2024"}) == ["fecha_factura con formato inválido: 15/01/2024"]
+    assert validate_invoice_fields({**VALID, "numero_factura": None}) == ["falta numero_factura"]
+
+
+def test_cascade_stops_at_first_valid_tier(pdf_path):
+    cheap, strong = FakeExtractor(VALID), FakeExtractor(VALID)
+    extractor = cascade(cheap, strong)
+
+    assert asyncio.run(extractor.extract(pdf_path)) == VALID
+    assert (cheap.calls, strong.calls) == (1, 0)
+    assert extractor.stats()["niveles"][0]["tasa_exito"] == 1.0
+
+
+def test_cascade_escalates_on_invalid_data_and_errors(pdf_path):
+    cheap = FakeExtractor({**VALID, "fecha_factura": "enero 2024"}, json.JSONDecodeError("x", "", 0), LlmError("503"))
+    strong = FakeExtractor(VALID, VALID, VALID)
+    extractor = cascade(cheap, strong)
+
+    for _ in range(3):
+        assert asyncio.run(extractor.extract(pdf_path)) == VALID
+    stats = extractor.stats()
+    assert stats["escalamientos"] == 3
+    assert stats["niveles"][0]["exitos"] == 0
+    assert stats["niveles"][1]["llamadas"] == 3
+    assert stats["niveles"][1]["costo_estimado_usd"] > 0
+
+
+def test_cascade_does_not_escalate_when_circuit_is_open(pdf_path):
+    strong = FakeExtractor(VALID)
+    extractor = cascade(FakeExtractor(CircuitOpenError(30)), strong)
+
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(extractor.extract(pdf_path))
+    assert strong.calls == 0
+
+
+def test_stub_is_deterministic_with_seed(pdf_path):
+    def run():
+        stub = StubExtractor(latency=0, error_rate=0.5, seed=7)
+        outcomes = []
+        for _ in range(10):
+            try:
+                asyncio.run(stub.extract(pdf_path))
+                outcomes.append(True)
+            except LlmError:
+                outcomes.append(False)
+        return outcomes
+
+    assert run() == run()
+    assert not all(run())
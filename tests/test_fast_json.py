@@ -0,0 +1,78 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+import fast_json
+
+
+DOCUMENT = {
+    "id": "f-1",
+    "nombre_proveedor": "Proveedor Ñandú",
+    "monto": 1500.0,
+    "cantidad": 3,
+    "fecha_utc": datetime(2024, 1, 15, 10, 30, 0, 123456, tzinfo=timezone.utc),
+    "fecha_sin_zona": datetime(2024, 1, 15, 10, 30),
+    "nada": None,
+    "lista": [True, False, 0.1],
+}
+
+
+def test_fallback_without_orjson_produces_same_bytes(monkeypatch):
+    if fast_json.orjson is None:
+        pytest.skip("orjson no está instalado")
+    with_orjson = fast_json.dumps(DOCUMENT)
+    monkeypatch.setattr(fast_json, "orjson", None)
+    assert fast_json.dumps(DOCUMENT) == with_orjson
+    assert b'"fecha_utc":"2024-01-15T10:30:00.123456Z"' in with_orjson
+
+
+def insert_legacy_invoices(server, empresa_id):
+    """Documentos como los que dejaron versiones anteriores: sin campos opcionales, monto entero,
+    fecha_factura como texto y fecha_creacion como texto sin zona horaria"""
+    asyncio.run(server.db.invoices.insert_many([
+        {
+            "id": f"{empresa_id}-legacy-1",
+            "empresa_id": empresa_id,
+            "numero_factura": "L-1",
+            "nombre_proveedor": "Proveedor Antiguo",
+            "fecha_factura": "2023-05-01",
+            "monto": 1200,
+            "estado_pago": "pagado",
+            "fecha_creacion": "2023-05-02T08:00:00",
+        },
+        {
+            "id": f"{empresa_id}-legacy-2",
+            "empresa_id": empresa_id,
+            "numero_factura": "L-2",
+            "nombre_proveedor": "Proveedor Antiguo",
+            "fecha_factura": "2023-05-03",
+            "monto": 99.99,
+            "estado_pago": "pendiente",
+            "fecha_creacion": "2023-05-03T08:00:00+00:00",
+            "archivo_pdf": "l-2.pdf",
+            "comprobante_pago": None,
+        },
+    ]))
+
+
+@pytest.mark.parametrize("params", [{}, {"limit": 10}, {"sort": "monto"}])
+def test_fast_path_matches_pydantic_models(server, api, admin_headers, empresa_id, insert_invoices, monkeypatch, params):
+    insert_invoices(
+        {"numero_contrato": "C-9", "verificacion_xml": {"coincide": True, "diferencias": []}},
+        {"fecha_factura": "31/12/2023", "monto": 0.1 + 0.2},  # fecha no reconocida: queda como texto
+    )
+    insert_legacy_invoices(server, empresa_id)
+
+    def get(fast):
+        monkeypatch.setattr(server, "INVOICES_FAST_JSON", fast)
+        response = api.get(f"/api/invoices/{empresa_id}", params=params, headers=admin_headers)
+        assert response.status_code == 200
+        return response.json()
+
+    fast, models = get(True), get(False)
+    assert fast == models
+    items = fast["items"] if "items" in fast else fast
+    assert len(items) == 4
+    legacy = next(item for item in items if item["numero_factura"] == "L-1")
+    assert legacy["monto"] == 1200.0 and legacy["archivo_xml"] is None
@@ -0,0 +1,135 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import httpx
+from fastapi import FastAPI, File, UploadFile
+from mongomock_motor import AsyncMongoMockClient
+
+from idempotency import IdempotencyMiddleware, IdempotencyStore, RequestFingerprint
+
+
+def make_app(wait_seconds=5):
+    """App mínima envuelta en el middleware; `calls` cuenta las ejecuciones reales del endpoint"""
+    app = FastAPI()
+    calls = {"n": 0}
+
+    @app.post("/facturas")
+    async def crear(payload: dict):
+        calls["n"] += 1
+        return {"n": calls["n"], "payload": payload}
+
+    @app.post("/lento")
+    async def lento():
+        calls["n"] += 1
+        await asyncio.sleep(0.3)
+        return {"n": calls["n"]}
+
+    @app.post("/subir")
+    async def subir(file: UploadFile = File(...)):
+        calls["n"] += 1
+        return {"n": calls["n"], "bytes": len(await file.read())}
+
+    store = IdempotencyStore(AsyncMongoMockClient()["test"]["idempotency_keys"])
+    return IdempotencyMiddleware(app, store, wait_seconds=wait_seconds), store, calls
+
+
+def client(asgi_app):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=asgi_app), base_url="http://test")
+
+
+def test_replays_stored_response_and_rejects_other_body():
+    asgi_app, _store, calls = make_app()
+
+    async def run():
+        async with client(asgi_app) as c:
+            headers = {"Idempotency-Key": "k1"}
+            first = await c.post("/facturas", json={"a": 1}, headers=headers)
+            retry = await c.post("/facturas", json={"a": 1}, headers=headers)
+            other = await c.post("/facturas", json={"a": 2}, headers=headers)
+            return first, retry, other
+
+    first, retry, other = asyncio.run(run())
+    assert first.status_code == 200 and retry.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert calls["n"] == 1
+    assert other.status_code == 422
+    assert other.json() == {"detail": "La Idempotency-Key ya se usó con otra petición"}
+
+
+def test_retry_waits_for_in_flight_original():
+    asgi_app, _store, calls = make_app()
+
+    async def run():
+        async with client(asgi_app) as c:
+            headers = {"Idempotency-Key": "k2"}
+            original = asyncio.create_task(c.post("/lento", headers=headers))
+            await asyncio.sleep(0.05)
+            retry = await c.post("/lento", headers=headers)
+            return await original, retry
+
+    original, retry = asyncio.run(run())
+    assert original.json() == retry.json() == {"n": 1}
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert calls["n"] == 1
+
+
+def test_takes_over_key_whose_lock_expired():
+    asgi_app, store, calls = make_app()
+
+    async def run():
+        async with client(asgi_app) as c:
+            # Registrar la clave con una petición real y simular que su proceso murió
+            await c.post("/facturas", json={"a": 1}, headers={"Idempotency-Key": "k3"})
+            expired = datetime.now(timezone.utc) - timedelta(seconds=1)
+            await store.collection.update_many({}, {"$set": {"estado": "procesando", "bloqueo_expira": expired}})
+            return await c.post("/facturas", json={"a": 1}, headers={"Idempotency-Key": "k3"})
+
+    retry = asyncio.run(run())
+    assert retry.status_code == 200
+    assert "idempotent-replayed" not in retry.headers
+    assert calls["n"] == 2
+
+
+def test_multipart_retry_with_new_boundary_is_replayed():
+    asgi_app, _store, calls = make_app()
+
+    async def run():
+        async with client(asgi_app) as c:
+            headers = {"Idempotency-Key": "k4"}
+            files = {"file": ("factura.pdf", b"%PDF-1.4 contenido", "application/pdf")}
+            first = await c.post("/subir", files=files, headers=headers)
+            # httpx genera un boundary nuevo en cada envío, como un navegador al reintentar
+            retry = await c.post("/subir", files=files, headers=headers)
+            other = await c.post("/subir", files={"file": ("factura.pdf", b"%PDF-1.4 otro", "application/pdf")}, headers=headers)
+            return first, retry, other
+
+    first, retry, other = asyncio.run(run())
+    assert first.status_code == 200
+    assert retry.status_code == 200 and retry.headers["idempotent-replayed"] == "true"
+    assert retry.json() == first.json()
+    assert other.status_code == 422
+    assert calls["n"] == 1
+
+
+def test_multipart_fingerprint_ignores_boundary_and_chunking():
+    def fingerprint(boundary, chunk_size):
+        body = (
+            f"--{boundary}\r\n"
+            'Content-Disposition: form-data; name="file"; filename="a.pdf"\r\n'
+            "Content-Type: application/pdf\r\n\r\n"
+            "%PDF-1.4 datos\r\n"
+            f"--{boundary}--\r\n"
+        ).encode()
+        scope = {
+            "method": "POST",
+            "path": "/api/upload-pdf/e1",
+            "query_string": b"",
+            "headers": [(b"content-type", f"multipart/form-data; boundary={boundary}".encode())],
+        }
+        fp = RequestFingerprint(scope)
+        for i in range(0, len(body), chunk_size):
+            fp.update(body[i:i + chunk_size])
+        return fp.hexdigest()
+
+    assert fingerprint("aaa111", 7) == fingerprint("zzz999", 1000)
@@ -0,0 +1,66 @@
+import asyncio
+import json
+
+
+def stream_chunks(server, empresa_id, **params):
+    """Bloques tal como los envía StreamingResponse (TestClient los uniría)"""
+    async def run():
+        response = await server.stream_invoices(
+            empresa_id, filters={}, sort=params.get("sort"), fields=params.get("fields"), current_user=None, empresa=None
+        )
+        assert response.media_type == "application/x-ndjson"
+        return [chunk async for chunk in response.body_iterator]
+    return asyncio.run(run())
+
+
+def test_stream_sends_one_invoice_per_line_in_blocks(server, api, admin_headers, empresa_id, insert_invoices, monkeypatch):
+    monkeypatch.setattr(server, "INVOICES_STREAM_CHUNK_LINES", 2)
+    insert_invoices(*[{"monto": float(n)} for n in range(5)])
+
+    chunks = stream_chunks(server, empresa_id, sort="monto")
+    assert [chunk.count(b"\n") for chunk in chunks] == [2, 2, 1]
+    assert all(chunk.endswith(b"\n") for chunk in chunks)
+
+    lines = b"".join(chunks).decode().splitlines()
+    listed = api.get(f"/api/invoices/{empresa_id}", params={"sort": "monto"}, headers=admin_headers).json()
+    assert [json.loads(line) for line in lines] == listed
+
+
+def test_stream_endpoint_applies_fields_and_filters(api, admin_headers, empresa_id, insert_invoices):
+    insert_invoices({"estado_pago": "pagado", "monto": 1.0}, {"monto": 2.0}, {"monto": 3.0})
+    response = api.get(
+        f"/api/invoices/{empresa_id}/stream",
+        params={"estado": "pendiente", "fields": "monto", "sort": "-monto"},
+        headers=admin_headers,
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert response.text.endswith("\n")
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {"id": f"{empresa_id}-003", "monto": 3.0},
+        {"id": f"{empresa_id}-002", "monto": 2.0},
+    ]
+
+
+def test_stream_error_is_reported_as_last_line(server, empresa_id, insert_invoices, monkeypatch):
+    monkeypatch.setattr(server, "INVOICES_STREAM_CHUNK_LINES", 1)
+    insert_invoices({}, {}, {})
+    original = server.invoice_document
+    served = []
+
+    def failing_document(doc):
+        if len(served) == 2:
+            raise RuntimeError("cursor perdido")
+        served.append(doc["id"])
+        return original(doc)
+
+    monkeypatch.setattr(server, "invoice_document", failing_document)
+    lines = [json.loads(line) for line in b"".join(stream_chunks(server, empresa_id)).splitlines()]
+    assert len(lines) == 3
+    assert [line["id"] for line in lines[:2]] == served
+    assert lines[-1] == {"error": "cursor perdido"}
+
+
+def test_stream_unknown_field_returns_400(api, admin_headers, empresa_id):
+    response = api.get(f"/api/invoices/{empresa_id}/stream", params={"fields": "secreto"}, headers=admin_headers)
+    assert response.status_code == 400
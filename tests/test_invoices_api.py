@@ -0,0 +1,55 @@
+import pytest
+
+
+def list_invoices(api, admin_headers, empresa_id, **params):
+    return api.get(f"/api/invoices/{empresa_id}", params=params, headers=admin_headers)
+
+
+@pytest.mark.parametrize("sort", ["-fecha_creacion", "monto", "-fecha_factura", "proveedor"])
+def test_keyset_pages_cover_every_invoice_once(api, admin_headers, empresa_id, insert_invoices, sort):
+    # Valores repetidos para que el desempate por id cruce páginas
+    insert_invoices(*[
+        {"monto": float(n % 3), "fecha_factura": f"2024-01-0{n % 4 + 1}", "nombre_proveedor": f"Proveedor {n % 2}"}
+        for n in range(7)
+    ])
+    expected = [item["id"] for item in list_invoices(api, admin_headers, empresa_id, sort=sort).json()]
+
+    seen, cursor = [], None
+    while True:
+        params = {"sort": sort, "limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = list_invoices(api, admin_headers, empresa_id, **params).json()
+        seen.extend(item["id"] for item in page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert len(expected) == 7
+    assert seen == expected
+
+
+def test_page_total_and_invalid_cursor(api, admin_headers, empresa_id, insert_invoices):
+    insert_invoices({}, {}, {"estado_pago": "pagado"})
+    page = list_invoices(api, admin_headers, empresa_id, limit=1, estado="pendiente", incluir_total=True).json()
+    assert page["total"] == 2 and len(page["items"]) == 1
+
+    other_sort = list_invoices(api, admin_headers, empresa_id, limit=1, sort="monto", cursor=page["next_cursor"])
+    assert other_sort.status_code == 400
+    assert list_invoices(api, admin_headers, empresa_id, limit=1, cursor="basura").status_code == 400
+
+
+def test_fields_returns_only_requested_fields(api, admin_headers, empresa_id, insert_invoices):
+    insert_invoices({"monto": 10.5}, {"monto": 20.0})
+    legacy = list_invoices(api, admin_headers, empresa_id, fields="monto,fecha_factura", sort="monto").json()
+    assert [set(item) for item in legacy] == [{"id", "monto", "fecha_factura"}] * 2
+    assert [item["monto"] for item in legacy] == [10.5, 20.0]
+    assert legacy[0]["fecha_factura"] == "2024-01-15"
+
+    page = list_invoices(api, admin_headers, empresa_id, fields="monto", sort="-fecha_factura", limit=1).json()
+    # El campo de orden se lee para el cursor pero no se devuelve
+    assert set(page["items"][0]) == {"id", "monto"}
+    assert page["next_cursor"]
+
+
+def test_unknown_field_returns_400(api, admin_headers, empresa_id):
+    response = list_invoices(api, admin_headers, empresa_id, fields="monto,monto_centavos,password")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Campos desconocidos: monto_centavos, password"
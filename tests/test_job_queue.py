@@ -0,0 +1,188 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from mongomock_motor import AsyncMongoMockClient
+
+from job_queue import JobQueue, PermanentJobError, RetryLaterError
+
+
+def make_queue(handler, **options):
+    collection = AsyncMongoMockClient()["test"]["jobs"]
+    return JobQueue(collection, handler, **options)
+
+
+def test_completes_job_and_stores_result():
+    async def handler(job):
+        return {"doble": job["payload"]["n"] * 2}
+
+    async def run():
+        queue = make_queue(handler)
+        job = await queue.enqueue("prueba", {"n": 21})
+        await queue.run_job(await queue.claim())
+        return await queue.get(job["id"])
+
+    job = asyncio.run(run())
+    assert job["estado"] == "completado"
+    assert job["resultado"] == {"doble": 42}
+    assert job["intentos"] == 1
+    assert "lease_expira" not in job
+
+
+def test_failed_job_retries_with_backoff_until_max_attempts():
+    async def handler(job):
+        raise RuntimeError("timeout de la IA")
+
+    async def run():
+        queue = make_queue(handler, max_attempts=2, retry_backoff=0)
+        job = await queue.enqueue("prueba", {})
+        await queue.run_job(await queue.claim())
+        first = await queue.get(job["id"])
+        await queue.run_job(await queue.claim())
+        return first, await queue.get(job["id"]), await queue.claim()
+
+    first, last, next_job = asyncio.run(run())
+    assert first["estado"] == "pendiente" and first["intentos"] == 1
+    assert first["error"] == "timeout de la IA"
+    assert last["estado"] == "error" and last["intentos"] == 2
+    assert next_job is None
+
+
+def test_backoff_delays_next_claim():
+    async def handler(job):
+        raise RuntimeError("falla")
+
+    async def run():
+        queue = make_queue(handler, retry_backoff=60)
+        await queue.enqueue("prueba", {})
+        await queue.run_job(await queue.claim())
+        return await queue.claim()
+
+    assert asyncio.run(run()) is None
+
+
+def test_permanent_error_is_not_retried():
+    async def handler(job):
+        raise PermanentJobError("sin datos")
+
+    async def run():
+        queue = make_queue(handler, max_attempts=3)
+        job = await queue.enqueue("prueba", {})
+        await queue.run_job(await queue.claim())
+        return await queue.get(job["id"])
+
+    job = asyncio.run(run())
+    assert job["estado"] == "error" and job["intentos"] == 1
+
+
+def test_retry_later_requeues_without_spending_an_attempt():
+    async def handler(job):
+        raise RetryLaterError("circuito abierto", retry_after=0)
+
+    async def run():
+        queue = make_queue(handler, max_attempts=1)
+        job = await queue.enqueue("prueba", {})
+        for _ in range(3):
+            await queue.run_job(await queue.claim())
+        return await queue.get(job["id"])
+
+    job = asyncio.run(run())
+    assert job["estado"] == "pendiente"
+    assert job["intentos"] == 0
+    assert job["error"] == "circuito abierto"
+
+
+def test_expired_lease_is_claimed_by_another_worker():
+    async def handler(job):
+        return None
+
+    async def run():
+        queue = make_queue(handler)
+        job = await queue.enqueue("prueba", {})
+        crashed = await queue.claim()
+        # Otro proceso no puede tomarlo mientras el lease está vigente
+        other = JobQueue(queue.collection, handler)
+        assert await other.claim() is None
+        expired = datetime.now(timezone.utc) - timedelta(seconds=1)
+        await queue.collection.update_one({"id": job["id"]}, {"$set": {"lease_expira": expired}})
+        return crashed, other.worker_id, await other.claim()
+
+    crashed, other_worker, reclaimed = asyncio.run(run())
+    assert reclaimed["id"] == crashed["id"]
+    assert reclaimed["worker"] == other_worker
+    assert reclaimed["intentos"] == 2
+
+
+def test_heartbeat_keeps_lease_while_handler_runs():
+    async def run():
+        claimed_by_other = []
+
+        async def handler(job):
+            # El handler tarda más que el lease; el heartbeat debe impedir que otro lo tome
+            for _ in range(4):
+                await asyncio.sleep(0.1)
+                claimed_by_other.append(await other.claim())
+            return "ok"
+
+        queue = make_queue(handler, lease_seconds=0.15)
+        other = JobQueue(queue.collection, handler, lease_seconds=0.15)
+        job = await queue.enqueue("prueba", {})
+        await queue.run_job(await queue.claim())
+        return claimed_by_other, await queue.get(job["id"])
+
+    claimed_by_other, job = asyncio.run(run())
+    assert claimed_by_other == [None] * 4
+    assert job["estado"] == "completado" and job["intentos"] == 1
+
+
+def test_stop_returns_interrupted_jobs_to_the_queue():
+    started = asyncio.Event()
+
+    async def handler(job):
+        started.set()
+        await asyncio.sleep(10)
+
+    async def run():
+        queue = make_queue(handler, poll_interval=0.05)
+        job = await queue.enqueue("prueba", {})
+        await queue.start()
+        await asyncio.wait_for(started.wait(), timeout=2)
+        await queue.stop()
+        return await queue.get(job["id"])
+
+    job = asyncio.run(run())
+    assert job["estado"] == "pendiente" and job["intentos"] == 0
+
+
+def test_worker_survives_a_failure_saving_the_result():
+    async def handler(job):
+        return job["payload"]["n"]
+
+    async def run():
+        queue = make_queue(handler, workers=1, poll_interval=0.05)
+        original_finish = queue._finish
+        failures = []
+
+        async def flaky_finish(job, *args, **kwargs):
+            # Falla todo intento de guardar el primer trabajo, también el de run_job al manejar el error
+            if job["id"] == first["id"]:
+                failures.append(job["id"])
+                raise ConnectionError("Mongo no disponible")
+            return await original_finish(job, *args, **kwargs)
+
+        queue._finish = flaky_finish
+        first = await queue.enqueue("prueba", {"n": 1})
+        second = await queue.enqueue("prueba", {"n": 2})
+        await queue.start()
+        for _ in range(100):
+            done = await queue.get(second["id"])
+            if done["estado"] == "completado":
+                break
+            await asyncio.sleep(0.02)
+        alive = all(not task.done() for task in queue._tasks)
+        await queue.stop()
+        return failures, first["id"], done, alive
+
+    failures, first_id, second, alive = asyncio.run(run())
+    assert failures == [first_id, first_id]
+    assert second["estado"] == "completado" and second["resultado"] == 2
+    assert alive
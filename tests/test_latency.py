@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+import pytest
+
+from latency import LatencyTracker, span
+
+
+def test_percentiles_over_rolling_window():
+    tracker = LatencyTracker(window=100)
+    for ms in range(1, 201):
+        tracker.record("upload_pdf", "ia", ms / 1000)
+
+    stats = tracker.stats()["operaciones"]["upload_pdf"]["etapas"]["ia"]
+    # Solo cuentan las últimas 100 muestras (101..200 ms)
+    assert stats["muestras"] == 100
+    assert stats["p50_ms"] == pytest.approx(150.0, abs=1)
+    assert stats["p99_ms"] == pytest.approx(199.0, abs=1)
+    assert stats["max_ms"] == 200.0
+
+
+def test_trace_collects_spans_from_nested_calls_and_errors():
+    tracker = LatencyTracker()
+
+    async def extract():
+        # Las funciones internas no reciben la traza: usan la del contexto
+        with span("ia"):
+            await asyncio.sleep(0.02)
+
+    async def run():
+        started = time.perf_counter() - 0.01  # la petición llegó antes de entrar al endpoint
+        async with tracker.trace("upload_pdf", started=started):
+            await extract()
+        with pytest.raises(RuntimeError):
+            async with tracker.trace("upload_pdf"):
+                raise RuntimeError("fallo")
+        # Fuera de una traza, span no registra nada
+        with span("ia"):
+            pass
+
+    asyncio.run(run())
+    operation = tracker.stats()["operaciones"]["upload_pdf"]
+    assert operation["errores"] == 1
+    assert operation["etapas"]["ia"]["muestras"] == 1
+    assert operation["etapas"]["ia"]["p50_ms"] >= 20
+    assert operation["etapas"]["recepcion"]["p50_ms"] >= 10
+    assert operation["etapas"]["total"]["muestras"] == 2
+    stages_ms = operation["etapas"]["ia"]["max_ms"] + operation["etapas"]["recepcion"]["max_ms"]
+    assert operation["etapas"]["total"]["max_ms"] >= stages_ms - 0.02  # redondeo a centésimas
@@ -0,0 +1,205 @@
+import asyncio
+import json
+
+import pytest
+from aiohttp import web
+
+from llm_client import (
+    CircuitBreaker,
+    CircuitOpenError,
+    ExtractionClient,
+    GeminiHttpTransport,
+    LlmError,
+    LlmTimeoutError,
+)
+
+
+INVOICE_JSON = json.dumps({
+    "numero_factura": "A-1",
+    "nombre_proveedor": "Proveedor Test",
+    "fecha_factura": "2024-01-15",
+    "monto": 1500.0
+})
+
+
+class FakeGemini:
+    """Servidor local que imita generateContent; `responses` define el comportamiento de cada petición"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = 0
+        self.client_ports = set()
+
+    async def handle(self, request):
+        self.requests += 1
+        self.client_ports.add(request.transport.get_extra_info("peername")[1])
+        body = await request.json()
+        assert body["contents"][0]["parts"][1]["inline_data"]["mime_type"] == "application/pdf"
+
+        action = self.responses.pop(0) if self.responses else "ok"
+        if action == "slow":
+            await asyncio.sleep(1)
+        if isinstance(action, int):
+            return web.json_response({"error": "fallo"}, status=action)
+        return web.json_response({"candidates": [{"content": {"parts": [{"text": INVOICE_JSON}]}}]})
+
+
+async def start_fake(fake):
+    app = web.Application()
+    app.router.add_post("/v1beta/models/{model}", fake.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def make_client(base_url, **kwargs):
+    options = dict(deadline=5.0, attempt_timeout=2.0, max_retries=3, backoff_base=0.01, backoff_max=0.05)
+    options.update(kwargs)
+    return ExtractionClient(
+        transport=GeminiHttpTransport(api_key="test", base_url=base_url),
+        model="gemini-2.0-flash",
+        system_message="test",
+        **options
+    )
+
+
+def run_with_fake(responses, scenario):
+    async def main():
+        fake = FakeGemini(responses)
+        runner, base_url = await start_fake(fake)
+        try:
+            return await scenario(fake, base_url)
+        finally:
+            await runner.cleanup()
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    path = tmp_path / "factura.pdf"
+    path.write_bytes(b"%PDF-1.4 test")
+    return str(path)
+
+
+def test_reuses_connection_across_calls(pdf_path):
+    async def scenario(fake, base_url):
+        client = make_client(base_url)
+        try:
+            for _ in range(3):
+                text = await client.extract("prompt", pdf_path)
+                assert json.loads(text)["numero_factura"] == "A-1"
+        finally:
+            await client.aclose()
+        return fake
+
+    fake = run_with_fake([], scenario)
+    assert fake.requests == 3
+    assert len(fake.client_ports) == 1
+
+
+def test_retries_transient_errors(pdf_path):
+    async def scenario(fake, base_url):
+        client = make_client(base_url)
+        try:
+            text = await client.extract("prompt", pdf_path)
+        finally:
+            await client.aclose()
+        return fake, client, text
+
+    fake, client, text = run_with_fake([503, 429], scenario)
+    assert json.loads(text)["monto"] == 1500.0
+    assert fake.requests == 3
+    assert client.stats()["intentos"] == 3
+
+
+def test_does_not_retry_client_errors(pdf_path):
+    async def scenario(fake, base_url):
+        client = make_client(base_url)
+        try:
+            with pytest.raises(LlmError) as excinfo:
+                await client.extract("prompt", pdf_path)
+        finally:
+            await client.aclose()
+        return fake, excinfo.value
+
+    fake, error = run_with_fake([400], scenario)
+    assert fake.requests == 1
+    assert not error.retryable
+
+
+def test_deadline_bounds_total_time(pdf_path):
+    async def scenario(fake, base_url):
+        client = make_client(base_url, deadline=0.5, attempt_timeout=0.3)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            with pytest.raises(LlmTimeoutError):
+                await client.extract("prompt", pdf_path)
+        finally:
+            await client.aclose()
+        return loop.time() - started
+
+    elapsed = run_with_fake(["slow", "slow", "slow", "slow"], scenario)
+    assert elapsed < 1.5
+
+
+def test_circuit_opens_and_fails_fast(pdf_path):
+    async def scenario(fake, base_url):
+        breaker = CircuitBreaker(window=10, min_calls=4, failure_threshold=0.5, cooldown=60)
+        client = make_client(base_url, max_retries=1, breaker=breaker)
+        try:
+            for _ in range(2):
+                with pytest.raises(LlmError):
+                    await client.extract("prompt", pdf_path)
+            requests_before = fake.requests
+            with pytest.raises(CircuitOpenError) as excinfo:
+                await client.extract("prompt", pdf_path)
+        finally:
+            await client.aclose()
+        return fake, requests_before, breaker, excinfo.value
+
+    fake, requests_before, breaker, error = run_with_fake([500] * 4, scenario)
+    assert breaker.state == "abierto"
+    assert fake.requests == requests_before == 4
+    assert error.retry_after > 0
+
+
+def test_client_errors_do_not_open_circuit(pdf_path):
+    async def scenario(fake, base_url):
+        breaker = CircuitBreaker(window=10, min_calls=2, failure_threshold=0.5, cooldown=60)
+        client = make_client(base_url, breaker=breaker)
+        try:
+            for _ in range(4):
+                with pytest.raises(LlmError):
+                    await client.extract("prompt", pdf_path)
+        finally:
+            await client.aclose()
+        return fake, breaker
+
+    fake, breaker = run_with_fake([400] * 4, scenario)
+    assert fake.requests == 4
+    assert breaker.state == "cerrado"
+    assert breaker.window.count(False) == 0
+
+def test_half_open_probe_closes_circuit():
+    now = [0.0]
+    breaker = CircuitBreaker(window=4, min_calls=2, failure_threshold=0.5, cooldown=10, clock=lambda: now[0])
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "abierto"
+
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    now[0] = 11.0
+    breaker.before_call()
+    assert breaker.state == "semiabierto"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == "cerrado"
+    breaker.before_call()
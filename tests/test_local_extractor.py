@@ -0,0 +1,42 @@
+from local_extractor import extract_invoice_fields
+
+
+CFDI_TEXT = """FACTURA
+Serie: A Folio: 1234
+Nombre del Emisor: Servicios Industriales del Norte SA de CV RFC: SIN010203AB1
+Receptor: Empresa Cliente SA de CV
+Fecha de emisión: 2024-03-15T10:20:30
+Subtotal: $1,000.00
+IVA: $160.00
+Total: $1,160.00
+"""
+
+
+def test_clean_cfdi_layout():
+    data, confidence = extract_invoice_fields(CFDI_TEXT)
+    assert data == {
+        "numero_factura": "A-1234",
+        "nombre_proveedor": "Servicios Industriales del Norte SA de CV",
+        "fecha_factura": "2024-03-15",
+        "monto": 1160.0,
+    }
+    assert confidence == 1.0
+
+
+def test_rfc_after_emisor_label_is_not_a_supplier_name():
+    for label in ("Emisor: RFC: XAXX010101000", "Emisor: R.F.C. XAXX010101000", "Emisor: XAXX010101000"):
+        text = f"Folio: 77\n{label}\nFecha: 2024-01-02\nTotal: $50.00\n"
+        data, confidence = extract_invoice_fields(text)
+        assert data["nombre_proveedor"] is None, label
+        assert confidence == 0.75
+
+
+def test_label_followed_by_line_break_does_not_take_next_line():
+    text = "Folio: 77\nEmisor:\nRFC: XAXX010101000\nFecha: 2024-01-02\nTotal: $50.00\n"
+    data, confidence = extract_invoice_fields(text)
+    assert data["nombre_proveedor"] is None
+    assert confidence < 1.0
+
+    # Con el nombre en la línea de otra etiqueta se usa esa
+    data, _ = extract_invoice_fields(text + "Proveedor: Papelería Central\n")
+    assert data["nombre_proveedor"] == "Papelería Central"
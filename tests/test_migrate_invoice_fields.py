@@ -0,0 +1,91 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from migrate_invoice_fields import MIGRATION_ID, migrate
+
+
+def legacy_invoices(count):
+    return [
+        {"_id": n, "id": f"f-{n}", "fecha_factura": f"2024-01-{n:02d}", "monto": n + 0.005}
+        for n in range(1, count + 1)
+    ]
+
+
+def test_resumes_from_saved_checkpoint():
+    async def run():
+        db = AsyncMongoMockClient()["test"]
+        await db.invoices.insert_many(legacy_invoices(7) + [{"_id": 8, "id": "f-8", "fecha_factura": "basura", "monto": 1}])
+        # Una ejecución anterior ya había procesado hasta el _id 3
+        await db.migrations.insert_one({"_id": MIGRATION_ID, "ultimo_id": 3, "revisados": 3, "actualizados": 3, "fechas_no_reconocidas": 0})
+        state = await migrate(db, batch_size=2, pause=0)
+        return state, await db.invoices.find().sort("_id", 1).to_list(None)
+
+    state, docs = asyncio.run(run())
+    assert state["completada"] is True
+    assert (state["revisados"], state["actualizados"], state["fechas_no_reconocidas"]) == (8, 8, 1)
+    # Los anteriores al checkpoint no se vuelven a leer
+    assert all("monto_centavos" not in doc for doc in docs[:3])
+    assert docs[3]["fecha_factura"] == datetime(2024, 1, 4)
+    assert docs[3]["monto_centavos"] == 401
+    assert docs[7]["fecha_factura"] == "basura" and docs[7]["monto_centavos"] == 100
+
+
+class FailingInvoices:
+    """Colección que falla en el bulk_write número `fail_on`, como un proceso interrumpido"""
+
+    def __init__(self, collection, fail_on):
+        self._collection = collection
+        self._calls = 0
+        self._fail_on = fail_on
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    async def bulk_write(self, operations, **kwargs):
+        self._calls += 1
+        if self._calls == self._fail_on:
+            raise ConnectionError("conexión perdida")
+        return await self._collection.bulk_write(operations, **kwargs)
+
+
+class DatabaseWithInvoices:
+    def __init__(self, db, invoices):
+        self.migrations = db.migrations
+        self.invoices = invoices
+
+
+def test_interrupted_run_continues_without_repeating_batches():
+    async def run():
+        db = AsyncMongoMockClient()["test"]
+        await db.invoices.insert_many(legacy_invoices(5))
+        interrupted = DatabaseWithInvoices(db, FailingInvoices(db.invoices, fail_on=2))
+        with pytest.raises(ConnectionError):
+            await migrate(interrupted, batch_size=2, pause=0)
+        checkpoint = await db.migrations.find_one({"_id": MIGRATION_ID})
+
+        resumed = DatabaseWithInvoices(db, FailingInvoices(db.invoices, fail_on=None))
+        state = await migrate(resumed, batch_size=2, pause=0)
+        again = await migrate(resumed, batch_size=2, pause=0)
+        return checkpoint, state, again, resumed.invoices._calls, await db.invoices.find().to_list(None)
+
+    checkpoint, state, again, calls, docs = asyncio.run(run())
+    assert checkpoint["ultimo_id"] == 2 and not checkpoint.get("completada")
+    # Reanuda desde el _id 3: dos lotes (3-4 y 5)
+    assert calls == 2
+    assert (state["revisados"], state["actualizados"]) == (5, 5)
+    assert again == state
+    assert all(isinstance(doc["fecha_factura"], datetime) for doc in docs)
+
+
+def test_restart_ignores_checkpoint():
+    async def run():
+        db = AsyncMongoMockClient()["test"]
+        await db.invoices.insert_many(legacy_invoices(3))
+        await db.migrations.insert_one({"_id": MIGRATION_ID, "completada": True, "revisados": 99})
+        return await migrate(db, batch_size=10, pause=0, restart=True)
+
+    state = asyncio.run(run())
+    assert (state["revisados"], state["actualizados"]) == (3, 3)
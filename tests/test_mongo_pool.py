@@ -0,0 +1,69 @@
+import threading
+
+import pytest
+from pymongo import monitoring
+from pymongo.read_preferences import Primary, SecondaryPreferred
+
+from mongo_pool import PoolMonitor, client_options_from_env, read_preference
+
+
+ADDRESS = ("db1", 27017)
+
+
+def test_pool_monitor_tracks_connections_and_waits():
+    monitor = PoolMonitor()
+    monitor.connection_created(monitoring.ConnectionCreatedEvent(ADDRESS, 1))
+    monitor.connection_created(monitoring.ConnectionCreatedEvent(ADDRESS, 2))
+
+    # Dos hilos esperan conexión a la vez; uno la obtiene y el otro agota el timeout
+    started = threading.Barrier(2)
+
+    def checkout(succeeds):
+        monitor.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(ADDRESS))
+        started.wait()
+        if succeeds:
+            monitor.connection_checked_out(monitoring.ConnectionCheckedOutEvent(ADDRESS, 1))
+        else:
+            monitor.connection_check_out_failed(monitoring.ConnectionCheckOutFailedEvent(ADDRESS, "timeout"))
+
+    threads = [threading.Thread(target=checkout, args=(succeeds,)) for succeeds in (True, False)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    monitor.connection_closed(monitoring.ConnectionClosedEvent(ADDRESS, 2, "idle"))
+    monitor.pool_cleared(monitoring.PoolClearedEvent(ADDRESS))
+
+    stats = monitor.stats()["servidores"]["db1:27017"]
+    assert stats["abiertas"] == 1
+    assert stats["en_uso"] == 1
+    assert stats["esperando"] == 0 and stats["max_esperando"] == 2
+    assert stats["checkouts"] == 1
+    assert stats["fallidos"] == {"timeout": 1}
+    assert stats["limpiezas"] == 1
+    assert stats["espera_max_ms"] >= stats["espera_p50_ms"] >= 0
+
+    monitor.connection_checked_in(monitoring.ConnectionCheckedInEvent(ADDRESS, 1))
+    assert monitor.stats()["servidores"]["db1:27017"]["en_uso"] == 0
+
+
+def test_read_preference_by_name():
+    assert read_preference("primary") == Primary()
+    assert read_preference("secondaryPreferred", max_staleness=120) == SecondaryPreferred(max_staleness=120)
+    with pytest.raises(ValueError, match="no soportada"):
+        read_preference("secundario")
+
+
+def test_client_options_from_env(monkeypatch):
+    for name in ("MONGO_MAX_IDLE_TIME_MS", "MONGO_WAIT_QUEUE_TIMEOUT_MS", "MONGO_SOCKET_TIMEOUT_MS", "MONGO_MIN_POOL_SIZE"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("MONGO_MAX_POOL_SIZE", "20")
+    monkeypatch.setenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000")
+    monkeypatch.setenv("MONGO_SOCKET_TIMEOUT_MS", "")
+
+    options = client_options_from_env()
+    assert options["maxPoolSize"] == 20
+    assert options["minPoolSize"] == 0
+    assert options["waitQueueTimeoutMS"] == 2000
+    # Sin variable (o vacía) se deja el valor por defecto de pymongo
+    assert "socketTimeoutMS" not in options and "maxIdleTimeMS" not in options
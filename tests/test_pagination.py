@@ -0,0 +1,64 @@
+import base64
+import json
+from datetime import datetime
+
+import pytest
+from mongomock import MongoClient
+
+from pagination import decode_cursor, encode_cursor, keyset_condition, keyset_sort
+
+
+def page_through(collection, sort_field, direction, page_size=2):
+    """Recorre la colección con cursores codificados, como lo haría un cliente de la API"""
+    seen, cursor = [], None
+    sort = f"{'-' if direction < 0 else ''}{sort_field}"
+    while True:
+        query = {}
+        if cursor:
+            value, last_id = decode_cursor(cursor, sort)
+            query = keyset_condition(sort_field, direction, value, last_id)
+        page = list(collection.find(query).sort(keyset_sort(sort_field, direction)).limit(page_size + 1))
+        seen.extend(doc["id"] for doc in page[:page_size])
+        if len(page) <= page_size:
+            return seen
+        cursor = encode_cursor(page[page_size - 1][sort_field], page[page_size - 1]["id"], sort)
+
+
+@pytest.mark.parametrize("direction", [1, -1])
+def test_keyset_paging_crosses_text_and_date_values(direction):
+    # Durante la migración fecha_factura mezcla texto y fechas BSON; "basura" nunca se migra
+    collection = MongoClient().db.invoices
+    collection.insert_many([
+        {"id": "a", "fecha_factura": "2024-01-05"},
+        {"id": "b", "fecha_factura": "basura"},
+        {"id": "c", "fecha_factura": datetime(2024, 1, 1)},
+        {"id": "d", "fecha_factura": datetime(2024, 2, 1)},
+        {"id": "e", "fecha_factura": datetime(2024, 2, 1)},
+        {"id": "f", "fecha_factura": "2023-12-31"},
+        {"id": "g", "fecha_factura": datetime(2024, 3, 1)},
+    ])
+    expected = [doc["id"] for doc in collection.find().sort(keyset_sort("fecha_factura", direction))]
+    assert page_through(collection, "fecha_factura", direction) == expected
+    assert sorted(expected) == list("abcdefg")
+
+
+@pytest.mark.parametrize("value", ["2024-01-05", datetime(2024, 1, 5, 10, 30), 1500.25, None])
+def test_cursor_round_trip(value):
+    cursor = encode_cursor(value, "id-1", "-fecha_factura")
+    assert "=" not in cursor
+    assert decode_cursor(cursor, "-fecha_factura") == (value, "id-1")
+
+
+def test_cursor_rejects_other_sort_and_garbage():
+    cursor = encode_cursor(100.0, "id-1", "monto")
+    with pytest.raises(ValueError, match="otro orden"):
+        decode_cursor(cursor, "-monto")
+    for garbage in ("no-es-base64!", encode_cursor(1, "x")[:-3], "W10"):
+        with pytest.raises(ValueError):
+            decode_cursor(garbage)
+
+
+def test_cursor_without_sort_is_rejected():
+    two_values = base64.urlsafe_b64encode(json.dumps(["2024-01-01T00:00:00+00:00", "id-1"]).encode()).decode().rstrip("=")
+    with pytest.raises(ValueError, match="Cursor inválido"):
+        decode_cursor(two_values)
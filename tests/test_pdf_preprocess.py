@@ -0,0 +1,113 @@
+import asyncio
+import os
+
+from PIL import Image
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+from pdf_preprocess import normalize_pdf_images, trim_pdf
+
+
+def make_pdf(path, texts):
+    """PDF con una página por texto, con capa de texto real (Helvetica)"""
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    }))
+    for text in texts:
+        page = writer.add_blank_page(612, 792)
+        page[NameObject("/Resources")] = DictionaryObject({NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})})
+        content = DecodedStreamObject()
+        content.set_data(f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode())
+        page[NameObject("/Contents")] = writer._add_object(content)
+    writer.write(str(path))
+    return str(path)
+
+
+def page_texts(path):
+    return [page.extract_text() for page in PdfReader(path).pages]
+
+
+def test_trim_keeps_first_pages_and_the_total_page(tmp_path):
+    src = make_pdf(tmp_path / "largo.pdf", ["Factura A-1", "Conceptos", "Conceptos 2", "Subtotal: 90.00", "Total: 100.00", "Anexo"])
+    trimmed, total_pages, sent_pages = trim_pdf(src, 2)
+    try:
+        assert (total_pages, sent_pages) == (6, 3)
+        assert page_texts(trimmed) == ["Factura A-1", "Conceptos", "Total: 100.00"]
+        assert len(PdfReader(src).pages) == 6  # el original no cambia
+    finally:
+        os.remove(trimmed)
+
+
+def test_trim_skips_short_or_unreadable_pdfs(tmp_path):
+    src = make_pdf(tmp_path / "corto.pdf", ["Factura", "Total: 1.00"])
+    assert trim_pdf(src, 2) == (None, 2, 2)
+    broken = tmp_path / "roto.pdf"
+    broken.write_bytes(b"no es un pdf")
+    assert trim_pdf(str(broken), 2) == (None, None, None)
+
+
+class PagesExtractor:
+    """Extractor de prueba: sin la página del importe el monto no aparece"""
+
+    name = "prueba"
+    cacheable = False
+    preprocess = True
+
+    def __init__(self):
+        self.pages_sent = []
+
+    async def extract(self, file_path):
+        texts = page_texts(file_path)
+        self.pages_sent.append(len(texts))
+        return {
+            "numero_factura": "A-1",
+            "nombre_proveedor": "Proveedor",
+            "fecha_factura": "2024-01-15",
+            "monto": 100.0 if any("Importe a pagar" in text for text in texts) else None,
+        }
+
+
+def test_falls_back_to_full_document_when_trimmed_pdf_misses_fields(server, tmp_path, monkeypatch):
+    # La última página no dice "Total", así que el recorte no la incluye
+    src = make_pdf(tmp_path / "factura.pdf", ["Factura A-1", "Conceptos", "Conceptos 2", "Importe a pagar 100.00"])
+    fake = PagesExtractor()
+    monkeypatch.setattr(server, "extractor", fake)
+
+    data = asyncio.run(server.extract_pdf_invoice_data(src, "hash-prueba", max_pages=2))
+    assert data["monto"] == 100.0
+    assert fake.pages_sent == [2, 4]
+    assert os.path.exists(src)
+
+
+def make_scanned_pdf(path, size, dpi):
+    """PDF de una página con una imagen RGB ruidosa a página completa, como un escaneo"""
+    image = Image.merge("RGB", [Image.effect_noise(size, 40) for _ in range(3)])
+    image.save(str(path), "PDF", resolution=dpi)
+    return str(path)
+
+
+def test_normalize_downscales_oversized_images(tmp_path):
+    # Carta a 200 dpi: 1700x2200 px en 8.5x11 pulgadas
+    src = make_scanned_pdf(tmp_path / "escaneo.pdf", (1700, 2200), 200)
+    normalized, original_size, normalized_size = normalize_pdf_images(src, 72)
+    try:
+        assert normalized is not None
+        assert normalized_size < original_size == os.path.getsize(src)
+        assert normalized_size == os.path.getsize(normalized)
+        page = PdfReader(normalized).pages[0]
+        images = [image_file.image for image_file in page.images]
+        assert len(images) == 1
+        assert images[0].width <= 8.5 * 72 + 1 and images[0].height <= 11 * 72 + 1
+    finally:
+        if normalized:
+            os.remove(normalized)
+
+
+def test_normalize_leaves_pdfs_without_images_unchanged(tmp_path):
+    src = make_pdf(tmp_path / "texto.pdf", ["Factura A-1", "Total: 100.00"])
+    size = os.path.getsize(src)
+    assert normalize_pdf_images(src, 72) == (None, size, size)
+    assert os.path.getsize(src) == size
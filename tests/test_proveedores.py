@@ -0,0 +1,17 @@
+def test_suggest_matches_prefix_without_accents(api, admin_headers, empresa_id, insert_invoices):
+    insert_invoices({"nombre_proveedor": "Papelería Águila"}, {"nombre_proveedor": "Transportes del Norte"})
+
+    response = api.get("/api/proveedores/suggest", params={"empresa_id": empresa_id, "q": "PAPEL"}, headers=admin_headers)
+    assert response.status_code == 200
+    assert response.json() == [{"nombre_proveedor": "Papelería Águila", "facturas": 1}]
+
+
+def test_suggest_rejects_unknown_or_deleted_empresa(api, admin_headers, empresa_id, insert_invoices):
+    insert_invoices({"nombre_proveedor": "Papelería Águila"})
+
+    unknown = api.get("/api/proveedores/suggest", params={"empresa_id": "no-existe", "q": "pap"}, headers=admin_headers)
+    assert unknown.status_code == 404
+
+    assert api.delete(f"/api/empresas/{empresa_id}", headers=admin_headers).status_code == 200
+    deleted = api.get("/api/proveedores/suggest", params={"empresa_id": empresa_id, "q": "pap"}, headers=admin_headers)
+    assert deleted.status_code == 404
@@ -0,0 +1,114 @@
+import asyncio
+import socket
+import time
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from llm_client import ExtractionClient, GeminiHttpTransport, LlmError
+from rate_limiter import MongoRateLimiter, RateLimitTimeout
+
+
+def collection():
+    return AsyncMongoMockClient()["test"]["llm_rate_limits"]
+
+
+def test_allows_burst_up_to_capacity_then_refills_gradually():
+    async def run():
+        limiter = MongoRateLimiter(collection(), rpm=3, window_seconds=0.6)
+        burst = [await limiter.acquire() for _ in range(3)]
+        started = time.monotonic()
+        await limiter.acquire()
+        return burst, time.monotonic() - started, limiter.stats()
+
+    burst, waited, stats = asyncio.run(run())
+    assert max(burst) < 0.05
+    # Una petición se rellena en 0.6 / 3 = 0.2s (más hasta 0.25s de jitter), no al final de la ventana
+    assert 0.15 <= waited < 0.5
+    assert stats["reservas"] == 4 and stats["esperas"] == 1
+
+
+def test_token_limit_and_charged_response_tokens():
+    async def run():
+        limiter = MongoRateLimiter(collection(), rpm=0, tpm=1000, window_seconds=60)
+        await limiter.acquire(tokens=600)
+        await limiter.acquire(tokens=400)
+        with pytest.raises(RateLimitTimeout):
+            await limiter.acquire(tokens=50, timeout=0.5)
+        # Los tokens de la respuesta se descuentan después: el saldo queda negativo
+        await limiter.add_tokens(200)
+        return await limiter.collection.find_one({"_id": "llm"})
+
+    bucket = asyncio.run(run())
+    assert bucket["tokens"] < -150
+
+
+def test_wait_with_timeout_raises_without_reserving():
+    async def run():
+        limiter = MongoRateLimiter(collection(), rpm=1, window_seconds=60)
+        await limiter.acquire()
+        started = time.monotonic()
+        with pytest.raises(RateLimitTimeout):
+            await limiter.acquire(timeout=1)
+        return time.monotonic() - started, limiter.stats()
+
+    elapsed, stats = asyncio.run(run())
+    # Con 60s para la próxima petición no tiene sentido dormir: falla de inmediato
+    assert elapsed < 0.2
+    assert stats["reservas"] == 1
+
+
+def test_bucket_is_shared_between_workers():
+    async def run():
+        shared = collection()
+        worker_a = MongoRateLimiter(shared, rpm=2, window_seconds=60)
+        worker_b = MongoRateLimiter(shared, rpm=2, window_seconds=60)
+        await worker_a.acquire()
+        await worker_b.acquire()
+        with pytest.raises(RateLimitTimeout):
+            await worker_a.acquire(timeout=0.5)
+
+    asyncio.run(run())
+
+
+def test_refund_returns_the_reservation():
+    async def run():
+        limiter = MongoRateLimiter(collection(), rpm=1, tpm=1000, window_seconds=60)
+        await limiter.acquire(tokens=1000)
+        await limiter.refund(tokens=1000)
+        waited = await limiter.acquire(tokens=1000, timeout=0.5)
+        return waited, limiter.stats()
+
+    waited, stats = asyncio.run(run())
+    assert waited < 0.05
+    assert stats["reembolsos"] == 1
+
+
+def test_client_refunds_quota_when_request_never_left(tmp_path):
+    # Puerto cerrado: la conexión falla antes de enviar nada al proveedor
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    pdf_path = tmp_path / "factura.pdf"
+    pdf_path.write_bytes(b"%PDF-1.4 test")
+
+    async def run():
+        limiter = MongoRateLimiter(collection(), rpm=1, window_seconds=60)
+        client = ExtractionClient(
+            transport=GeminiHttpTransport(api_key="test", base_url=f"http://127.0.0.1:{port}"),
+            model="gemini-2.0-flash",
+            system_message="test",
+            deadline=5.0, attempt_timeout=1.0, max_retries=2, backoff_base=0.01, backoff_max=0.05,
+            rate_limiter=limiter
+        )
+        try:
+            with pytest.raises(LlmError) as excinfo:
+                await client.extract("prompt", str(pdf_path))
+        finally:
+            await client.aclose()
+        return excinfo.value, limiter.stats()
+
+    error, stats = asyncio.run(run())
+    # Sin reembolso, el segundo intento se quedaría sin cupo (1 por minuto)
+    assert "No se pudo conectar" in str(error)
+    assert stats["reservas"] == 3 and stats["reembolsos"] == 3
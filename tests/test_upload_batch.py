@@ -0,0 +1,59 @@
+import asyncio
+import io
+import json
+import os
+
+from fastapi import UploadFile
+
+
+def pdf(name):
+    return UploadFile(file=io.BytesIO(b"%PDF-1.4 factura " + name.encode()), filename=name)
+
+
+def test_batch_streams_one_line_per_file_and_inserts(server, api, admin_headers, empresa_id):
+    files = [
+        ("files", ("a.pdf", b"%PDF-1.4 a", "application/pdf")),
+        ("files", ("b.pdf", b"%PDF-1.4 b", "application/pdf")),
+        ("files", ("notas.txt", b"texto", "text/plain")),
+    ]
+    response = api.post(f"/api/upload-pdf-batch/{empresa_id}", files=files, headers=admin_headers)
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert sorted(line["archivo"] for line in lines[:-1]) == ["a.pdf", "b.pdf", "notas.txt"]
+    assert lines[-1] == {"resumen": True, "total": 3, "insertadas": 2, "errores": 1}
+    assert asyncio.run(server.db.invoices.count_documents({"empresa_id": empresa_id})) == 2
+
+
+def test_batch_inserts_even_if_client_disconnects(server, api, empresa_id):
+    async def run():
+        empresa = await server.empresa_cache.get(empresa_id)
+        response = await server.upload_pdf_batch(
+            empresa_id, files=[pdf("c.pdf"), pdf("d.pdf"), pdf("e.pdf")], current_user=None, empresa=empresa
+        )
+        # El cliente lee la primera línea y cierra la conexión
+        body = response.body_iterator
+        await body.__anext__()
+        await body.aclose()
+        await asyncio.gather(*server.batch_tasks)
+        return await server.db.invoices.count_documents({"empresa_id": empresa_id})
+
+    assert asyncio.run(run()) == 3
+
+
+def test_failed_inserts_delete_their_pdf(server):
+    async def run():
+        await server.db.invoices.create_index("id", unique=True)
+        await server.db.invoices.insert_one({"id": "duplicada"})
+        invoices = []
+        for invoice_id in ("duplicada", "nueva"):
+            filename = f"{invoice_id}.pdf"
+            with open(os.path.join(server.UPLOAD_DIR, filename), "wb") as f:
+                f.write(b"%PDF-1.4")
+            invoices.append({"id": invoice_id, "archivo_pdf": filename})
+        return await server.insert_batch_invoices(invoices)
+
+    resumen = asyncio.run(run())
+    assert resumen["insertadas"] == 1 and "error" in resumen
+    assert not os.path.exists(os.path.join(server.UPLOAD_DIR, "duplicada.pdf"))
+    assert os.path.exists(os.path.join(server.UPLOAD_DIR, "nueva.pdf"))